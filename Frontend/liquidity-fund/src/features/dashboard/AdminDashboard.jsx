@@ -6,7 +6,7 @@ import {
 } from 'lucide-react';
 import { motion } from 'framer-motion';
 import { PieChart, Pie, Cell, ResponsiveContainer, Legend, Tooltip } from 'recharts';
-import { API_BASE_URL } from '../../lib/api';
+import { API_BASE_URL, apiFetchAllPages } from '../../lib/api';
 import Contact from '../../components/Contact';
 
 
@@ -540,15 +540,10 @@ const AdminDashboard = () => {
       return;
     }
     try {
-      const res = await fetch(`${API_BASE_URL}/api/rentals/admin/active/`, {
-        headers: {
-          'Authorization': `Bearer ${token}`,
-          'Content-Type': 'application/json'
-        }
-      });
-      if (res.ok) {
-        const data = await res.json();
-        setActiveRentals(data.active_rentals || []);
+      // Follow next_cursor so each request reads one bounded page
+      const { response: res, data } = await apiFetchAllPages('/api/rentals/admin/active/', 'active_rentals');
+      if (data) {
+        setActiveRentals(data.active_rentals);
         setActiveRentalsSummary(data.summary || {});
       } else if (res.status === 403) {
         console.error('Access denied: Admin privileges required');
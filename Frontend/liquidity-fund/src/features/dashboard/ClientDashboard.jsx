@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from "react";
 import Contact from "../../components/Contact";
 import { Link } from 'react-router-dom';
-import { API_BASE_URL } from "../../lib/api";
+import { API_BASE_URL, apiFetchAllPages } from "../../lib/api";
 import toast from "react-hot-toast";
 import { LayoutDashboard } from "lucide-react";
 import { Wallet } from "lucide-react";
@@ -97,15 +97,10 @@ const ClientDashboard = () => {
 
   const fetchUserRentals = async () => {
     try {
-      const response = await fetch(`${API_BASE_URL}/api/rentals/user-rentals/`, {
-        headers: {
-          'Authorization': `Bearer ${token}`,
-          'Content-Type': 'application/json'
-        }
-      });
-      if (response.ok) {
-        const data = await response.json();
-        setActiveRentals(data.rentals || []);
+      // Follow next_cursor so each request reads one bounded page
+      const { data } = await apiFetchAllPages('/api/rentals/user-rentals/', 'rentals');
+      if (data) {
+        setActiveRentals(data.rentals);
       }
     } catch (error) {
       console.error('Failed to fetch user rentals:', error);
@@ -181,32 +176,36 @@ const ClientDashboard = () => {
       const mpesaResult = await initiateMpesaPayment(phoneNumber, selectedCurrency.code);
       setPaymentStatus('Check your phone for M-Pesa prompt...');
 
-      const initialBalance = balance;
+      // The STK push is queued server-side; poll its tracking id until the
+      // callback has been settled.
       let attempts = 0;
       const pollInterval = setInterval(async () => {
         attempts++;
-        await fetchBalance();
-        if (balance !== initialBalance) {
-          clearInterval(pollInterval);
-          await fetchUserRentals();
-          
-          const expectedBalanceChange = -selectedCurrency.price;
-          const actualBalanceChange = balance - initialBalance;
-          
-          if (actualBalanceChange < expectedBalanceChange) {
-            const estimatedReward = Math.abs(actualBalanceChange - expectedBalanceChange) / 2;
-            showReferralReward(estimatedReward);
+        try {
+          const statusResponse = await apiCall(`/mpesa/status/${mpesaResult.tracking_id}/`);
+          const statusData = statusResponse.ok ? await statusResponse.json() : null;
+
+          if (statusData?.payment_status === 'completed') {
+            clearInterval(pollInterval);
+            await fetchBalance();
+            await fetchUserRentals();
+
+            setShowPaymentModal(false);
+            setActiveTab('rentals');
+            setPaymentStatus('');
+            setPhoneNumber('');
+            setIsLoading(false);
+          } else if (statusData?.payment_status === 'failed') {
+            clearInterval(pollInterval);
+            setPaymentStatus('Payment failed: ' + (statusData.error || 'transaction was not completed'));
+            setIsLoading(false);
+          } else if (attempts > 60) {
+            clearInterval(pollInterval);
+            setPaymentStatus('Payment timeout. Please try again.');
+            setIsLoading(false);
           }
-          
-          setShowPaymentModal(false);
-          setActiveTab('rentals');
-          setPaymentStatus('');
-          setPhoneNumber('');
-          setIsLoading(false);
-        } else if (attempts > 60) {
-          clearInterval(pollInterval);
-          setPaymentStatus('Payment timeout. Please try again.');
-          setIsLoading(false);
+        } catch (error) {
+          console.error('Failed to fetch payment status:', error);
         }
       }, 1000);
 
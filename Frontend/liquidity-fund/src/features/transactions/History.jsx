@@ -1,13 +1,34 @@
 
 import React, { useEffect, useState } from 'react';
-import { API_BASE_URL } from '../../lib/api';
+import { API_BASE_URL, apiFetchPage } from '../../lib/api';
 import { Loader } from 'lucide-react';
 
+// Payments as history rows (failed transactions excluded)
+const toPaymentTransactions = (payments) => (payments || [])
+  .filter(payment => payment.status !== 'failed')
+  .map(payment => ({
+    id: `payment-${payment.id}`,
+    type: 'Rental',
+    amount: payment.amount_deducted,
+    date: new Date(payment.created_at).toLocaleDateString(),
+    method: 'M-Pesa',
+    status: payment.status,
+    currency: payment.currency,
+    details: `${payment.currency} rental`
+  }));
+
 const History = () => {
-  const [transactions, setTransactions] = useState([]);
+  const [paymentTransactions, setPaymentTransactions] = useState([]);
+  const [withdrawalTransactions, setWithdrawalTransactions] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState('');
 
+  // Combine and sort by date (newest first)
+  const transactions = [...paymentTransactions, ...withdrawalTransactions]
+    .sort((a, b) => new Date(b.date) - new Date(a.date));
+
   const fetchTransactionHistory = async () => {
     try {
       setLoading(true);
@@ -15,13 +36,8 @@ const History = () => {
       
       const token = localStorage.getItem('access');
       
-      // Fetch payment history (rentals/deposits)
-      const paymentsResponse = await fetch(`${API_BASE_URL}/api/payments/history/`, {
-        headers: {
-          'Authorization': `Bearer ${token}`,
-          'Content-Type': 'application/json'
-        }
-      });
+      // Fetch the first page of payment history (rentals/deposits)
+      const paymentsResponse = await apiFetchPage('/api/payments/history/');
 
 
       // Fetch withdrawal history
@@ -44,22 +60,8 @@ const History = () => {
       const withdrawalsData = await withdrawalsResponse.json();
 
 
-      // Process payments data (exclude failed transactions)
-      const paymentTransactions = paymentsData.payments
-        ?.filter(payment => payment.status !== 'failed') // Exclude failed transactions
-        .map(payment => ({
-          id: `payment-${payment.id}`,
-          type: 'Rental',
-          amount: payment.amount_deducted,
-          date: new Date(payment.created_at).toLocaleDateString(),
-          method: 'M-Pesa',
-          status: payment.status,
-          currency: payment.currency,
-          details: `${payment.currency} rental`
-        })) || [];
-
       // Process withdrawals data (exclude failed transactions)
-      const withdrawalTransactions = withdrawalsData
+      const withdrawalRows = withdrawalsData
         .filter(withdrawal => withdrawal.status !== 'failed') // Exclude failed transactions
         .map(withdrawal => ({
           id: `withdrawal-${withdrawal.id}`,
@@ -71,11 +73,9 @@ const History = () => {
           details: `Withdrawal request`
         })) || [];
 
-      // Combine and sort by date (newest first)
-      const allTransactions = [...paymentTransactions, ...withdrawalTransactions]
-        .sort((a, b) => new Date(b.date) - new Date(a.date));
-
-      setTransactions(allTransactions);
+      setPaymentTransactions(toPaymentTransactions(paymentsData.payments));
+      setNextCursor(paymentsData.next_cursor || null);
+      setWithdrawalTransactions(withdrawalRows);
     } catch (error) {
       console.error('Error fetching transaction history:', error);
       setError('Failed to load transaction history. Please try again.');
@@ -84,6 +84,25 @@ const History = () => {
     }
   };
 
+  // Fetch the next page of payments and append it
+  const loadMorePayments = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await apiFetchPage('/api/payments/history/', { cursor: nextCursor });
+      if (!response.ok) {
+        throw new Error('Failed to fetch payment history');
+      }
+      const data = await response.json();
+      setPaymentTransactions(current => [...current, ...toPaymentTransactions(data.payments)]);
+      setNextCursor(data.next_cursor || null);
+    } catch (error) {
+      console.error('Error fetching more payments:', error);
+      setError('Failed to load transaction history. Please try again.');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     fetchTransactionHistory();
   }, []);
@@ -193,6 +212,17 @@ const History = () => {
                 ))}
               </tbody>
             </table>
+            {nextCursor && (
+              <div className="flex justify-center mt-6">
+                <button
+                  onClick={loadMorePayments}
+                  disabled={loadingMore}
+                  className="px-6 py-3 bg-[#0F5D4E] text-white rounded-xl font-medium hover:bg-[#0A3D32] transition-all disabled:opacity-50"
+                >
+                  {loadingMore ? 'Loading...' : 'Load more'}
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
@@ -11,3 +11,30 @@ export const apiFetch = (url, options = {}) => {
   };
   return fetch(`${API_BASE_URL}${url}`, { ...options, headers });
 };
+
+// Rows per request for keyset-paged list endpoints (the backend caps this at 200)
+export const PAGE_LIMIT = 50;
+
+// One page of a keyset-paged list; pass the previous page's next_cursor to continue
+export const apiFetchPage = (url, { limit = PAGE_LIMIT, cursor, ...options } = {}) => {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (cursor) params.set('cursor', cursor);
+  return apiFetch(`${url}${url.includes('?') ? '&' : '?'}${params}`, options);
+};
+
+// Every row of a keyset-paged list, following next_cursor one bounded page
+// at a time. Returns the last response and the first page's data with
+// `key` holding all rows, or data null if a request failed.
+export const apiFetchAllPages = async (url, key, { limit = 200, ...options } = {}) => {
+  let data = null;
+  let cursor = null;
+  let response;
+  do {
+    response = await apiFetchPage(url, { limit, cursor, ...options });
+    if (!response.ok) return { response, data: null };
+    const page = await response.json();
+    data = data ? { ...data, [key]: [...data[key], ...(page[key] || [])] } : { ...page, [key]: page[key] || [] };
+    cursor = page.next_cursor;
+  } while (cursor);
+  return { response, data: { ...data, next_cursor: null } };
+};
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
-import { apiFetch } from '../lib/api';
+import { apiFetch, apiFetchAllPages } from '../lib/api';
 
 function formatDate(dateStr) {
   const d = new Date(dateStr);
@@ -35,9 +35,9 @@ const Home = () => {
           setProfile(profileData);
         }
 
-        const paymentsResponse = await apiFetch('/api/payments/history/');
-        const paymentsData = await paymentsResponse.json();
-        const formattedTransactions = paymentsData.payments.map(payment => ({
+        // The earnings graph needs every deposit, read one bounded page at a time
+        const { data: paymentsData } = await apiFetchAllPages('/api/payments/history/', 'payments');
+        const formattedTransactions = (paymentsData?.payments || []).map(payment => ({
           id: payment.id,
           type: payment.amount_deducted > 0 ? 'Deposit' : 'Withdraw',
           amount: Math.abs(payment.amount_deducted),
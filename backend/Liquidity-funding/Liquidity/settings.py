@@ -198,11 +198,14 @@ FRONTEND_URL = config("FRONTEND_URL", default="https://front.liquiinvestke.co.ke
 # ------------------------------------------------------------
 # M-PESA CONFIG
 MPESA_ENV = config("MPESA_ENV", default="production")
-MPESA_BASE_URL = (
-    "https://sandbox.safaricom.co.ke"
-    if MPESA_ENV == "sandbox"
-    else "https://api.safaricom.co.ke"
-)
+MPESA_BASE_URL = config(
+    "MPESA_BASE_URL",  # e.g. http://127.0.0.1:8090 for the local daraja_simulator
+    default=(
+        "https://sandbox.safaricom.co.ke"
+        if MPESA_ENV == "sandbox"
+        else "https://api.safaricom.co.ke"
+    ),
+).rstrip("/")
 MPESA_CONSUMER_KEY = config("MPESA_CONSUMER_KEY")
 MPESA_CONSUMER_SECRET = config("MPESA_CONSUMER_SECRET")
 MPESA_SHORTCODE = config("MPESA_SHORTCODE")
@@ -215,12 +218,58 @@ MPESA_BASE64_ENCODED_CREDENTIALS = base64.b64encode(
     f"{MPESA_CONSUMER_KEY}:{MPESA_CONSUMER_SECRET}".encode()
 ).decode()
 
+# Daraja HTTP client (see payment/mpesa.py)
+MPESA_HTTP_POOL_SIZE = config("MPESA_HTTP_POOL_SIZE", default=10, cast=int)
+MPESA_HTTP_MAX_RETRIES = config("MPESA_HTTP_MAX_RETRIES", default=2, cast=int)  # idempotent calls only
+
+# STK push queue (see payment/jobs.py and the process_stk_pushes command)
+STK_PUSH_MAX_ATTEMPTS = config("STK_PUSH_MAX_ATTEMPTS", default=3, cast=int)
+STK_PUSH_CLAIM_TIMEOUT = config("STK_PUSH_CLAIM_TIMEOUT", default=120, cast=int)  # seconds
+
+# Callback inbox retries (see drain_callback_inbox in payment/settlement.py)
+MPESA_CALLBACK_MAX_ATTEMPTS = config("MPESA_CALLBACK_MAX_ATTEMPTS", default=5, cast=int)
+MPESA_CALLBACK_RETRY_DELAY = config("MPESA_CALLBACK_RETRY_DELAY", default=30, cast=int)  # seconds, doubled per attempt
+
 # Note: For production, generate timestamp dynamically in your views/functions
 MPESA_TIMESTAMP = datetime.now().strftime("%Y%m%d%H%M%S")
 MPESA_PASSWORD = base64.b64encode(
     f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{MPESA_TIMESTAMP}".encode()
 ).decode()
 
+# ------------------------------------------------------------
+# CACHES
+# "mpesa" is file-backed so every Passenger worker shares one OAuth token.
+# "wallets" is file-backed so a balance change invalidates every worker; the
+# admin payments summary is cached there too.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "mpesa": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": config("MPESA_CACHE_DIR", default=str(BASE_DIR / ".cache" / "mpesa")),
+    },
+    "wallets": {
+        # Checks its size once a minute rather than listing the directory on every write
+        "BACKEND": "payment.caches.ThrottledCullFileCache",
+        "LOCATION": config("WALLET_CACHE_DIR", default=str(BASE_DIR / ".cache" / "wallets")),
+        "OPTIONS": {"MAX_ENTRIES": 15000, "CULL_INTERVAL": 60},  # Balances, their version and the next rental end date per active user
+    },
+}
+
+# ------------------------------------------------------------
+# SYSTEM SETTINGS CACHE
+# Seconds a worker process keeps SystemSettings (maintenance mode) in memory
+# before re-reading it. Writes in the same process invalidate immediately.
+SYSTEM_SETTINGS_CACHE_TTL = config("SYSTEM_SETTINGS_CACHE_TTL", default=30, cast=int)
+
+# Seconds the admin payments overview reuses its per-currency totals
+PAYMENTS_SUMMARY_CACHE_TTL = config("PAYMENTS_SUMMARY_CACHE_TTL", default=30, cast=int)
+
+# Upper bound on how long a cached wallet balance lives; every posting
+# already invalidates it when its transaction commits
+WALLET_BALANCE_CACHE_TTL = config("WALLET_BALANCE_CACHE_TTL", default=300, cast=int)
+
 # ------------------------------------------------------------
 # LOGGING
 LOGGING = {
@@ -35,6 +35,7 @@ class CustomUserAdmin(UserAdmin):
         "referred_by__email",   # ✅ allow searching by referrer’s email
     )
     ordering = ("-date_joined",)
+    readonly_fields = ("wallet_balance",)  # Changed only through WalletService
 
     # Add referral info section in user detail
     fieldsets = (
@@ -76,6 +77,12 @@ class CustomUserAdmin(UserAdmin):
     referred_by_email.admin_order_field = "referred_by"
     referred_by_email.short_description = "Referred By"
 
+    def wallet_balance(self, obj):
+        """Show the available wallet balance (read-only)."""
+        wallet = getattr(obj, "wallet", None)
+        return wallet.balance if wallet else "-"
+    wallet_balance.short_description = "Wallet Balance"
+
     def referral_count(self, obj):
         """Show how many users this person referred."""
         return obj.referrals.count()
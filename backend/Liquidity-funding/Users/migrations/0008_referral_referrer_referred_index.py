@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Users', '0007_remove_customuser_wallet_balance_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='referral',
+            index=models.Index(fields=['referrer', 'referred'], name='Users_refer_referre_7f40d4_idx'),
+        ),
+    ]
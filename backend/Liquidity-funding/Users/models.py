@@ -121,6 +121,9 @@ class Referral(models.Model):
 
     class Meta:
         unique_together = ("referrer", "referred_email")
+        indexes = [
+            models.Index(fields=["referrer", "referred"]),
+        ]
 
     def __str__(self):
         return f"{self.referrer.email} referred {self.referred_email}"
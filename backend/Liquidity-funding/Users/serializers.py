@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
@@ -50,10 +52,9 @@ class UserSerializer(serializers.ModelSerializer):
         return ""
 
     def get_wallet_balance(self, obj):
-        try:
-            return obj.wallet.balance
-        except:
-            return 0.00
+        # The wallet row itself (select_related in list views), not a cache lookup per user
+        wallet = getattr(obj, "wallet", None)
+        return wallet.balance if wallet else Decimal("0.00")
 
 
 # -----------------------
@@ -185,6 +186,7 @@ class KYCProfileSerializer(serializers.ModelSerializer):
 # -----------------------
 class UserProfileSerializer(serializers.ModelSerializer):
     kyc = serializers.SerializerMethodField()
+    wallet_balance = serializers.SerializerMethodField()
 
     class Meta:
         model = CustomUser
@@ -195,3 +197,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
         if kyc:
             return KYCProfileSerializer(kyc).data
         return None
+
+    def get_wallet_balance(self, obj):
+        # The wallet row itself (select_related in list views), not a cache lookup per user
+        wallet = getattr(obj, "wallet", None)
+        return wallet.balance if wallet else Decimal("0.00")
@@ -1,3 +1,47 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from payment.tests import LOCMEM_CACHES
+from payment.wallets import WalletService
+from .models import CustomUser, KYCProfile
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AdminAwardWalletTests(TransactionTestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(email="admin@example.com", full_name="Admin", password="Secret123!")
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        WalletService.credit(self.user, 100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def award(self, amount):
+        return self.client.post(f"/api/auth/users/{self.user.id}/award-wallet/", {"amount": amount}, format="json")
+
+    def test_award_credits_the_wallet(self):
+        response = self.award("50")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(WalletService.balances(self.user), (150, 0))
+        self.assertTrue(KYCProfile.objects.get(user=self.user).is_verified)
+
+    def test_award_that_would_overdraw_is_rejected(self):
+        response = self.award("-500")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.data)
+        self.assertEqual(WalletService.balances(self.user), (100, 0))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserListViewTests(TransactionTestCase):
+    def test_balances_come_from_one_query(self):
+        admin = CustomUser.objects.create_superuser(email="admin@example.com", full_name="Admin", password="Secret123!")
+        for i in range(5):
+            WalletService.credit(CustomUser.objects.create_user(email=f"user{i}@example.com", full_name="User", password="Secret123!"), i)
+        client = APIClient()
+        client.force_authenticate(admin)
+        with self.assertNumQueries(1):
+            response = client.get("/api/auth/users/")
+        balances = {row["email"]: row["wallet_balance"] for row in response.data}
+        self.assertEqual(balances["user3@example.com"], Decimal("3.00"))
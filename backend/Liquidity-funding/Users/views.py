@@ -28,6 +28,9 @@ from django.db.models import Count
 # -----------------------
 logger = logging.getLogger(__name__)
 
+# Keep-alive session reused for Google token verification
+google_session = requests.Session()
+
 User = get_user_model()
 token_generator = PasswordResetTokenGenerator()
 
@@ -156,8 +159,8 @@ class GoogleLoginView(APIView):
             return Response({"detail": "Google token is required."}, status=400)
 
         try:
-            google_url = f"https://oauth2.googleapis.com/tokeninfo?id_token={token}"
-            resp = requests.get(google_url)
+            google_url = "https://oauth2.googleapis.com/tokeninfo"
+            resp = google_session.get(google_url, params={"id_token": token}, timeout=(3.05, 10))
             if resp.status_code != 200:
                 return Response({"detail": "Invalid Google token."}, status=400)
 
@@ -335,7 +338,7 @@ class UserListView(APIView):
 
     def get(self, request):
         from .serializers import UserSerializer
-        users = CustomUser.objects.all()
+        users = CustomUser.objects.select_related("wallet")
         serializer = UserSerializer(users, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -525,19 +528,15 @@ from rest_framework.response import Response
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
 def admin_award_wallet(request, user_id):
-    from payment.models import Wallet
-    from decimal import Decimal
+    from payment.wallets import WalletService
     amount = request.data.get('amount', 0)
     try:
         user = CustomUser.objects.get(pk=user_id)
-        # Update the user's wallet_balance field directly
-        user.wallet_balance += Decimal(str(amount))
-        user.save()
-        
-        # Also update the Wallet model if it exists
-        wallet, _ = Wallet.objects.get_or_create(user=user)
-        wallet.balance += Decimal(str(amount))
-        wallet.save()
+        # Credit the wallet through the ledger; a negative award that would
+        # overdraw the wallet is rejected and nothing changes
+        if not WalletService.credit(user, amount, "admin_award", reference=f"admin:{request.user.id}"):
+            return Response({"error": "Award would overdraw the wallet; nothing was changed."}, status=400)
+        balance, _ = WalletService.balances(user)
         
         # Auto-verify KYC for the user
         try:
@@ -560,7 +559,7 @@ def admin_award_wallet(request, user_id):
             kyc_message = f" KYC profile created and verified for {user.email}."
         
         return Response({
-            "message": f"Wallet updated for {user.email}. New balance: {user.wallet_balance}.{kyc_message}"
+            "message": f"Wallet updated for {user.email}. New balance: {balance}.{kyc_message}"
         }, status=200)
     except CustomUser.DoesNotExist:
         return Response({"error": "User not found."}, status=404)
@@ -1,18 +1,19 @@
 # payments/admin.py
 from django.contrib import admin
-from .models import Wallet, Payment, MpesaTransactionMapping
+from .models import Wallet, Payment, MpesaTransactionMapping, StkPushJob, MpesaCallback, LedgerEntry
 
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
     """
     Admin configuration for the Wallet model.
-    Displays user, balance, and last update info.
+    Displays user, balance, and last update info. Balances are projections
+    of the ledger and are read-only here.
     """
-    list_display = ("user", "balance", "last_updated")
+    list_display = ("user", "balance", "rental_balance", "last_updated")
     list_filter = ("last_updated",)
     search_fields = ("user__email", "user__username")
-    readonly_fields = ("last_updated",)
+    readonly_fields = ("balance", "rental_balance", "last_updated")
     ordering = ("-last_updated",)
     list_per_page = 25  # ✅ Pagination for performance
 
@@ -60,3 +61,53 @@ class MpesaTransactionMappingAdmin(admin.ModelAdmin):
         deleted_count, _ = queryset.filter(expires_at__lt=timezone.now()).delete()
         self.message_user(request, f"{deleted_count} expired mappings deleted.")
     delete_expired.short_description = "Delete expired mappings"
+
+
+@admin.register(StkPushJob)
+class StkPushJobAdmin(admin.ModelAdmin):
+    """
+    Admin configuration for queued STK pushes.
+    Shows delivery status and the last Daraja error per job.
+    """
+    list_display = ("tracking_id", "payment", "phone_number", "status", "attempts", "response_code", "created_at")
+    list_filter = ("status", "created_at")
+    search_fields = ("tracking_id", "phone_number", "payment__user__email", "payment__checkout_request_id")
+    readonly_fields = ("tracking_id", "claim_token", "claimed_at", "created_at", "updated_at")
+    ordering = ("-created_at",)
+    list_per_page = 50
+
+
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    """
+    Admin configuration for the M-PESA callback inbox.
+    Read-only view of raw callbacks and their settlement outcome.
+    """
+    list_display = ("id", "received_at", "processed_at", "outcome", "attempts", "detail")
+    list_filter = ("outcome", "received_at")
+    search_fields = ("raw_body",)
+    readonly_fields = ("raw_body", "received_at", "processed_at", "outcome", "detail", "attempts", "last_error", "next_attempt_at")
+    ordering = ("-id",)
+    list_per_page = 50
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """
+    Read-only view of the wallet ledger.
+    Entries are append-only; corrections are made with new postings.
+    """
+    list_display = ("id", "user", "entry_type", "from_account", "to_account", "amount", "reference", "created_at")
+    list_filter = ("entry_type", "created_at")
+    search_fields = ("user__email", "reference")
+    ordering = ("-id",)
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
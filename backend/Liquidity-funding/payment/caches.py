@@ -0,0 +1,28 @@
+# payments/caches.py
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class ThrottledCullFileCache(FileBasedCache):
+    """
+    FileBasedCache that checks its size at most once per CULL_INTERVAL
+    seconds (OPTIONS, default 60) instead of on every set().
+
+    The stock backend lists the whole cache directory on each write to
+    decide whether to cull, which turns a batch of balance invalidations
+    into one directory scan per user. Between checks the directory may
+    grow past MAX_ENTRIES by the entries written in one interval.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_interval = params.get("OPTIONS", {}).get("CULL_INTERVAL", 60)
+        self._next_cull = 0.0
+
+    def _cull(self):
+        now = time.monotonic()
+        if now < self._next_cull:
+            return
+        self._next_cull = now + self._cull_interval
+        super()._cull()
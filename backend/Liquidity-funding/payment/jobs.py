@@ -0,0 +1,188 @@
+# payments/jobs.py
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from urllib3.exceptions import NewConnectionError
+
+from .models import Payment, StkPushJob, record_mpesa_mapping
+from .mpesa import send_stk_push
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------#
+# Enqueue
+# ---------------------------#
+def enqueue_stk_push(user, currency, amount, phone):
+    """Persist a pending Payment and queue its STK push. Returns the job."""
+    with transaction.atomic():
+        payment = Payment.objects.create(
+            user=user,
+            currency=currency,
+            amount_deducted=amount,
+            status="pending",
+        )
+        job = StkPushJob.objects.create(payment=payment, phone_number=phone)
+    logger.info(f"Queued STK push {job.tracking_id} for payment {payment.id}")
+    return job
+
+
+# ---------------------------#
+# Claim
+# ---------------------------#
+def expire_stale_claims(now=None):
+    """
+    Give up on jobs stuck in "sending" longer than STK_PUSH_CLAIM_TIMEOUT
+    (a worker died mid-send). The push may already have reached the
+    customer, so they are marked "unknown" rather than sent again; their
+    payments stay pending for the callback to settle. Returns the count.
+    """
+    now = now or timezone.now()
+    timeout = timedelta(seconds=getattr(settings, "STK_PUSH_CLAIM_TIMEOUT", 120))
+    expired = StkPushJob.objects.filter(status="sending", claimed_at__lt=now - timeout).update(
+        status="unknown", claim_token=None, last_error="Worker stopped while sending; outcome unknown"
+    )
+    if expired:
+        logger.warning(f"{expired} STK push(es) were abandoned mid-send; marked unknown")
+    return expired
+
+
+def claim_stk_push_jobs(limit):
+    """Claim up to `limit` queued jobs for this worker with one conditional UPDATE."""
+    now = timezone.now()
+    expire_stale_claims(now)
+
+    ids = list(
+        StkPushJob.objects.filter(status="queued")
+        .order_by("created_at")
+        .values_list("id", flat=True)[:limit]
+    )
+    if not ids:
+        return []
+
+    token = uuid.uuid4()
+    StkPushJob.objects.filter(status="queued", id__in=ids).update(
+        status="sending",
+        claim_token=token,
+        claimed_at=now,
+        attempts=F("attempts") + 1,
+    )
+    return list(StkPushJob.objects.filter(claim_token=token).select_related("payment"))
+
+
+# ---------------------------#
+# Process
+# ---------------------------#
+def _never_sent(error):
+    """
+    Whether a failed send provably never reached Daraja: no token, or a
+    connection that was never established (connect timeout, refused, DNS).
+    A dropped keep-alive connection ("Connection aborted",
+    RemoteDisconnected) is also a ConnectionError, but the push may have
+    been delivered before it dropped.
+    """
+    if isinstance(error, (RuntimeError, requests.ConnectTimeout)):
+        return True
+    if not isinstance(error, requests.ConnectionError):
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the cause
+    pending, seen = [error], set()
+    while pending:
+        current = pending.pop()
+        if current is None or id(current) in seen:
+            continue
+        seen.add(id(current))
+        if isinstance(current, NewConnectionError):
+            return True
+        pending.extend([getattr(current, "reason", None), current.__cause__, current.__context__])
+        pending.extend(arg for arg in current.args if isinstance(arg, BaseException))
+    return False
+
+
+def process_stk_push_job(job):
+    """Send one claimed push and record the outcome. Returns the final job status."""
+    payment = job.payment
+    max_attempts = getattr(settings, "STK_PUSH_MAX_ATTEMPTS", 3)
+
+    try:
+        http_status, data = send_stk_push(job.phone_number, int(payment.amount_deducted), payment.currency)
+    except (requests.RequestException, RuntimeError, ValueError) as e:
+        if _never_sent(e):
+            # Safe to send again until attempts run out
+            final = job.attempts >= max_attempts
+            new_status = "failed" if final else "queued"
+            with transaction.atomic():
+                StkPushJob.objects.filter(id=job.id, claim_token=job.claim_token).update(
+                    status=new_status, last_error=str(e), claim_token=None
+                )
+                if final:
+                    Payment.objects.filter(id=payment.id, status="pending").update(status="failed")
+            logger.warning(f"STK push {job.tracking_id} attempt {job.attempts} failed: {e}")
+            return new_status
+
+        # Dropped connection, read timeout or unreadable reply: Daraja may
+        # have accepted the push, and STK pushes are not idempotent, so
+        # never resend. The payment stays pending; its callback is matched
+        # to it on arrival.
+        StkPushJob.objects.filter(id=job.id, claim_token=job.claim_token).update(
+            status="unknown", last_error=str(e), claim_token=None
+        )
+        logger.warning(f"STK push {job.tracking_id} outcome unknown: {e}")
+        return "unknown"
+
+    checkout_request_id = data.get("CheckoutRequestID")
+    response_code = str(data.get("ResponseCode", ""))
+
+    with transaction.atomic():
+        if http_status < 400 and checkout_request_id and response_code in ("", "0"):
+            Payment.objects.filter(id=payment.id).update(checkout_request_id=checkout_request_id)
+            payment.checkout_request_id = checkout_request_id
+            record_mpesa_mapping(payment, phone_number=job.phone_number)
+            new_status, error = "sent", ""
+            logger.info(f"STK push {job.tracking_id} sent, CheckoutRequestID: {checkout_request_id}")
+        else:
+            # Daraja rejected the request; retrying would not help
+            Payment.objects.filter(id=payment.id, status="pending").update(status="failed")
+            new_status = "failed"
+            error = data.get("errorMessage") or data.get("ResponseDescription") or f"HTTP {http_status}"
+            logger.warning(f"STK push {job.tracking_id} rejected: {error}")
+
+        StkPushJob.objects.filter(id=job.id, claim_token=job.claim_token).update(
+            status=new_status,
+            response_code=data.get("ResponseCode") or data.get("errorCode") or "",
+            last_error=error,
+            claim_token=None,
+        )
+    return new_status
+
+
+def _process_in_thread(job):
+    try:
+        return process_stk_push_job(job)
+    except Exception:
+        logger.exception(f"Unexpected error processing STK push {job.tracking_id}")
+        return "error"
+    finally:
+        # Each pool thread owns its own DB connection
+        connection.close()
+
+
+def run_stk_push_batch(workers=4, batch_size=20):
+    """Claim one batch and send its pushes concurrently. Returns {status: count}."""
+    close_old_connections()
+    jobs = claim_stk_push_jobs(batch_size)
+    counts = {}
+    if not jobs:
+        return counts
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(_process_in_thread, jobs):
+            counts[result] = counts.get(result, 0) + 1
+    return counts
@@ -0,0 +1,253 @@
+# payments/ledger.py
+import logging
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+
+from .models import LedgerEntry, Wallet
+
+logger = logging.getLogger(__name__)
+
+# Accounts projected onto Wallet columns; the others only live in the ledger
+PROJECTED_ACCOUNTS = {"available": "balance", "locked": "rental_balance"}
+
+# entry_type -> (from_account, to_account)
+POSTINGS = {
+    "deposit": ("external", "available"),
+    "rental_lock": ("available", "locked"),
+    "rental_unlock": ("locked", "available"),
+    "rental_profit": ("platform", "available"),
+    "referral_reward": ("platform", "available"),
+    "withdrawal_hold": ("available", "held"),
+    "withdrawal_refund": ("held", "available"),
+    "withdrawal_payout": ("held", "external"),
+    "admin_award": ("platform", "available"),
+}
+
+
+BALANCE_CACHE_KEY = "wallet:balances:{user_id}"
+BALANCE_VERSION_KEY = "wallet:balances-version:{user_id}"
+
+
+class InsufficientFunds(Exception):
+    """Raised when a posting would take a wallet balance below zero."""
+
+
+# ---------------------------#
+# Posting
+# ---------------------------#
+def _build_postings(user_id, entries):
+    """LedgerEntry rows and the net {wallet column: delta} for one user's postings."""
+    rows, deltas = [], {}
+    for entry_type, amount, reference in entries:
+        amount = Decimal(str(amount))
+        if amount == 0:
+            continue
+        from_account, to_account = POSTINGS[entry_type]
+        if amount < 0:
+            from_account, to_account, amount = to_account, from_account, -amount
+        rows.append(LedgerEntry(
+            user_id=user_id,
+            entry_type=entry_type,
+            from_account=from_account,
+            to_account=to_account,
+            amount=amount,
+            reference=reference or "",
+        ))
+        for account, sign in ((from_account, -1), (to_account, 1)):
+            column = PROJECTED_ACCOUNTS.get(account)
+            if column:
+                deltas[column] = deltas.get(column, Decimal("0")) + sign * amount
+    return rows, {column: delta for column, delta in deltas.items() if delta}
+
+
+def post_entries(user, entries):
+    """
+    Append (entry_type, amount, reference) postings for one user and apply
+    their net effect to the wallet projection with a single conditional
+    F() UPDATE, in one transaction. Zero amounts are skipped.
+
+    Any balance the postings reduce is guarded in the UPDATE's WHERE
+    clause (e.g. balance >= x); if no row matches, nothing is written and
+    InsufficientFunds is raised. Returns the created entries.
+    """
+    user_id = getattr(user, "pk", user)
+    rows, deltas = _build_postings(user_id, entries)
+    if not rows:
+        return []
+
+    changes = {column: F(column) + delta for column, delta in deltas.items()}
+    guards = {f"{column}__gte": -delta for column, delta in deltas.items() if delta < 0}
+    with transaction.atomic():
+        if changes and not Wallet.objects.filter(user_id=user_id, **guards).update(**changes):
+            if guards or Wallet.objects.filter(user_id=user_id).exists():
+                raise InsufficientFunds(f"Insufficient funds for user {user_id}: {deltas}")
+            Wallet.objects.create(user_id=user_id, **deltas)
+        created = LedgerEntry.objects.bulk_create(rows)
+        invalidate_cached_balances(user_id)
+    return created
+
+
+def post_many(entries_by_user):
+    """
+    Post {user_id: [(entry_type, amount, reference), ...]} for many users
+    with one grouped UPDATE (a CASE per wallet column) and one bulk insert.
+    Guards are applied per user; unless every wallet matches, nothing is
+    written and InsufficientFunds is raised so the caller can fall back
+    to post_entries() per user. Returns the created entries.
+    """
+    rows, deltas_by_user = [], {}
+    for user_id, entries in entries_by_user.items():
+        user_rows, deltas = _build_postings(user_id, entries)
+        rows.extend(user_rows)
+        if deltas:
+            deltas_by_user[user_id] = deltas
+    if not rows:
+        return []
+
+    zero = Value(Decimal("0"), output_field=DecimalField(max_digits=12, decimal_places=2))
+    columns = {column for deltas in deltas_by_user.values() for column in deltas}
+    changes = {
+        column: F(column) + Case(
+            *[
+                When(user_id=user_id, then=Value(deltas[column], output_field=zero.output_field))
+                for user_id, deltas in deltas_by_user.items()
+                if column in deltas
+            ],
+            default=zero,
+        )
+        for column in columns
+    }
+    matches = Q()
+    for user_id, deltas in deltas_by_user.items():
+        matches |= Q(user_id=user_id, **{f"{column}__gte": -delta for column, delta in deltas.items() if delta < 0})
+
+    with transaction.atomic():
+        if deltas_by_user and Wallet.objects.filter(matches).update(**changes) != len(deltas_by_user):
+            raise InsufficientFunds(f"Grouped posting did not match all {len(deltas_by_user)} wallets")
+        created = LedgerEntry.objects.bulk_create(rows)
+        invalidate_cached_balances(*entries_by_user)
+    return created
+
+
+def post(user, entry_type, amount, reference=""):
+    """Append one posting and update the wallet projection. Returns the entry (or None for a zero amount)."""
+    created = post_entries(user, [(entry_type, amount, reference)])
+    return created[0] if created else None
+
+
+# ---------------------------#
+# Balance cache
+# ---------------------------#
+def _balance_keys(user_id):
+    return BALANCE_CACHE_KEY.format(user_id=user_id), BALANCE_VERSION_KEY.format(user_id=user_id)
+
+
+def _read_balances(user_id):
+    available, locked = (
+        Wallet.objects.filter(user_id=user_id).values_list("balance", "rental_balance").first()
+        or (Decimal("0.00"), Decimal("0.00"))
+    )
+    return {"available": available, "locked": locked, "total": available + locked}
+
+
+def cached_balances(user):
+    """
+    {"available", "locked", "total"} for a user's wallet, read through the
+    shared "wallets" cache. An entry only counts while it carries the
+    user's current version, so a read that raced with a posting can never
+    pin a stale balance. Versions are bumped when a posting commits, so
+    reads inside a transaction go to the database and are not cached.
+    """
+    user_id = getattr(user, "pk", user)
+    if connection.in_atomic_block:
+        return _read_balances(user_id)
+
+    cache = caches["wallets"]
+    key, version_key = _balance_keys(user_id)
+    cached = cache.get_many([key, version_key])
+    version = cached.get(version_key)
+    entry = cached.get(key)
+    if entry is not None and entry["version"] == version:
+        return entry["balances"]
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+
+    balances = _read_balances(user_id)
+    cache.set(key, {"version": version, "balances": balances}, getattr(settings, "WALLET_BALANCE_CACHE_TTL", 300))
+    return balances
+
+
+def invalidate_cached_balances(*user_ids):
+    """
+    Bump the balance versions of `user_ids` once the current transaction
+    commits (right away outside one), with a single set_many per call so a
+    batch posting costs one round of cache writes and none while its row
+    locks are held.
+    """
+    versions = {_balance_keys(user_id)[1]: uuid.uuid4().hex for user_id in set(user_ids)}
+    if versions:
+        transaction.on_commit(lambda: caches["wallets"].set_many(versions, None))
+
+
+# ---------------------------#
+# Rebuilding projections
+# ---------------------------#
+def _account_total(account):
+    zero = Value(Decimal("0"), output_field=DecimalField(max_digits=14, decimal_places=2))
+    incoming = Sum(Case(When(to_account=account, then=F("amount")), default=zero))
+    outgoing = Sum(Case(When(from_account=account, then=F("amount")), default=zero))
+    return incoming - outgoing
+
+
+def ledger_balances(user_ids=None):
+    """{user_id: {"balance": ..., "rental_balance": ...}} computed from the ledger in one GROUP BY."""
+    entries = LedgerEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    totals = (
+        entries.order_by()
+        .values("user_id")
+        .annotate(**{column: _account_total(account) for account, column in PROJECTED_ACCOUNTS.items()})
+    )
+    return {
+        row["user_id"]: {column: row[column] or Decimal("0") for column in PROJECTED_ACCOUNTS.values()}
+        for row in totals
+    }
+
+
+def rebuild_wallet_balances(user_ids=None, dry_run=False, batch_size=500):
+    """
+    Recompute Wallet.balance/rental_balance from the ledger and fix any
+    wallet that drifted. Returns (wallets_checked, drifted_wallets), where
+    drifted_wallets lists (wallet, expected) pairs.
+    """
+    expected = ledger_balances(user_ids)
+    zero = {column: Decimal("0") for column in PROJECTED_ACCOUNTS.values()}
+    wallets = Wallet.objects.order_by("id")
+    if user_ids is not None:
+        wallets = wallets.filter(user_id__in=user_ids)
+
+    checked, drifted = 0, []
+    for wallet in wallets.iterator(chunk_size=batch_size):
+        checked += 1
+        target = expected.get(wallet.user_id, zero)
+        if any(getattr(wallet, column) != value for column, value in target.items()):
+            drifted.append((wallet, target))
+
+    if not dry_run:
+        for wallet, _ in drifted:
+            # Recompute under the wallet row lock so postings committed
+            # since the scan are not overwritten
+            with transaction.atomic():
+                Wallet.objects.select_for_update().filter(id=wallet.id).exists()
+                target = ledger_balances([wallet.user_id]).get(wallet.user_id, zero)
+                Wallet.objects.filter(id=wallet.id).update(**target)
+                invalidate_cached_balances(wallet.user_id)
+            logger.warning(f"Wallet {wallet.id} drifted from the ledger; reset to {target}")
+    return checked, drifted
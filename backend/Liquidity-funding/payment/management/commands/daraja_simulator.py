@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payment.simulator import DarajaSimulator
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local Daraja simulator (OAuth, STK push, STK query, B2C). '
+        'Start the backend with MPESA_BASE_URL pointing at it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        parser.add_argument('--latency-ms', type=float, default=50, help='Base latency added to every response')
+        parser.add_argument('--jitter-ms', type=float, default=50, help='Random extra latency, up to this many ms')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 503')
+        parser.add_argument('--cancel-rate', type=float, default=0.0, help='Fraction of STK pushes the "customer" cancels')
+        parser.add_argument('--callback-delay', type=float, default=1.0, help='Seconds before the STK result callback is posted')
+        parser.add_argument('--callback-url', help="Override the push's CallBackURL, e.g. http://127.0.0.1:8000/api/payments/mpesa/callback/")
+        parser.add_argument('--seed', type=int, help='Seed for reproducible failures and cancellations')
+
+    def handle(self, *args, **options):
+        simulator = DarajaSimulator(
+            host=options['host'],
+            port=options['port'],
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            failure_rate=options['failure_rate'],
+            cancel_rate=options['cancel_rate'],
+            callback_delay=options['callback_delay'],
+            callback_url=options['callback_url'],
+            seed=options['seed'],
+        ).start()
+        self.stdout.write(f'Daraja simulator listening on {simulator.url} (Ctrl+C to stop)')
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.stop()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Daraja simulator stopped: {simulator.counters}')
+        )
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payment.settlement import drain_callback_inbox
+
+
+class Command(BaseCommand):
+    help = 'Settle M-PESA callbacks stored in the callback inbox, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Callbacks settled per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the inbox instead of exiting when it is empty')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the inbox is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        totals = {}
+        while True:
+            counts = drain_callback_inbox(batch_size=options['batch_size'])
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+
+            if counts:
+                self.stdout.write(f'Settled batch: {counts}')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'M-PESA callback inbox drained: {totals or "nothing to do"}')
+        )
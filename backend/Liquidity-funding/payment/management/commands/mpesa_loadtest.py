@@ -0,0 +1,149 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from payment.jobs import run_stk_push_batch
+from payment.settlement import drain_callback_inbox
+
+User = get_user_model()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive concurrent M-PESA payments from initiation to settlement and report latency and throughput. '
+        'Run the backend and the STK push / callback workers with MPESA_BASE_URL pointing at daraja_simulator, '
+        'or pass --run-workers to run the workers inside this command.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Backend serving /api/payments/')
+        parser.add_argument('--users', type=int, default=10, help='Concurrent users')
+        parser.add_argument('--payments', type=int, default=1, help='Payments made by each user, one after another')
+        parser.add_argument('--currency', default='CAD')
+        parser.add_argument('--phone', default='0712345678')
+        parser.add_argument('--poll-interval', type=float, default=0.25, help='Seconds between status polls')
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for one payment to settle')
+        parser.add_argument('--run-workers', action='store_true', help='Also run the STK push and callback inbox workers')
+        parser.add_argument('--keep-users', action='store_true', help='Keep the generated load-test users afterwards')
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create_user(email=f'loadtest-{run_id}-{i}@loadtest.local', full_name=f'Load Test {i}')
+            for i in range(options['users'])
+        ]
+        tokens = [str(RefreshToken.for_user(user).access_token) for user in users]
+
+        stop = threading.Event()
+        workers = []
+        if options['run_workers']:
+            workers = [
+                threading.Thread(target=self._worker_loop, args=(run_stk_push_batch, stop), daemon=True),
+                threading.Thread(target=self._worker_loop, args=(drain_callback_inbox, stop), daemon=True),
+            ]
+            for worker in workers:
+                worker.start()
+
+        self.stdout.write(f'Load run {run_id}: {len(users)} users x {options["payments"]} payments against {options["base_url"]}')
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=len(users) or 1) as pool:
+                results = [r for user_results in pool.map(lambda token: self._run_user(token, options), tokens) for r in user_results]
+        finally:
+            elapsed = time.monotonic() - started
+            stop.set()
+            for worker in workers:
+                worker.join()
+            if not options['keep_users']:
+                User.objects.filter(id__in=[user.id for user in users]).delete()
+
+        self._report(results, elapsed)
+
+    def _worker_loop(self, step, stop):
+        try:
+            while not stop.is_set():
+                try:
+                    busy = step()
+                except Exception as e:
+                    self.stderr.write(f'{step.__name__} failed: {e}')
+                    busy = False
+                if not busy:
+                    stop.wait(0.1)
+        finally:
+            connection.close()
+
+    def _run_user(self, token, options):
+        session = requests.Session()
+        session.headers['Authorization'] = f'Bearer {token}'
+        base_url = options['base_url'].rstrip('/')
+        results = []
+
+        for _ in range(options['payments']):
+            started = time.monotonic()
+            try:
+                response = session.post(
+                    f'{base_url}/api/payments/mpesa/initiate/',
+                    json={'currency': options['currency'], 'phone': options['phone']},
+                    timeout=30,
+                )
+            except requests.RequestException:
+                results.append({'outcome': 'initiate_error', 'initiate': time.monotonic() - started, 'settle': None})
+                continue
+            initiated = time.monotonic() - started
+
+            if response.status_code != 202:
+                results.append({'outcome': f'initiate_http_{response.status_code}', 'initiate': initiated, 'settle': None})
+                continue
+
+            tracking_id = response.json()['tracking_id']
+            outcome = 'timeout'
+            deadline = started + options['timeout']
+            while time.monotonic() < deadline:
+                time.sleep(options['poll_interval'])
+                try:
+                    data = session.get(f'{base_url}/api/payments/mpesa/status/{tracking_id}/', timeout=30).json()
+                except (requests.RequestException, ValueError):
+                    continue
+                if data.get('payment_status') in ('completed', 'failed'):
+                    outcome = data['payment_status']
+                    break
+            results.append({'outcome': outcome, 'initiate': initiated, 'settle': time.monotonic() - started})
+        return results
+
+    def _report(self, results, elapsed):
+        outcomes = {}
+        for result in results:
+            outcomes[result['outcome']] = outcomes.get(result['outcome'], 0) + 1
+
+        initiate = [r['initiate'] * 1000 for r in results]
+        settle = [r['settle'] * 1000 for r in results if r['outcome'] in ('completed', 'failed')]
+
+        self.stdout.write(f'Outcomes: {outcomes}')
+        self.stdout.write(
+            f'Initiation latency: p50 {percentile(initiate, 50):.0f} ms, p99 {percentile(initiate, 99):.0f} ms'
+        )
+        self.stdout.write(
+            f'Initiation to settlement: p50 {percentile(settle, 50):.0f} ms, p99 {percentile(settle, 99):.0f} ms'
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{len(settle)} of {len(results)} payments settled in {elapsed:.1f}s '
+                f'({len(settle) / elapsed if elapsed else 0:.2f} payments/s)'
+            )
+        )
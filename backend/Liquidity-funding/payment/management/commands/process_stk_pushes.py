@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payment.jobs import run_stk_push_batch
+
+
+class Command(BaseCommand):
+    help = 'Send queued M-PESA STK pushes using a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent pushes per batch')
+        parser.add_argument('--batch-size', type=int, default=20, help='Jobs claimed per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the queue instead of exiting when it is empty')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        totals = {}
+        while True:
+            counts = run_stk_push_batch(workers=options['workers'], batch_size=options['batch_size'])
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+
+            if counts:
+                self.stdout.write(f'Processed batch: {counts}')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'STK push queue drained: {totals or "nothing to do"}')
+        )
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payment.ledger import rebuild_wallet_balances
+
+
+class Command(BaseCommand):
+    help = 'Recompute wallet balances from the ledger and fix wallets that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, action='append', dest='user_ids', help='Only rebuild this user (repeatable)')
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without changing any wallet')
+        parser.add_argument('--batch-size', type=int, default=500, help='Wallets loaded per query')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        checked, drifted = rebuild_wallet_balances(
+            user_ids=options['user_ids'],
+            dry_run=options['dry_run'],
+            batch_size=options['batch_size'],
+        )
+        for wallet, expected in drifted:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'{wallet.user_id}: balance {wallet.balance} -> {expected["balance"]}, '
+                    f'rental_balance {wallet.rental_balance} -> {expected["rental_balance"]}'
+                )
+            )
+
+        action = 'would be fixed' if options['dry_run'] else 'fixed'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Checked {checked} wallets in {time.monotonic() - started:.2f}s; {len(drifted)} {action}'
+            )
+        )
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payment.settlement import reconcile_stale_payments
+
+
+class Command(BaseCommand):
+    help = 'Resolve stale pending M-PESA payments using the Daraja STK Push Query API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=10, help='Only payments pending for at least this many minutes')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Payments loaded per chunk')
+        parser.add_argument('--concurrency', type=int, default=4, help='STK queries in flight at once')
+        parser.add_argument('--rate', type=float, default=5.0, help='Maximum STK queries per second')
+
+    def handle(self, *args, **options):
+        counts = reconcile_stale_payments(
+            older_than=timedelta(minutes=options['older_than']),
+            chunk_size=options['chunk_size'],
+            concurrency=options['concurrency'],
+            rate=options['rate'],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'Reconciled stale payments: {counts or "nothing to do"}')
+        )
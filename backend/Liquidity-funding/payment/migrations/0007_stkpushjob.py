@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:02
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0006_wallet_rental_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StkPushJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tracking_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('phone_number', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('claim_token', models.UUIDField(blank=True, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('response_code', models.CharField(blank=True, default='', max_length=20)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stk_push_job', to='payment.payment')),
+            ],
+            options={
+                'verbose_name': 'STK Push Job',
+                'verbose_name_plural': 'STK Push Jobs',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='payment_stk_status_a87a78_idx'), models.Index(fields=['claim_token'], name='payment_stk_claim_t_8beadf_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0007_stkpushjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('raw_body', models.TextField()),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('outcome', models.CharField(blank=True, default='', max_length=20)),
+                ('detail', models.CharField(blank=True, default='', max_length=255)),
+            ],
+            options={
+                'verbose_name': 'M-PESA Callback',
+                'verbose_name_plural': 'M-PESA Callbacks',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='payment_mpe_process_2c5557_idx')],
+            },
+        ),
+    ]
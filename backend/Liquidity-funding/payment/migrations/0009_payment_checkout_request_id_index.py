@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0008_mpesacallback'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, db_index=True, help_text='M-PESA CheckoutRequestID for STK Push tracking', max_length=50, null=True),
+        ),
+    ]
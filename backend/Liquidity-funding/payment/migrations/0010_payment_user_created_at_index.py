@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0009_payment_checkout_request_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['user', 'created_at'], name='payment_pay_user_id_b9fc38_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0010_payment_user_created_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('deposit', 'Deposit'), ('rental_lock', 'Rental lock'), ('rental_unlock', 'Rental unlock'), ('rental_profit', 'Rental profit'), ('referral_reward', 'Referral reward'), ('withdrawal_hold', 'Withdrawal hold'), ('withdrawal_refund', 'Withdrawal refund'), ('withdrawal_payout', 'Withdrawal payout'), ('admin_award', 'Admin award'), ('opening_balance', 'Opening balance')], max_length=20)),
+                ('from_account', models.CharField(choices=[('available', 'Available balance'), ('locked', 'Locked in rentals'), ('held', 'Held for withdrawal'), ('external', 'External (M-PESA)'), ('platform', 'Platform funds')], max_length=10)),
+                ('to_account', models.CharField(choices=[('available', 'Available balance'), ('locked', 'Locked in rentals'), ('held', 'Held for withdrawal'), ('external', 'External (M-PESA)'), ('platform', 'Platform funds')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('reference', models.CharField(blank=True, default='', max_length=50)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Ledger Entry',
+                'verbose_name_plural': 'Ledger Entries',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['user', 'id'], name='payment_led_user_id_c99713_idx'), models.Index(fields=['reference'], name='payment_led_referen_5f1ad9_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+from decimal import Decimal
+
+from django.db import migrations
+
+
+def post_opening_balances(apps, schema_editor):
+    """Seed the ledger with each wallet's current balances so projections rebuild to the same values."""
+    Wallet = apps.get_model("payment", "Wallet")
+    LedgerEntry = apps.get_model("payment", "LedgerEntry")
+
+    entries = []
+    for wallet in Wallet.objects.exclude(balance=0, rental_balance=0).iterator():
+        for account, amount in (("available", wallet.balance), ("locked", wallet.rental_balance)):
+            if not amount:
+                continue
+            from_account, to_account = ("external", account) if amount > 0 else (account, "external")
+            entries.append(LedgerEntry(
+                user_id=wallet.user_id,
+                entry_type="opening_balance",
+                from_account=from_account,
+                to_account=to_account,
+                amount=abs(Decimal(amount)),
+                reference=f"wallet:{wallet.id}",
+            ))
+    LedgerEntry.objects.bulk_create(entries, batch_size=500)
+
+
+def remove_opening_balances(apps, schema_editor):
+    LedgerEntry = apps.get_model("payment", "LedgerEntry")
+    LedgerEntry.objects.filter(entry_type="opening_balance").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0011_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(post_opening_balances, remove_opening_balances),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0013_payment_status_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stkpushjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed'), ('unknown', 'Unknown')], default='queued', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0014_stkpushjob_unknown_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesacallback',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mpesacallback',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='mpesacallback',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
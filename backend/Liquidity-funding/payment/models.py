@@ -4,6 +4,7 @@ from django.utils import timezone
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from datetime import timedelta
+import uuid
 from Users.models import CustomUser
 
 
@@ -14,7 +15,8 @@ from Users.models import CustomUser
 class Wallet(models.Model):
     """
     Each user has one wallet that tracks their KES balance.
-    Updated automatically whenever balance changes or user is created.
+    Created automatically with the user; balances only change through
+    payment.wallets.WalletService.
     """
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name="wallet")
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)  # Available for withdrawal
@@ -51,33 +53,66 @@ class Wallet(models.Model):
         """Check if user can withdraw the specified amount"""
         return amount <= self.balance
 
-    def add_referral_reward(self, amount):
-        """Add referral reward to wallet balance"""
-        self.balance += amount
-        self.save()
-
-    def add_admin_award(self, amount):
-        """Add admin award to wallet balance"""
-        self.balance += amount
-        self.save()
-
-    def create_rental_payment(self, amount):
-        """Process rental payment by moving money from wallet to rental balance"""
-        if self.balance >= amount:
-            self.balance -= amount
-            self.rental_balance += amount
-            self.save()
-            return True
-        return False
-
-    def complete_rental(self, rental_amount, return_amount):
-        """Complete a rental by moving money from rental_balance to balance"""
-        if self.rental_balance >= rental_amount:
-            self.rental_balance -= rental_amount
-            self.balance += return_amount
-            self.save()
-            return True
-        return False
+
+# -----------------------
+# Ledger Entry Model
+# -----------------------
+class LedgerEntry(models.Model):
+    """
+    Append-only, double-entry record of every wallet money movement.
+    Each row moves `amount` from one account to another; Wallet.balance
+    ("available") and Wallet.rental_balance ("locked") are projections of
+    these rows, kept in step by payment.ledger.post() and rebuildable with
+    the rebuild_wallets command.
+    """
+    ACCOUNT_CHOICES = [
+        ("available", "Available balance"),
+        ("locked", "Locked in rentals"),
+        ("held", "Held for withdrawal"),
+        ("external", "External (M-PESA)"),
+        ("platform", "Platform funds"),
+    ]
+
+    ENTRY_TYPE_CHOICES = [
+        ("deposit", "Deposit"),
+        ("rental_lock", "Rental lock"),
+        ("rental_unlock", "Rental unlock"),
+        ("rental_profit", "Rental profit"),
+        ("referral_reward", "Referral reward"),
+        ("withdrawal_hold", "Withdrawal hold"),
+        ("withdrawal_refund", "Withdrawal refund"),
+        ("withdrawal_payout", "Withdrawal payout"),
+        ("admin_award", "Admin award"),
+        ("opening_balance", "Opening balance"),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="ledger_entries")
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES)
+    from_account = models.CharField(max_length=10, choices=ACCOUNT_CHOICES)
+    to_account = models.CharField(max_length=10, choices=ACCOUNT_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # Always positive
+    reference = models.CharField(max_length=50, blank=True, default="")  # e.g. "payment:12", "rental:4"
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.entry_type} {self.amount:.2f} KES {self.from_account} → {self.to_account} ({self.user.email})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only and cannot be changed.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Ledger entries are append-only and cannot be deleted.")
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = "Ledger Entry"
+        verbose_name_plural = "Ledger Entries"
+        indexes = [
+            models.Index(fields=["user", "id"]),
+            models.Index(fields=["reference"]),
+        ]
 
 
 # -----------------------
@@ -109,7 +144,7 @@ class Payment(models.Model):
     amount_deducted = models.DecimalField(max_digits=12, decimal_places=2)
     created_at = models.DateTimeField(default=timezone.now)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="completed")
-    checkout_request_id = models.CharField(max_length=50, blank=True, null=True, help_text="M-PESA CheckoutRequestID for STK Push tracking")
+    checkout_request_id = models.CharField(max_length=50, blank=True, null=True, db_index=True, help_text="M-PESA CheckoutRequestID for STK Push tracking")
 
     def __str__(self):
         return f"{self.user.email} — {self.amount_deducted:.2f} {self.currency} ({self.status})"
@@ -118,6 +153,14 @@ class Payment(models.Model):
         ordering = ["-created_at"]
         verbose_name = "Payment"
         verbose_name_plural = "Payments"
+        indexes = [
+            # Per-user history pages, keyset-paginated on (created_at, id)
+            models.Index(fields=["user", "created_at"]),
+            # Per-user totals for one status over a date range
+            models.Index(fields=["user", "status", "created_at"]),
+            # Stale pending reconciliation, keyset-paginated on id
+            models.Index(fields=["status", "id"]),
+        ]
 
 
 # -----------------------
@@ -148,6 +191,82 @@ class MpesaTransactionMapping(models.Model):
         ]
 
 
+# -----------------------
+# M-PESA Callback Inbox Model
+# -----------------------
+class MpesaCallback(models.Model):
+    """
+    Append-only inbox of raw Daraja STK callbacks.
+    MpesaCallbackView only inserts here; the drain_mpesa_callbacks worker
+    settles rows in batches and records the outcome, retrying rows whose
+    settlement raised.
+    """
+    raw_body = models.TextField()
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=20, blank=True, default="")  # completed / failed / not_found / invalid / error
+    detail = models.CharField(max_length=255, blank=True, default="")
+    # Settlement errors (deadlocks, lock timeouts) leave the row unprocessed
+    # for a later drain, until MPESA_CALLBACK_MAX_ATTEMPTS is reached
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"M-PESA callback {self.id} ({self.outcome or 'pending'})"
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = "M-PESA Callback"
+        verbose_name_plural = "M-PESA Callbacks"
+        indexes = [
+            models.Index(fields=["processed_at", "id"]),
+        ]
+
+
+# -----------------------
+# STK Push Job Model
+# -----------------------
+class StkPushJob(models.Model):
+    """
+    Queued M-PESA STK push for a pending Payment.
+    MpesaPaymentView enqueues one job per request and returns immediately;
+    the process_stk_pushes worker sends the push and records the
+    CheckoutRequestID on the payment.
+    """
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("sending", "Sending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+        ("unknown", "Unknown"),  # may have reached Daraja; never resent
+    ]
+
+    tracking_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name="stk_push_job")
+    phone_number = models.CharField(max_length=20)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claim_token = models.UUIDField(null=True, blank=True)  # Set by the worker that claimed the job
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    response_code = models.CharField(max_length=20, blank=True, default="")
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"STK push {self.tracking_id} ({self.status})"
+
+    class Meta:
+        ordering = ["created_at"]
+        verbose_name = "STK Push Job"
+        verbose_name_plural = "STK Push Jobs"
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["claim_token"]),
+        ]
+
+
 # -----------------------
 # Signals → Auto-create Wallet when a user is created
 # -----------------------
@@ -158,24 +277,22 @@ def create_user_wallet(sender, instance, created, **kwargs):
         Wallet.objects.create(user=instance)
 
 
-@receiver(post_save, sender=CustomUser)
-def save_user_wallet(sender, instance, **kwargs):
-    """Ensure wallet is saved whenever the user is updated."""
-    if hasattr(instance, "wallet"):
-        instance.wallet.save()
+def record_mpesa_mapping(payment, phone_number=None):
+    """Map a pending payment's CheckoutRequestID to its user for callback processing."""
+    MpesaTransactionMapping.objects.update_or_create(
+        checkout_request_id=payment.checkout_request_id,
+        defaults={
+            'user': payment.user,
+            'phone_number': phone_number or payment.user.phone_number or '',
+            'amount': payment.amount_deducted,
+            'currency': payment.currency,
+            'expires_at': timezone.now() + timedelta(hours=24)
+        }
+    )
 
 
 @receiver(post_save, sender=Payment)
 def create_mpesa_mapping(sender, instance, created, **kwargs):
     """Create M-PESA mapping when a pending payment is created."""
     if created and instance.status == "pending" and instance.checkout_request_id:
-        MpesaTransactionMapping.objects.update_or_create(
-            checkout_request_id=instance.checkout_request_id,
-            defaults={
-                'user': instance.user,
-                'phone_number': instance.user.phone_number or '',
-                'amount': instance.amount_deducted,
-                'currency': instance.currency,
-                'expires_at': timezone.now() + timedelta(hours=24)
-            }
-        )
+        record_mpesa_mapping(instance)
@@ -0,0 +1,347 @@
+# payments/mpesa.py
+import base64
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------#
+# Pooled Daraja HTTP client
+# ---------------------------#
+class DarajaClient:
+    """
+    Keep-alive HTTP client for every Safaricom Daraja call.
+
+    Owns one pooled requests.Session per process, applies per-endpoint
+    (connect, read) timeouts, retries idempotent calls on transport errors
+    and 429/5xx with jittered exponential backoff, and keeps latency and
+    error counters per endpoint (see stats()).
+    """
+    ENDPOINTS = {
+        "oauth": {"path": "/oauth/v1/generate", "timeout": (3.05, 10), "idempotent": True},
+        "stk_push": {"path": "/mpesa/stkpush/v1/processrequest", "timeout": (3.05, 15), "idempotent": False},
+        "stk_query": {"path": "/mpesa/stkpushquery/v1/query", "timeout": (3.05, 10), "idempotent": True},
+    }
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size=None, max_retries=None, backoff=0.25):
+        self.pool_size = pool_size or getattr(settings, "MPESA_HTTP_POOL_SIZE", 10)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, "MPESA_HTTP_MAX_RETRIES", 2)
+        self.backoff = backoff
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def _record(self, endpoint, elapsed, error=False, retried=False):
+        with self._stats_lock:
+            entry = self._stats.setdefault(
+                endpoint, {"calls": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["retries"] += int(retried)
+            ms = elapsed * 1000
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+
+    def stats(self):
+        """Snapshot of per-endpoint counters with average latency."""
+        with self._stats_lock:
+            return {
+                endpoint: dict(entry, avg_ms=entry["total_ms"] / entry["calls"] if entry["calls"] else 0.0)
+                for endpoint, entry in self._stats.items()
+            }
+
+    def request(self, endpoint, method, **kwargs):
+        """
+        Call a Daraja endpoint and return the response.
+        Raises requests.RequestException once retries are exhausted.
+        """
+        config = self.ENDPOINTS[endpoint]
+        url = f"{settings.MPESA_BASE_URL}{config['path']}"
+        kwargs.setdefault("timeout", config["timeout"])
+        attempts = 1 + (self.max_retries if config["idempotent"] else 0)
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, time.monotonic() - started, error=True, retried=not last_attempt)
+                if last_attempt:
+                    raise
+                logger.warning(f"Daraja {endpoint} attempt {attempt + 1} failed: {e}")
+            else:
+                retry = response.status_code in self.RETRY_STATUSES and not last_attempt
+                self._record(endpoint, time.monotonic() - started, error=response.status_code >= 500, retried=retry)
+                if not retry:
+                    return response
+                logger.warning(f"Daraja {endpoint} attempt {attempt + 1} returned HTTP {response.status_code}")
+            time.sleep(self.backoff * (2 ** attempt) + random.uniform(0, self.backoff))
+
+
+daraja_client = DarajaClient()
+
+
+# ---------------------------#
+# Shared OAuth token cache
+# ---------------------------#
+class MpesaTokenProvider:
+    """
+    Caches the Daraja OAuth token until shortly before it expires.
+
+    The token lives in memory for this process and in the "mpesa" cache
+    alias (file-backed by default) so every worker process reuses it.
+    Threads share a single in-flight refresh through a lock, and processes
+    through a lock key in the shared cache that holds its owner's id and
+    outlives the slowest possible fetch.
+    """
+    CACHE_KEY = "mpesa:access-token:{base_url}"
+    LOCK_KEY = "mpesa:access-token:refresh:{base_url}"
+
+    def __init__(self, cache_alias="mpesa", refresh_margin=60, lock_wait=5.0, lock_ttl=None):
+        self.cache_alias = cache_alias
+        self.refresh_margin = refresh_margin
+        self.lock_wait = lock_wait
+        self.lock_ttl = lock_ttl
+        self._entry = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _keys(self):
+        # Tokens are scoped to the Daraja environment they were issued by
+        base_url = settings.MPESA_BASE_URL
+        return self.CACHE_KEY.format(base_url=base_url), self.LOCK_KEY.format(base_url=base_url)
+
+    def _lock_timeout(self):
+        """Seconds the refresh lock lives: the slowest OAuth fetch, with every retry and backoff."""
+        if self.lock_ttl:
+            return self.lock_ttl
+        connect, read = DarajaClient.ENDPOINTS["oauth"]["timeout"]
+        attempts = 1 + daraja_client.max_retries
+        backoff = sum(daraja_client.backoff * (2 ** attempt + 1) for attempt in range(attempts - 1))
+        return int((connect + read) * attempts + backoff) + 1
+
+    def _is_fresh(self, entry):
+        return (
+            entry is not None
+            and entry.get("base_url") == settings.MPESA_BASE_URL
+            and time.time() < entry["expires_at"] - self.refresh_margin
+        )
+
+    def _from_shared_cache(self, cache_key):
+        entry = self.cache.get(cache_key)
+        if self._is_fresh(entry):
+            self._entry = entry
+            return entry["access_token"]
+        return None
+
+    def get_token(self):
+        """Return a valid access token, or None if Daraja could not be reached."""
+        entry = self._entry
+        if self._is_fresh(entry):
+            return entry["access_token"]
+
+        cache_key, lock_key = self._keys()
+        with self._lock:
+            # Another thread may have refreshed while we waited
+            if self._is_fresh(self._entry):
+                return self._entry["access_token"]
+
+            token = self._from_shared_cache(cache_key)
+            if token:
+                return token
+
+            owner = uuid.uuid4().hex
+            deadline = time.time() + self.lock_wait
+            while not self.cache.add(lock_key, owner, timeout=self._lock_timeout()):
+                # Another process is refreshing; wait for its result, or
+                # for its lock to go away if it failed
+                if time.time() >= deadline:
+                    logger.warning("Timed out waiting for another process to refresh the M-PESA token")
+                    return self._from_shared_cache(cache_key)
+                time.sleep(0.1)
+                token = self._from_shared_cache(cache_key)
+                if token:
+                    return token
+
+            try:
+                return self._refresh(cache_key)
+            finally:
+                # Only release the lock if it is still ours
+                if self.cache.get(lock_key) == owner:
+                    self.cache.delete(lock_key)
+
+    def _refresh(self, cache_key):
+        token_data = fetch_mpesa_access_token()
+        if not token_data or not token_data.get("access_token"):
+            return None
+
+        expires_in = int(token_data.get("expires_in") or 3599)
+        entry = {
+            "access_token": token_data["access_token"],
+            "expires_at": time.time() + expires_in,
+            "base_url": settings.MPESA_BASE_URL,
+        }
+        self.cache.set(cache_key, entry, timeout=max(expires_in - self.refresh_margin, 1))
+        self._entry = entry
+        logger.info(f"M-PESA access token refreshed, valid for {expires_in}s")
+        return entry["access_token"]
+
+    def invalidate(self):
+        """Forget the token (e.g. after Daraja rejects it with 401)."""
+        with self._lock:
+            self._entry = None
+            self.cache.delete(self._keys()[0])
+
+
+token_provider = MpesaTokenProvider()
+
+
+# ---------------------------#
+# Helper: Get M-PESA Access Token
+# ---------------------------#
+def fetch_mpesa_access_token():
+    """Fetch a new OAuth token payload from M-PESA API (uncached)."""
+    headers = {"Authorization": f"Basic {settings.MPESA_BASE64_ENCODED_CREDENTIALS}"}
+
+    try:
+        response = daraja_client.request(
+            "oauth", "GET", params={"grant_type": "client_credentials"}, headers=headers
+        )
+        response.raise_for_status()
+        return response.json()
+    except requests.RequestException as e:
+        logger.error(f"M-PESA token request failed: {e}")
+        return None
+
+
+def get_mpesa_access_token():
+    """Return the cached OAuth token, refreshing it shortly before expiry."""
+    return token_provider.get_token()
+
+
+# ---------------------------#
+# Helper: STK Push password
+# ---------------------------#
+def generate_stk_password(timestamp=None):
+    """Return (password, timestamp) for Lipa Na M-PESA Online requests."""
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d%H%M%S")
+    password = base64.b64encode(f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode()).decode()
+    return password, timestamp
+
+
+# ---------------------------#
+# Helper: Send STK Push
+# ---------------------------#
+def send_stk_push(phone, amount, account_reference):
+    """
+    Send an STK push to Daraja and return (http_status, response_data).
+    Raises requests.RequestException on transport errors and RuntimeError
+    when no access token could be obtained.
+    """
+    access_token = get_mpesa_access_token()
+    if not access_token:
+        raise RuntimeError("Failed to retrieve M-PESA access token")
+
+    password, timestamp = generate_stk_password()
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    payload = {
+        "BusinessShortCode": settings.MPESA_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "TransactionType": "CustomerBuyGoodsOnline",
+        "Amount": amount,
+        "PartyA": phone,
+        "PartyB": settings.MPESA_TILL_NUMBER,
+        "PhoneNumber": phone,
+        "CallBackURL": settings.MPESA_CALLBACK_URL,
+        "AccountReference": account_reference,
+        "TransactionDesc": f"Wallet top-up via {account_reference}",
+    }
+
+    response = daraja_client.request("stk_push", "POST", json=payload, headers=headers)
+    if response.status_code == 401:
+        token_provider.invalidate()
+    data = response.json()
+    logger.info(f"STK Push initiated for {phone}: {json.dumps(data)}")
+    return response.status_code, data
+
+
+# ---------------------------#
+# Helper: STK Push Query
+# ---------------------------#
+def query_stk_status(checkout_request_id):
+    """
+    Ask Daraja for the outcome of an STK push.
+    Returns (http_status, response_data); raises requests.RequestException
+    on transport errors and RuntimeError when no token is available.
+    """
+    access_token = get_mpesa_access_token()
+    if not access_token:
+        raise RuntimeError("Failed to retrieve M-PESA access token")
+
+    password, timestamp = generate_stk_password()
+    payload = {
+        "BusinessShortCode": settings.MPESA_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    response = daraja_client.request("stk_query", "POST", json=payload, headers=headers)
+    if response.status_code == 401:
+        token_provider.invalidate()
+    return response.status_code, response.json()
+
+
+# ---------------------------#
+# Helper: Rate limiter
+# ---------------------------#
+class RateLimiter:
+    """Thread-safe limiter spacing calls at most `rate` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
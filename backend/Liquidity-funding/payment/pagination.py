@@ -0,0 +1,94 @@
+# payments/pagination.py
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidPageParameter(ValueError):
+    """Raised for a malformed cursor, limit or timestamp query parameter."""
+
+
+# ---------------------------#
+# Query parameter helpers
+# ---------------------------#
+def is_paged(params):
+    """
+    Whether a request asked for paging. Callers that pass neither limit
+    nor cursor (older clients) get the full list in one response.
+    """
+    return params.get("limit") not in (None, "") or params.get("cursor") not in (None, "")
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Page size from a query parameter, clamped to 1..maximum."""
+    if value in (None, ""):
+        return default
+    try:
+        return min(max(int(value), 1), maximum)
+    except (TypeError, ValueError):
+        raise InvalidPageParameter("limit must be an integer")
+
+
+def parse_timestamp(value, name="since"):
+    """Aware datetime from an ISO 8601 query parameter (naive values use the site timezone)."""
+    if value in (None, ""):
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise InvalidPageParameter(f"{name} must be an ISO 8601 datetime")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+# ---------------------------#
+# Keyset cursor
+# ---------------------------#
+def encode_cursor(created_at, pk):
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (created_at, pk) from an opaque cursor."""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return parse_timestamp(created_at, name="cursor"), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidPageParameter("Invalid cursor")
+
+
+def keyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE, field="created_at"):
+    """
+    Newest-first page of `queryset` ordered on (field, id), starting after
+    `cursor`. Works on model and .values() querysets (which must include
+    `field` and "id"). Returns (rows, next_cursor or None). With
+    limit=None every remaining row is returned and next_cursor is None.
+
+    Unlike OFFSET paging, each page is a bounded index range scan no
+    matter how deep the client has paged.
+    """
+    if cursor:
+        after, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f"{field}__lt": after}) | Q(**{field: after, "id__lt": pk}))
+
+    if limit is None:
+        return list(queryset.order_by(f"-{field}", "-id")), None
+
+    rows = list(queryset.order_by(f"-{field}", "-id")[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    if isinstance(last, dict):
+        return rows, encode_cursor(last[field], last["id"])
+    return rows, encode_cursor(getattr(last, field), last.id)
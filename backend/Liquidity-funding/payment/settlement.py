@@ -0,0 +1,336 @@
+# payments/settlement.py
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MpesaCallback, MpesaTransactionMapping, Payment, StkPushJob, record_mpesa_mapping
+from .mpesa import RateLimiter, query_stk_status
+from .wallets import WalletService
+from Users.models import Referral
+from rentals.models import Rental
+
+logger = logging.getLogger(__name__)
+
+# A push whose outcome was unknown and that got no callback in this long
+# (the lifetime of an M-PESA mapping) is treated as never paid
+UNKNOWN_PUSH_TTL = timedelta(hours=24)
+
+
+# ---------------------------#
+# Referral reward
+# ---------------------------#
+def process_referral_reward(user, amount):
+    """
+    Process referral reward when a user rents a coin.
+    Gives 50% of rental amount to the referrer.
+    """
+    logger.info(f"Processing referral reward for user {user.email}, amount {amount}")
+
+    if getattr(user, "referred_by", None):
+        reward = Decimal(str(amount)) / Decimal('2')  # 50% of rental amount
+        WalletService.credit(user.referred_by, reward, "referral_reward", reference=f"referral:{user.id}")
+
+        Referral.objects.update_or_create(
+            referrer=user.referred_by,
+            referred=user,
+            defaults={"reward": reward},
+        )
+
+        logger.info(f"Referral reward processed: {reward} awarded to {user.referred_by.email} for {user.email}'s rental")
+        return reward
+    else:
+        logger.info(f"No referrer found for user {user.email}")
+    return 0
+
+
+# ---------------------------#
+# STK callback settlement
+# ---------------------------#
+def parse_stk_callback(raw_body):
+    """Return the stkCallback dict from a raw Daraja callback body."""
+    data = json.loads(raw_body or "{}")
+    return data.get("Body", {}).get("stkCallback", {})
+
+
+def link_unknown_push(checkout_request_id, amount, phone):
+    """
+    Attach a CheckoutRequestID we never recorded to the pending payment of
+    an STK push whose outcome was unknown (the send timed out after Daraja
+    accepted it), matched on phone number and amount, oldest first.
+    Returns the linked payment's id, or None.
+    """
+    if not phone:
+        return None
+    payment = (
+        Payment.objects.select_related("user")
+        .filter(
+            status="pending",
+            checkout_request_id__isnull=True,
+            amount_deducted=amount,
+            stk_push_job__status="unknown",
+            stk_push_job__phone_number=str(phone),
+        )
+        .order_by("id")
+        .first()
+    )
+    if not payment or not Payment.objects.filter(id=payment.id, checkout_request_id__isnull=True).update(
+        checkout_request_id=checkout_request_id
+    ):
+        return None
+    payment.checkout_request_id = checkout_request_id
+    record_mpesa_mapping(payment, phone_number=str(phone))
+    StkPushJob.objects.filter(payment_id=payment.id).update(status="sent", last_error="")
+    logger.info(f"Linked {checkout_request_id} to payment {payment.id}, whose STK push outcome was unknown")
+    return payment.id
+
+
+def settle_stk_callback(stk_callback):
+    """
+    Apply one STK callback: fail or complete its pending payment, lock the
+    paid amount in a new rental and pay any referral reward.
+    Returns (outcome, detail). Must run inside a transaction.
+    """
+    result_code = stk_callback.get("ResultCode")
+    checkout_request_id = stk_callback.get("CheckoutRequestID")
+
+    if not checkout_request_id:
+        return "invalid", "Missing CheckoutRequestID"
+
+    if result_code != 0:
+        updated = Payment.objects.filter(checkout_request_id=checkout_request_id, status="pending").update(status="failed")
+        logger.info(f"M-PESA ResultCode {result_code} for {checkout_request_id}; {updated} payment(s) marked failed")
+        return "failed", stk_callback.get("ResultDesc", "")
+
+    amount, phone = None, None
+    for item in stk_callback.get("CallbackMetadata", {}).get("Item", []):
+        if item.get("Name") == "Amount":
+            amount = Decimal(str(item["Value"]))
+        elif item.get("Name") == "PhoneNumber":
+            phone = item.get("Value")
+    if not amount:
+        return "invalid", "Missing Amount"
+
+    # checkout_request_id is not unique, so settle exactly one payment:
+    # the oldest pending row, claimed by primary key with one conditional
+    # UPDATE. Only the first delivery of a callback flips it to completed
+    # and moves money.
+    payment_id = (
+        Payment.objects.filter(checkout_request_id=checkout_request_id, status="pending")
+        .order_by("id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    if payment_id is None:
+        if Payment.objects.filter(checkout_request_id=checkout_request_id).exists():
+            logger.info(f"Duplicate callback for already settled CheckoutRequestID: {checkout_request_id}")
+            return "duplicate", "Already settled"
+        payment_id = link_unknown_push(checkout_request_id, amount, phone)
+        if payment_id is None:
+            logger.warning(f"No pending payment found for CheckoutRequestID: {checkout_request_id}")
+            return "not_found", "Transaction not found"
+
+    if not Payment.objects.filter(id=payment_id, status="pending").update(status="completed"):
+        logger.info(f"Payment {payment_id} was settled concurrently for CheckoutRequestID: {checkout_request_id}")
+        return "duplicate", "Already settled"
+
+    # Other pending rows for the same push (legacy duplicates) stand for
+    # the same money; close them so a redelivered callback cannot settle them
+    superseded = (
+        Payment.objects.filter(checkout_request_id=checkout_request_id, status="pending")
+        .exclude(id=payment_id)
+        .update(status="failed")
+    )
+    if superseded:
+        logger.warning(f"{superseded} duplicate pending payment(s) for {checkout_request_id} marked failed")
+
+    payment = Payment.objects.select_related("user__referred_by").get(id=payment_id)
+    user = payment.user
+
+    # The M-PESA payment funds the rental directly: lock it until maturity
+    WalletService.deposit_locked(user, amount, reference=f"payment:{payment.id}")
+
+    Rental.objects.create(
+        user=user,
+        currency=payment.currency,
+        amount=amount,
+        expected_return=amount * 2,
+        status="active",
+        duration_days=20,
+        referrer=user.referred_by,
+        referral_reward_given=user.referred_by_id is not None,
+    )
+    reward = process_referral_reward(user, amount)
+
+    logger.info(f"Settled {checkout_request_id} for {user.email}: rental of {amount}, referral reward {reward}")
+    return "completed", ""
+
+
+# ---------------------------#
+# Callback inbox
+# ---------------------------#
+def drain_callback_inbox(batch_size=100):
+    """
+    Settle up to `batch_size` unprocessed callbacks in one transaction.
+    Each callback runs in its own savepoint so one bad payload does not
+    roll back the rest of the batch. A callback whose settlement raises
+    (deadlock, lock wait timeout) stays unprocessed and is retried with
+    a doubling delay until MPESA_CALLBACK_MAX_ATTEMPTS. Returns
+    {outcome: count}.
+    """
+    max_attempts = getattr(settings, "MPESA_CALLBACK_MAX_ATTEMPTS", 5)
+    retry_delay = getattr(settings, "MPESA_CALLBACK_RETRY_DELAY", 30)
+    counts = {}
+    with transaction.atomic():
+        now = timezone.now()
+        callbacks = list(
+            MpesaCallback.objects.select_for_update(skip_locked=True)
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now), processed_at__isnull=True)
+            .order_by("id")[:batch_size]
+        )
+        for callback in callbacks:
+            try:
+                stk_callback = parse_stk_callback(callback.raw_body)
+            except (ValueError, AttributeError) as e:
+                outcome, detail = "invalid", f"Unreadable body: {e}"
+            else:
+                try:
+                    with transaction.atomic():
+                        outcome, detail = settle_stk_callback(stk_callback)
+                except Exception as e:
+                    logger.exception(f"Error settling M-PESA callback {callback.id} (attempt {callback.attempts + 1})")
+                    outcome, detail = "error", str(e)
+
+            if outcome == "error":
+                callback.attempts += 1
+                callback.last_error = detail
+                if callback.attempts < max_attempts:
+                    callback.next_attempt_at = now + timedelta(seconds=retry_delay * 2 ** (callback.attempts - 1))
+                else:
+                    logger.error(f"Giving up on M-PESA callback {callback.id} after {callback.attempts} attempts")
+                    callback.processed_at = now
+            else:
+                callback.processed_at = now
+            callback.outcome = outcome
+            callback.detail = detail[:255]
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+        MpesaCallback.objects.bulk_update(
+            callbacks, ["processed_at", "outcome", "detail", "attempts", "last_error", "next_attempt_at"]
+        )
+    return counts
+
+
+# ---------------------------#
+# Stale pending reconciliation
+# ---------------------------#
+def stale_pending_payments(older_than, chunk_size):
+    """Yield chunks of pending STK payments older than `older_than`, keyset-paginated on id."""
+    cutoff = timezone.now() - older_than
+    last_id = 0
+    while True:
+        chunk = list(
+            Payment.objects.filter(
+                status="pending", checkout_request_id__isnull=False, created_at__lt=cutoff, id__gt=last_id
+            )
+            .order_by("id")
+            .values("id", "checkout_request_id", "amount_deducted")[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]["id"]
+
+
+def reconcile_payment(row, expired, limiter):
+    """
+    Query Daraja for one stale payment and settle it through the callback
+    path. Payments Daraja cannot resolve are failed once their M-PESA
+    mapping has expired. Returns the settlement outcome.
+    """
+    checkout_request_id = row["checkout_request_id"]
+    limiter.wait()
+    try:
+        http_status, data = query_stk_status(checkout_request_id)
+    except (requests.RequestException, RuntimeError, ValueError) as e:
+        logger.warning(f"STK query for {checkout_request_id} failed: {e}")
+        return "error"
+
+    result_code = data.get("ResultCode")
+    if result_code is None:
+        # Error envelope, e.g. "The transaction is being processed"
+        if not expired:
+            return "pending"
+        stk_callback = {"CheckoutRequestID": checkout_request_id, "ResultCode": -1, "ResultDesc": "Expired without a result"}
+    else:
+        stk_callback = {
+            "CheckoutRequestID": checkout_request_id,
+            "ResultCode": int(result_code),
+            "ResultDesc": data.get("ResultDesc", ""),
+        }
+        if stk_callback["ResultCode"] == 0:
+            stk_callback["CallbackMetadata"] = {"Item": [{"Name": "Amount", "Value": str(row["amount_deducted"])}]}
+
+    with transaction.atomic():
+        outcome, _ = settle_stk_callback(stk_callback)
+    return outcome
+
+
+def fail_unknown_pushes(older_than=UNKNOWN_PUSH_TTL):
+    """
+    Fail pending payments whose STK push outcome was unknown and that no
+    callback was matched to within `older_than`. They have no
+    CheckoutRequestID, so Daraja cannot be queried for them. Returns the count.
+    """
+    failed = Payment.objects.filter(
+        status="pending",
+        checkout_request_id__isnull=True,
+        stk_push_job__status="unknown",
+        created_at__lt=timezone.now() - older_than,
+    ).update(status="failed")
+    if failed:
+        logger.warning(f"{failed} payment(s) with an unknown STK push outcome got no callback; marked failed")
+    return failed
+
+
+def reconcile_stale_payments(older_than, chunk_size=100, concurrency=4, rate=5.0):
+    """
+    Resolve pending payments whose callback never arrived, `chunk_size` at
+    a time, with at most `concurrency` STK queries in flight and no more
+    than `rate` queries per second. Returns {outcome: count}.
+    """
+    limiter = RateLimiter(rate)
+    counts = {}
+
+    def run(args):
+        try:
+            return reconcile_payment(*args)
+        except Exception:
+            logger.exception(f"Unexpected error reconciling payment {args[0]['id']}")
+            return "error"
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for chunk in stale_pending_payments(older_than, chunk_size):
+            now = timezone.now()
+            expired = set(
+                MpesaTransactionMapping.objects.filter(
+                    checkout_request_id__in=[row["checkout_request_id"] for row in chunk], expires_at__lt=now
+                ).values_list("checkout_request_id", flat=True)
+            )
+            tasks = [(row, row["checkout_request_id"] in expired, limiter) for row in chunk]
+            for outcome in pool.map(run, tasks):
+                counts[outcome] = counts.get(outcome, 0) + 1
+
+    unknown_failed = fail_unknown_pushes()
+    if unknown_failed:
+        counts["unknown_failed"] = unknown_failed
+    return counts
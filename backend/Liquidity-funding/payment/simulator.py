@@ -0,0 +1,265 @@
+# payments/simulator.py
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------#
+# Local Daraja simulator
+# ---------------------------#
+class DarajaSimulator:
+    """
+    Local stand-in for the Safaricom Daraja API used for offline testing
+    and load runs. Point MPESA_BASE_URL at it.
+
+    Serves OAuth, STK push, STK push query and B2C requests with a
+    configurable latency and failure rate, and posts STK results back to
+    the CallBackURL of each push (or `callback_url` when set) after
+    `callback_delay` seconds, as Daraja does.
+
+    For tests: the first `fail_first` requests get a 503, OAuth replies
+    wait `oauth_delay` seconds and hand out `access_token` (a fresh one
+    per request when None), `stk_response`/`stk_status` replace the STK
+    push reply (e.g. a rejection), `query_results` maps CheckoutRequestIDs
+    to fixed STK query replies (a 500 when they carry an errorCode), and
+    `send_callbacks=False` keeps results from being posted back. Every
+    request is logged in `requests` as (method, path, body).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0, jitter_ms=0, failure_rate=0.0,
+                 cancel_rate=0.0, callback_delay=1.0, callback_url=None, seed=None,
+                 fail_first=0, oauth_delay=0, access_token=None, expires_in="3599",
+                 stk_response=None, stk_status=200, query_results=None, send_callbacks=True):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.cancel_rate = cancel_rate
+        self.callback_delay = callback_delay
+        self.callback_url = callback_url
+        self.fail_first = fail_first
+        self.oauth_delay = oauth_delay
+        self.access_token = access_token
+        self.expires_in = expires_in
+        self.stk_response = stk_response
+        self.stk_status = stk_status
+        self.query_results = query_results or {}
+        self.send_callbacks = send_callbacks
+        self.requests = []
+        self.random = random.Random(seed)
+        self.transactions = {}  # CheckoutRequestID -> result dict (None while pending)
+        self.counters = {"oauth": 0, "stk_push": 0, "stk_query": 0, "b2c": 0, "failures": 0, "callbacks": 0, "callback_errors": 0}
+        self._lock = threading.Lock()
+        self._callback_session = requests.Session()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    # -----------------------
+    # Lifecycle
+    # -----------------------
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -----------------------
+    # Behaviour
+    # -----------------------
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def _simulate_latency(self):
+        delay = self.latency_ms + (self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+
+    def _should_fail(self):
+        with self._lock:
+            return self.random.random() < self.failure_rate
+
+    def _log(self, method, path, body):
+        """Record a request; returns whether it is one of the first `fail_first`."""
+        with self._lock:
+            self.requests.append((method, path, body))
+            return len(self.requests) <= self.fail_first
+
+    @property
+    def stk_pushes(self):
+        return [r for r in self.requests if r[1].startswith("/mpesa/stkpush/")]
+
+    @property
+    def stk_queries(self):
+        return [r for r in self.requests if r[1].startswith("/mpesa/stkpushquery/")]
+
+    @property
+    def token_requests(self):
+        return [r for r in self.requests if r[1].startswith("/oauth/")]
+
+    def _result_for(self, checkout_request_id, amount, phone):
+        with self._lock:
+            cancelled = self.random.random() < self.cancel_rate
+        if cancelled:
+            return {"ResultCode": 1032, "ResultDesc": "Request cancelled by user"}
+        return {
+            "ResultCode": 0,
+            "ResultDesc": "The service request is processed successfully.",
+            "CallbackMetadata": {"Item": [
+                {"Name": "Amount", "Value": amount},
+                {"Name": "MpesaReceiptNumber", "Value": uuid.uuid4().hex[:10].upper()},
+                {"Name": "TransactionDate", "Value": int(time.strftime("%Y%m%d%H%M%S"))},
+                {"Name": "PhoneNumber", "Value": int(phone) if str(phone).isdigit() else phone},
+            ]},
+        }
+
+    def _deliver_callback(self, url, merchant_request_id, checkout_request_id, result):
+        time.sleep(self.callback_delay)
+        with self._lock:
+            self.transactions[checkout_request_id] = result
+        body = {"Body": {"stkCallback": {
+            "MerchantRequestID": merchant_request_id,
+            "CheckoutRequestID": checkout_request_id,
+            **result,
+        }}}
+        try:
+            self._callback_session.post(url, json=body, timeout=10)
+            self._count("callbacks")
+        except requests.RequestException as e:
+            self._count("callback_errors")
+            logger.warning(f"Simulator callback to {url} failed: {e}")
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code, body):
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    return json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return {}
+
+            def _fail(self):
+                simulator._count("failures")
+                self._reply(503, {"requestId": uuid.uuid4().hex, "errorCode": "503.001.01", "errorMessage": "Service Unavailable"})
+
+            def do_GET(self):
+                fail_first = simulator._log("GET", self.path, None)
+                simulator._simulate_latency()
+                if not self.path.startswith("/oauth/v1/generate"):
+                    return self._reply(404, {"errorMessage": "Not Found"})
+                simulator._count("oauth")
+                if fail_first or simulator._should_fail():
+                    return self._fail()
+                if simulator.oauth_delay:
+                    time.sleep(simulator.oauth_delay)
+                self._reply(200, {
+                    "access_token": simulator.access_token or uuid.uuid4().hex,
+                    "expires_in": simulator.expires_in,
+                })
+
+            def do_POST(self):
+                body = self._body()
+                fail_first = simulator._log("POST", self.path, body)
+                simulator._simulate_latency()
+                if fail_first:
+                    return self._fail()
+                if self.path.startswith("/mpesa/stkpush/v1/processrequest"):
+                    return self._stk_push(body)
+                if self.path.startswith("/mpesa/stkpushquery/v1/query"):
+                    return self._stk_query(body)
+                if self.path.startswith("/mpesa/b2c/"):
+                    return self._b2c(body)
+                self._reply(404, {"errorMessage": "Not Found"})
+
+            def _stk_push(self, body):
+                simulator._count("stk_push")
+                if simulator._should_fail():
+                    return self._fail()
+                if simulator.stk_response is not None:
+                    return self._reply(simulator.stk_status, simulator.stk_response)
+                merchant_request_id = uuid.uuid4().hex[:20]
+                checkout_request_id = f"ws_CO_{uuid.uuid4().hex[:24]}"
+                with simulator._lock:
+                    simulator.transactions[checkout_request_id] = None
+                result = simulator._result_for(checkout_request_id, body.get("Amount"), body.get("PhoneNumber"))
+                callback_url = simulator.callback_url or body.get("CallBackURL")
+                if callback_url and simulator.send_callbacks:
+                    threading.Thread(
+                        target=simulator._deliver_callback,
+                        args=(callback_url, merchant_request_id, checkout_request_id, result),
+                        daemon=True,
+                    ).start()
+                self._reply(200, {
+                    "MerchantRequestID": merchant_request_id,
+                    "CheckoutRequestID": checkout_request_id,
+                    "ResponseCode": "0",
+                    "ResponseDescription": "Success. Request accepted for processing",
+                    "CustomerMessage": "Success. Request accepted for processing",
+                })
+
+            def _stk_query(self, body):
+                simulator._count("stk_query")
+                if simulator._should_fail():
+                    return self._fail()
+                checkout_request_id = body.get("CheckoutRequestID")
+                if checkout_request_id in simulator.query_results:
+                    result = simulator.query_results[checkout_request_id]
+                    return self._reply(500 if "errorCode" in result else 200, result)
+                with simulator._lock:
+                    known = checkout_request_id in simulator.transactions
+                    result = simulator.transactions.get(checkout_request_id)
+                if not known:
+                    return self._reply(400, {"errorCode": "400.002.02", "errorMessage": "Bad Request - Invalid CheckoutRequestID"})
+                if result is None:
+                    return self._reply(500, {"errorCode": "500.001.1001", "errorMessage": "The transaction is being processed"})
+                self._reply(200, {
+                    "ResponseCode": "0",
+                    "ResponseDescription": "The service request has been accepted successsfully",
+                    "CheckoutRequestID": checkout_request_id,
+                    "ResultCode": str(result["ResultCode"]),
+                    "ResultDesc": result["ResultDesc"],
+                })
+
+            def _b2c(self, body):
+                simulator._count("b2c")
+                if simulator._should_fail():
+                    return self._fail()
+                self._reply(200, {
+                    "ConversationID": f"AG_{uuid.uuid4().hex[:20]}",
+                    "OriginatorConversationID": uuid.uuid4().hex[:20],
+                    "ResponseCode": "0",
+                    "ResponseDescription": "Accept the service request successfully.",
+                })
+
+        return Handler
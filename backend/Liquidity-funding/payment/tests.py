@@ -1,3 +1,804 @@
-from django.test import TestCase
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from http.client import RemoteDisconnected
+from io import StringIO
+from unittest import skipIf
+from unittest.mock import patch
 
-# Create your tests here.
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from Users.models import CustomUser, KYCProfile, Referral
+from .jobs import claim_stk_push_jobs, run_stk_push_batch
+from .caches import ThrottledCullFileCache
+from .ledger import ledger_balances, post, post_entries, rebuild_wallet_balances
+from .models import LedgerEntry, MpesaCallback, MpesaTransactionMapping, Payment, StkPushJob, Wallet
+from .mpesa import DarajaClient, MpesaTokenProvider, query_stk_status
+from .settlement import drain_callback_inbox, fail_unknown_pushes, reconcile_stale_payments, settle_stk_callback
+from .simulator import DarajaSimulator
+from .wallets import WalletService
+from rentals.maturity import due_rentals
+from rentals.models import Rental
+from withdrawal.models import Withdrawal
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "mpesa": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "mpesa-tests"},
+    "wallets": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "wallets-tests"},
+}
+
+
+def daraja_simulator(**options):
+    """A DarajaSimulator with a fixed token that posts no callbacks, for the pipeline tests."""
+    return DarajaSimulator(**{"access_token": "test-token", "send_callbacks": False, **options})
+
+
+class AsyncStkPushTests(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def initiate(self, currency="CAD"):
+        return self.client.post("/api/payments/mpesa/initiate/", {"phone": "0712345678", "currency": currency}, format="json")
+
+    def test_initiate_returns_202_without_calling_daraja(self):
+        with daraja_simulator() as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            response = self.initiate()
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(daraja.requests, [])
+
+        job = StkPushJob.objects.get(tracking_id=response.data["tracking_id"])
+        self.assertEqual(job.status, "queued")
+        self.assertEqual(job.phone_number, "254712345678")
+        self.assertEqual(job.payment.status, "pending")
+        self.assertIsNone(job.payment.checkout_request_id)
+
+    def test_worker_pool_sends_pushes_and_records_checkout_ids(self):
+        with daraja_simulator() as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            for currency in ("CAD", "AUD", "GBP", "JPY", "EUR"):
+                self.initiate(currency)
+            counts = run_stk_push_batch(workers=3, batch_size=10)
+            self.assertEqual(len(daraja.stk_pushes), 5)
+
+        self.assertEqual(counts, {"sent": 5})
+        checkout_ids = set(Payment.objects.values_list("checkout_request_id", flat=True))
+        self.assertEqual(len(checkout_ids), 5)
+        self.assertEqual(len(daraja.token_requests), 1)
+        self.assertNotIn(None, checkout_ids)
+        self.assertEqual(MpesaTransactionMapping.objects.count(), 5)
+
+        status_response = self.client.get(f"/api/payments/mpesa/status/{StkPushJob.objects.first().tracking_id}/")
+        self.assertEqual(status_response.data["push_status"], "sent")
+
+    def test_rejected_push_fails_payment(self):
+        rejection = {"requestId": "1", "errorCode": "400.002.02", "errorMessage": "Bad Request - Invalid PhoneNumber"}
+        with daraja_simulator(stk_response=rejection, stk_status=400) as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            self.initiate()
+            call_command("process_stk_pushes", stdout=open("/dev/null", "w"))
+
+        job = StkPushJob.objects.get()
+        self.assertEqual(job.status, "failed")
+        self.assertIn("Invalid PhoneNumber", job.last_error)
+        self.assertEqual(job.payment.status, "failed")
+
+    @override_settings(MPESA_BASE_URL="http://127.0.0.1:9", STK_PUSH_MAX_ATTEMPTS=2)
+    def test_transport_errors_are_retried_then_failed(self):
+        self.initiate()
+        self.assertEqual(run_stk_push_batch(workers=1), {"queued": 1})
+        self.assertEqual(run_stk_push_batch(workers=1), {"failed": 1})
+        self.assertEqual(StkPushJob.objects.get().attempts, 2)
+        self.assertEqual(Payment.objects.get().status, "failed")
+
+    def test_push_with_unknown_outcome_is_never_resent(self):
+        self.initiate()
+        with patch("payment.jobs.send_stk_push", side_effect=requests.ReadTimeout("Read timed out")) as send:
+            self.assertEqual(run_stk_push_batch(workers=1), {"unknown": 1})
+            self.assertEqual(run_stk_push_batch(workers=1), {})
+        self.assertEqual(send.call_count, 1)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.status, payment.stk_push_job.status), ("pending", "unknown"))
+
+        # Daraja did accept it: the callback is matched on phone and amount
+        callback = stk_callback_body("ws_CO_late", amount=int(payment.amount_deducted))["Body"]["stkCallback"]
+        with transaction.atomic():
+            self.assertEqual(settle_stk_callback(callback)[0], "completed")
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.checkout_request_id), ("completed", "ws_CO_late"))
+        self.assertEqual(StkPushJob.objects.get().status, "sent")
+
+    def test_dropped_connection_is_unknown_but_refused_connection_is_retried(self):
+        self.initiate()
+        dropped = requests.ConnectionError(ProtocolError("Connection aborted.", RemoteDisconnected("Remote end closed connection")))
+        with patch("payment.jobs.send_stk_push", side_effect=dropped):
+            self.assertEqual(run_stk_push_batch(workers=1), {"unknown": 1})
+
+        self.initiate()
+        refused = requests.ConnectionError(MaxRetryError(None, "/mpesa/stkpush/v1/processrequest", NewConnectionError(None, "Connection refused")))
+        with patch("payment.jobs.send_stk_push", side_effect=refused):
+            self.assertEqual(run_stk_push_batch(workers=1), {"queued": 1})
+        with patch("payment.jobs.send_stk_push", side_effect=requests.ConnectTimeout("Connect timed out")):
+            self.assertEqual(run_stk_push_batch(workers=1), {"queued": 1})
+
+    def test_unknown_push_without_callback_fails_after_a_day(self):
+        self.initiate()
+        StkPushJob.objects.update(status="unknown")
+        self.assertEqual(fail_unknown_pushes(), 0)
+        Payment.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(fail_unknown_pushes(), 1)
+        self.assertEqual(Payment.objects.get().status, "failed")
+
+    @override_settings(STK_PUSH_CLAIM_TIMEOUT=60)
+    def test_abandoned_sends_are_marked_unknown_not_reclaimed(self):
+        self.initiate()
+        self.assertEqual(len(claim_stk_push_jobs(10)), 1)
+        StkPushJob.objects.update(claimed_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(claim_stk_push_jobs(10), [])
+        job = StkPushJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ("unknown", 1))
+        self.assertEqual(job.payment.status, "pending")
+
+    def test_claimed_jobs_are_not_claimed_twice(self):
+        self.initiate()
+        self.assertEqual(len(claim_stk_push_jobs(10)), 1)
+        self.assertEqual(claim_stk_push_jobs(10), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MpesaTokenProviderTests(SimpleTestCase):
+    def test_token_is_reused_until_expiry(self):
+        provider = MpesaTokenProvider()
+        with daraja_simulator() as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            self.assertEqual(provider.get_token(), "test-token")
+            self.assertEqual(provider.get_token(), "test-token")
+            # A second provider (another worker process) reads the shared cache
+            self.assertEqual(MpesaTokenProvider().get_token(), "test-token")
+            self.assertEqual(len(daraja.token_requests), 1)
+
+    def test_token_refreshed_inside_refresh_margin(self):
+        provider = MpesaTokenProvider(refresh_margin=60)
+        with daraja_simulator(expires_in="30") as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            provider.get_token()
+            provider.get_token()
+            self.assertEqual(len(daraja.token_requests), 2)
+
+    def test_concurrent_callers_share_one_refresh(self):
+        provider = MpesaTokenProvider()
+        with daraja_simulator(oauth_delay=0.2) as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                tokens = list(pool.map(lambda _: provider.get_token(), range(8)))
+            self.assertEqual(set(tokens), {"test-token"})
+            self.assertEqual(len(daraja.token_requests), 1)
+
+    def test_waiter_neither_refreshes_nor_releases_anothers_lock(self):
+        provider = MpesaTokenProvider(lock_wait=0.3)
+        with daraja_simulator() as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            cache_key, lock_key = provider._keys()
+            caches["mpesa"].set(lock_key, "another-process", 60)
+            self.assertIsNone(provider.get_token())
+            self.assertEqual(daraja.token_requests, [])
+            self.assertEqual(caches["mpesa"].get(lock_key), "another-process")
+
+            # Once the other process publishes its token, waiters use it
+            caches["mpesa"].set(cache_key, {"access_token": "shared", "expires_at": time.time() + 3600, "base_url": daraja.url})
+            self.assertEqual(provider.get_token(), "shared")
+            self.assertEqual(daraja.token_requests, [])
+
+    def test_lock_outlives_the_slowest_fetch(self):
+        connect, read = DarajaClient.ENDPOINTS["oauth"]["timeout"]
+        self.assertGreater(MpesaTokenProvider()._lock_timeout(), (connect + read) * 3)
+
+    def test_invalidate_forces_refresh(self):
+        provider = MpesaTokenProvider()
+        with daraja_simulator() as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            provider.get_token()
+            provider.invalidate()
+            provider.get_token()
+            self.assertEqual(len(daraja.token_requests), 2)
+
+
+class DarajaClientTests(SimpleTestCase):
+    def test_idempotent_calls_are_retried(self):
+        client = DarajaClient(max_retries=2, backoff=0.01)
+        with daraja_simulator(fail_first=2) as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            response = client.request("oauth", "GET", params={"grant_type": "client_credentials"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(daraja.token_requests), 3)
+
+        stats = client.stats()["oauth"]
+        self.assertEqual((stats["calls"], stats["errors"], stats["retries"]), (3, 2, 2))
+
+    def test_stk_push_is_never_retried(self):
+        client = DarajaClient(max_retries=2, backoff=0.01)
+        with daraja_simulator(fail_first=1) as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            response = client.request("stk_push", "POST", json={})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(len(daraja.stk_pushes), 1)
+
+    def test_connections_are_reused(self):
+        client = DarajaClient()
+        with daraja_simulator() as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            for _ in range(3):
+                client.request("stk_push", "POST", json={})
+        pools = client.session.get_adapter(daraja.url).poolmanager.pools
+        self.assertEqual(sum(pools[key].num_connections for key in pools.keys()), 1)
+
+
+def stk_callback_body(checkout_request_id, result_code=0, amount=100, phone=254712345678):
+    callback = {"MerchantRequestID": "mr", "CheckoutRequestID": checkout_request_id, "ResultCode": result_code}
+    if result_code == 0:
+        callback["ResultDesc"] = "The service request is processed successfully."
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": f"R{checkout_request_id}"},
+            {"Name": "PhoneNumber", "Value": phone},
+        ]}
+    else:
+        callback["ResultDesc"] = "Request cancelled by user"
+    return {"Body": {"stkCallback": callback}}
+
+
+class CallbackInboxTests(TestCase):
+    def setUp(self):
+        self.referrer = CustomUser.objects.create_user(email="ref@example.com", full_name="Ref", password="Secret123!")
+        self.user = CustomUser.objects.create_user(
+            email="payer@example.com", full_name="Payer", password="Secret123!", referred_by=self.referrer
+        )
+
+    def pending_payment(self, checkout_request_id, amount=100):
+        return Payment.objects.create(
+            user=self.user, currency="CAD", amount_deducted=amount, status="pending",
+            checkout_request_id=checkout_request_id,
+        )
+
+    def post_callback(self, body):
+        return self.client.post("/api/payments/mpesa/callback/", body, content_type="application/json")
+
+    def test_callback_is_acknowledged_with_a_single_insert(self):
+        self.pending_payment("ws_CO_1")
+        with self.assertNumQueries(1):
+            response = self.post_callback(stk_callback_body("ws_CO_1"))
+        self.assertEqual(response.json()["ResultCode"], 0)
+        self.assertEqual(MpesaCallback.objects.count(), 1)
+        self.assertEqual(Payment.objects.get().status, "pending")
+
+    def test_drain_settles_callbacks_in_one_batch(self):
+        for i in range(3):
+            self.pending_payment(f"ws_CO_{i}")
+            self.post_callback(stk_callback_body(f"ws_CO_{i}"))
+        self.pending_payment("ws_CO_cancelled")
+        self.post_callback(stk_callback_body("ws_CO_cancelled", result_code=1032))
+        self.post_callback("not json")
+
+        counts = drain_callback_inbox(batch_size=10)
+
+        self.assertEqual(counts, {"completed": 3, "failed": 1, "invalid": 1})
+        self.assertEqual(Payment.objects.filter(status="completed").count(), 3)
+        self.assertEqual(Payment.objects.get(checkout_request_id="ws_CO_cancelled").status, "failed")
+        self.assertEqual(Rental.objects.filter(user=self.user, referrer=self.referrer).count(), 3)
+        self.assertEqual(Wallet.objects.get(user=self.user).rental_balance, 300)
+        self.assertEqual(Wallet.objects.get(user=self.referrer).balance, 150)
+        self.assertFalse(MpesaCallback.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(drain_callback_inbox(), {})
+
+    @override_settings(MPESA_CALLBACK_RETRY_DELAY=0)
+    def test_transient_failure_is_retried_on_the_next_drain(self):
+        self.pending_payment("ws_CO_retry")
+        self.post_callback(stk_callback_body("ws_CO_retry"))
+        with patch("payment.settlement.settle_stk_callback", side_effect=OperationalError("Deadlock found")):
+            self.assertEqual(drain_callback_inbox(), {"error": 1})
+
+        callback = MpesaCallback.objects.get()
+        self.assertIsNone(callback.processed_at)
+        self.assertEqual((callback.attempts, callback.last_error), (1, "Deadlock found"))
+        self.assertEqual(Payment.objects.get().status, "pending")
+
+        self.assertEqual(drain_callback_inbox(), {"completed": 1})
+        self.assertEqual(Payment.objects.get().status, "completed")
+        self.assertEqual(Wallet.objects.get(user=self.user).rental_balance, 100)
+
+    @override_settings(MPESA_CALLBACK_RETRY_DELAY=0, MPESA_CALLBACK_MAX_ATTEMPTS=2)
+    def test_retries_stop_at_the_cap(self):
+        self.post_callback(stk_callback_body("ws_CO_stuck"))
+        with patch("payment.settlement.settle_stk_callback", side_effect=OperationalError("Lock wait timeout")):
+            self.assertEqual(drain_callback_inbox(), {"error": 1})
+            self.assertEqual(drain_callback_inbox(), {"error": 1})
+            self.assertEqual(drain_callback_inbox(), {})
+        callback = MpesaCallback.objects.get()
+        self.assertEqual((callback.attempts, callback.outcome), (2, "error"))
+        self.assertIsNotNone(callback.processed_at)
+
+    def test_failed_attempt_waits_before_retrying(self):
+        self.post_callback(stk_callback_body("ws_CO_later"))
+        with patch("payment.settlement.settle_stk_callback", side_effect=OperationalError("Deadlock found")):
+            drain_callback_inbox()
+        self.assertEqual(drain_callback_inbox(), {})
+        self.assertGreater(MpesaCallback.objects.get().next_attempt_at, timezone.now())
+
+    def test_duplicate_callbacks_settle_once(self):
+        self.pending_payment("ws_CO_dup")
+        for _ in range(3):
+            self.post_callback(stk_callback_body("ws_CO_dup"))
+
+        self.assertEqual(drain_callback_inbox(), {"completed": 1, "duplicate": 2})
+        self.assertEqual(Rental.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Wallet.objects.get(user=self.user).rental_balance, 100)
+        self.assertEqual(Wallet.objects.get(user=self.referrer).balance, 50)
+
+    def test_duplicate_payment_rows_settle_only_one(self):
+        first = self.pending_payment("ws_CO_twice")
+        second = self.pending_payment("ws_CO_twice")
+        self.post_callback(stk_callback_body("ws_CO_twice"))
+        self.post_callback(stk_callback_body("ws_CO_twice"))
+
+        self.assertEqual(drain_callback_inbox(), {"completed": 1, "duplicate": 1})
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, second.status), ("completed", "failed"))
+        self.assertEqual(Rental.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Wallet.objects.get(user=self.user).rental_balance, 100)
+
+    def test_duplicate_callback_does_not_touch_wallets(self):
+        self.pending_payment("ws_CO_dup")
+        settle_stk_callback(stk_callback_body("ws_CO_dup")["Body"]["stkCallback"])
+        with self.assertNumQueries(2):
+            outcome, _ = settle_stk_callback(stk_callback_body("ws_CO_dup")["Body"]["stkCallback"])
+        self.assertEqual(outcome, "duplicate")
+
+
+class StalePaymentReconcilerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+
+    def stale_payment(self, checkout_request_id, minutes_old=30, mapping_expired=False):
+        payment = Payment.objects.create(
+            user=self.user, currency="CAD", amount_deducted=100, status="pending",
+            checkout_request_id=checkout_request_id,
+            created_at=timezone.now() - timedelta(minutes=minutes_old),
+        )
+        if mapping_expired:
+            MpesaTransactionMapping.objects.filter(checkout_request_id=checkout_request_id).update(
+                expires_at=timezone.now() - timedelta(minutes=1)
+            )
+        return payment
+
+    def test_stale_payments_are_settled_or_failed(self):
+        processing = {"errorCode": "500.001.1001", "errorMessage": "The transaction is being processed"}
+        results = {
+            "ws_CO_paid": {"ResultCode": "0", "ResultDesc": "The service request is processed successfully."},
+            "ws_CO_cancelled": {"ResultCode": "1032", "ResultDesc": "Request cancelled by user"},
+            "ws_CO_processing": processing,
+            "ws_CO_expired": processing,
+        }
+        self.stale_payment("ws_CO_paid")
+        self.stale_payment("ws_CO_cancelled")
+        self.stale_payment("ws_CO_processing")
+        self.stale_payment("ws_CO_expired", mapping_expired=True)
+        self.stale_payment("ws_CO_fresh", minutes_old=1)
+
+        with daraja_simulator(query_results=results) as daraja, override_settings(MPESA_BASE_URL=daraja.url):
+            counts = reconcile_stale_payments(timedelta(minutes=10), chunk_size=2, concurrency=2, rate=50)
+            queried = {body["CheckoutRequestID"] for _, _, body in daraja.stk_queries}
+            self.assertEqual(queried, {"ws_CO_paid", "ws_CO_cancelled", "ws_CO_processing", "ws_CO_expired"})
+
+        self.assertEqual(counts, {"completed": 1, "failed": 2, "pending": 1})
+        statuses = dict(Payment.objects.values_list("checkout_request_id", "status"))
+        self.assertEqual(statuses, {
+            "ws_CO_paid": "completed",
+            "ws_CO_cancelled": "failed",
+            "ws_CO_processing": "pending",
+            "ws_CO_expired": "failed",
+            "ws_CO_fresh": "pending",
+        })
+        self.assertEqual(Rental.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Wallet.objects.get(user=self.user).rental_balance, 100)
+
+
+class DarajaSimulatorEndToEndTests(LiveServerTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def wait_for_callbacks(self, count, timeout=10):
+        deadline = time.monotonic() + timeout
+        while MpesaCallback.objects.count() < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def test_payments_settle_through_simulator_callbacks(self):
+        callback_url = f"{self.live_server_url}/api/payments/mpesa/callback/"
+        with DarajaSimulator(latency_ms=5, callback_delay=0.1, seed=7) as simulator, \
+                override_settings(MPESA_BASE_URL=simulator.url, MPESA_CALLBACK_URL=callback_url):
+            tracking_ids = [
+                self.client.post("/api/payments/mpesa/initiate/", {"phone": "0712345678", "currency": currency}, format="json").data["tracking_id"]
+                for currency in ("CAD", "AUD", "GBP")
+            ]
+            self.assertEqual(run_stk_push_batch(workers=3, batch_size=10), {"sent": 3})
+            self.wait_for_callbacks(3)
+            self.assertEqual(simulator.counters["callbacks"], 3)
+
+        self.assertEqual(drain_callback_inbox(), {"completed": 3})
+        for tracking_id in tracking_ids:
+            response = self.client.get(f"/api/payments/mpesa/status/{tracking_id}/")
+            self.assertEqual(response.data["payment_status"], "completed")
+        self.assertEqual(Wallet.objects.get(user=self.user).rental_balance, 100 + 250 + 500)
+
+    def test_query_reports_cancelled_push(self):
+        with DarajaSimulator(cancel_rate=1.0, callback_delay=0, callback_url=f"{self.live_server_url}/api/payments/mpesa/callback/") as simulator, \
+                override_settings(MPESA_BASE_URL=simulator.url):
+            self.client.post("/api/payments/mpesa/initiate/", {"phone": "0712345678", "currency": "CAD"}, format="json")
+            run_stk_push_batch(workers=1, batch_size=1)
+            self.wait_for_callbacks(1)
+            checkout_request_id = Payment.objects.get().checkout_request_id
+            http_status, data = query_stk_status(checkout_request_id)
+
+        self.assertEqual((http_status, data["ResultCode"]), (200, "1032"))
+        self.assertEqual(drain_callback_inbox(), {"failed": 1})
+
+
+class PaymentHistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        other = CustomUser.objects.create_user(email="other@example.com", full_name="Other", password="Secret123!")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        base = timezone.now() - timedelta(days=1)
+        # Two payments share each timestamp to exercise the id tie-breaker
+        for i in range(7):
+            Payment.objects.create(user=self.user, currency="CAD", amount_deducted=100, created_at=base + timedelta(minutes=i // 2))
+        Payment.objects.create(user=other, currency="CAD", amount_deducted=100)
+
+    def test_pages_cover_history_exactly_once(self):
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+            response = self.client.get("/api/payments/history/", params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data["payments"]), 3)
+            seen.extend(p["id"] for p in response.data["payments"])
+            cursor = response.data["next_cursor"]
+            if not cursor:
+                break
+
+        expected = list(Payment.objects.filter(user=self.user).order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_unpaged_request_returns_the_whole_history(self):
+        for _ in range(60):
+            Payment.objects.create(user=self.user, currency="CAD", amount_deducted=100)
+        response = self.client.get("/api/payments/history/")
+        self.assertEqual(len(response.data["payments"]), 67)
+        self.assertIsNone(response.data["next_cursor"])
+        self.assertEqual(len(self.client.get("/api/payments/history/", {"limit": 50}).data["payments"]), 50)
+
+    def test_since_returns_only_newer_payments(self):
+        latest = Payment.objects.create(user=self.user, currency="AUD", amount_deducted=250)
+        since = (latest.created_at - timedelta(seconds=1)).isoformat()
+        response = self.client.get("/api/payments/history/", {"since": since})
+        self.assertEqual([p["id"] for p in response.data["payments"]], [latest.id])
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get("/api/payments/history/", {"cursor": "not-a-cursor"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/payments/history/", {"since": "yesterday"}).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AdminPaymentsOverviewTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(email="admin@example.com", full_name="Admin", password="Secret123!")
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        old = timezone.now() - timedelta(days=10)
+        Payment.objects.create(user=self.user, currency="CAD", amount_deducted=100, status="completed")
+        Payment.objects.create(user=self.user, currency="CAD", amount_deducted=100, status="completed")
+        Payment.objects.create(user=self.user, currency="CAD", amount_deducted=100, status="failed")
+        Payment.objects.create(user=self.user, currency="EUR", amount_deducted=1000, status="completed")
+        Payment.objects.create(user=self.admin, currency="USD", amount_deducted=1200, status="completed", created_at=old)
+
+    def tearDown(self):
+        caches["wallets"].clear()
+
+    def test_totals_are_grouped_by_currency_and_status(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/payments/admin/overview/", {"limit": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["payments"]), 2)
+        self.assertIsNotNone(response.data["next_cursor"])
+        self.assertEqual(response.data["totals_by_currency"], {"CAD": 200, "EUR": 1000, "USD": 1200})
+        self.assertEqual(response.data["counts_by_status"], {"completed": 4, "failed": 1})
+        self.assertEqual(response.data["grand_total"], 2500)
+        self.assertEqual(response.data["completed_total"], 2400)
+
+    def test_summary_is_cached_between_pages(self):
+        first = self.client.get("/api/payments/admin/overview/", {"limit": 2})
+        with self.assertNumQueries(1):
+            self.client.get("/api/payments/admin/overview/", {"limit": 2, "cursor": first.data["next_cursor"]})
+
+    def test_date_and_user_filters(self):
+        today = timezone.localdate().isoformat()
+        response = self.client.get("/api/payments/admin/overview/", {"date_from": today, "date_to": today})
+        self.assertEqual(response.data["totals_by_currency"], {"CAD": 200, "EUR": 1000})
+
+        response = self.client.get("/api/payments/admin/overview/", {"user_id": self.admin.id})
+        self.assertEqual([p["currency"] for p in response.data["payments"]], ["USD"])
+        self.assertEqual(self.client.get("/api/payments/admin/overview/", {"date_from": "soon"}).status_code, 400)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        self.admin = CustomUser.objects.create_superuser(email="admin@example.com", full_name="Admin", password="Secret123!")
+        self.client = APIClient()
+
+    def wallet(self):
+        return Wallet.objects.get(user=self.user)
+
+    def test_postings_update_projection(self):
+        post_entries(self.user, [("deposit", 500, "payment:1"), ("rental_lock", 200, "payment:1")])
+        post(self.user, "referral_reward", 50)
+        wallet = self.wallet()
+        self.assertEqual((wallet.balance, wallet.rental_balance), (350, 200))
+        self.assertEqual(LedgerEntry.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(ledger_balances([self.user.id])[self.user.id], {"balance": 350, "rental_balance": 200})
+
+    def test_rental_completion_posts_unlock_and_profit(self):
+        post_entries(self.user, [("deposit", 100, ""), ("rental_lock", 100, "")])
+        self.assertTrue(WalletService.unlock(self.user, Decimal("100"), profit=Decimal("100"), reference="rental:1"))
+        wallet = self.wallet()
+        self.assertEqual((wallet.balance, wallet.rental_balance), (200, 0))
+        self.assertEqual(
+            list(LedgerEntry.objects.filter(reference="rental:1").values_list("entry_type", flat=True)),
+            ["rental_unlock", "rental_profit"],
+        )
+
+    def test_rejected_withdrawal_is_refunded_once(self):
+        post(self.user, "deposit", 1000)
+        self.client.force_authenticate(self.user)
+        response = self.client.post("/api/withdraw/", {"mobile_number": "0712345678", "amount": "400"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.wallet().balance, 600)
+
+        self.client.force_authenticate(self.admin)
+        self.client.post(f"/api/withdraw/reject/{response.data['withdrawal']['id']}/")
+        self.assertEqual(self.wallet().balance, 1000)
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="withdrawal_refund").count(), 1)
+
+    def test_rebuild_fixes_drifted_wallets(self):
+        post(self.user, "deposit", 300)
+        Wallet.objects.filter(user=self.user).update(balance=999)
+
+        checked, drifted = rebuild_wallet_balances(dry_run=True)
+        self.assertEqual([wallet.user_id for wallet, _ in drifted], [self.user.id])
+        self.assertEqual(self.wallet().balance, 999)
+
+        call_command("rebuild_wallets", stdout=StringIO())
+        self.assertEqual(self.wallet().balance, 300)
+        self.assertEqual(rebuild_wallet_balances()[1], [])
+
+    def test_entries_are_append_only(self):
+        entry = post(self.user, "deposit", 10)
+        entry.amount = 1000
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WalletServiceTests(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        WalletService.credit(self.user, 100)
+
+    def test_debit_is_conditional(self):
+        self.assertFalse(WalletService.debit(self.user, 150))
+        self.assertTrue(WalletService.debit(self.user, 60))
+        self.assertFalse(WalletService.lock(self.user, 50))
+        self.assertEqual(WalletService.balances(self.user), (40, 0))
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="withdrawal_hold").count(), 1)
+
+    def test_concurrent_debits_cannot_overspend(self):
+        def spend(_):
+            try:
+                return WalletService.lock(self.user.id, 30)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(spend, range(8)))
+
+        self.assertEqual(results.count(True), 3)
+        self.assertEqual(WalletService.balances(self.user), (10, 90))
+        self.assertEqual(rebuild_wallet_balances(dry_run=True)[1], [])
+
+    def test_withdrawal_request_rejects_overdraft(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post("/api/withdraw/", {"mobile_number": "0712345678", "amount": "500"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.user.withdrawals.exists())
+
+    def test_rental_creation_locks_funds(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post("/api/rentals/create/", {"amount": "80"}, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data["wallet_balances"]["available_balance"], 20)
+        self.assertEqual(client.post("/api/rentals/create/", {"amount": "80"}, format="json").status_code, 400)
+        self.assertEqual(Rental.objects.filter(user=self.user).count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BalanceCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        WalletService.credit(self.user, 100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_balance_is_served_from_cache_until_a_posting(self):
+        response = self.client.get("/api/payments/balance/")
+        self.assertEqual(response.data["available_balance"], 100)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/payments/balance/").data["total_balance"], 100)
+
+        WalletService.lock(self.user, 40)
+        response = self.client.get("/api/payments/balance/")
+        self.assertEqual((response.data["available_balance"], response.data["locked_rental_balance"]), (60, 40))
+
+    def test_unchanged_balance_returns_304(self):
+        etag = self.client.get("/api/payments/balance/")["ETag"]
+        response = self.client.get("/api/payments/balance/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        WalletService.credit(self.user, 5)
+        response = self.client.get("/api/payments/balance/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_rolled_back_posting_is_not_cached(self):
+        try:
+            with transaction.atomic():
+                WalletService.credit(self.user, 1000)
+                self.assertEqual(WalletService.balances(self.user)[0], 1100)
+                raise RuntimeError("abort")
+        except RuntimeError:
+            pass
+        self.assertEqual(WalletService.balances(self.user)[0], 100)
+
+
+    def test_batch_posting_bumps_versions_once_after_commit(self):
+        others = [
+            CustomUser.objects.create_user(email=f"other{i}@example.com", full_name="Other", password="Secret123!")
+            for i in range(3)
+        ]
+        for user in [self.user, *others]:
+            WalletService.balances(user)  # Warm the cache
+        wallets = caches["wallets"]
+        with patch.object(wallets, "set_many", wraps=wallets.set_many) as set_many, patch.object(wallets, "set", wraps=wallets.set) as set_one:
+            with transaction.atomic():
+                WalletService.credit_many([(user.id, 10, "referral_reward", "") for user in [self.user, *others]])
+                self.assertEqual(set_many.call_count + set_one.call_count, 0)  # Nothing while row locks are held
+                self.assertEqual(WalletService.balances(self.user)[0], 110)  # Reads inside see the posting
+        set_many.assert_called_once()
+        self.assertEqual(len(set_many.call_args.args[0]), 4)
+        self.assertEqual(set_one.call_count, 4)  # LocMemCache.set_many sets each key
+        self.assertEqual(WalletService.balances(others[0]), (10, 0))
+
+
+class ThrottledCullFileCacheTests(SimpleTestCase):
+    def test_directory_is_listed_once_per_interval(self):
+        with tempfile.TemporaryDirectory() as location:
+            cache = ThrottledCullFileCache(location, {"OPTIONS": {"MAX_ENTRIES": 3, "CULL_INTERVAL": 60}})
+            with patch.object(cache, "_list_cache_files", wraps=cache._list_cache_files) as listing:
+                for i in range(10):
+                    cache.set(f"key-{i}", i)
+            self.assertEqual(listing.call_count, 1)
+            self.assertEqual(cache.get("key-9"), 9)
+
+            cache._next_cull = 0.0
+            cache.set("key-10", 10)
+            self.assertLessEqual(len(cache._list_cache_files()), 10)
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN each hot query against realistically skewed data (most
+    rentals settled, most payments completed) and fail on a full table
+    scan, so a dropped or unusable index shows up here.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        users = CustomUser.objects.bulk_create([
+            CustomUser(email=f"user{i}@example.com", full_name=f"User {i}", referral_code=f"code{i:08d}")
+            for i in range(300)
+        ])
+        cls.user, cls.other = users[0], users[1]
+        Rental.objects.bulk_create([
+            Rental(
+                user=users[i % 300], currency="KES", amount=100, expected_return=200,
+                created_at=now - timedelta(days=i % 60), end_date=now - timedelta(days=i % 60 - 20),
+                status="active" if i % 20 == 0 else "completed", is_completed=i % 20 != 0,
+                referrer=users[(i + 1) % 300] if i % 7 == 0 else None, referral_reward_given=i % 50 != 0,
+            )
+            for i in range(6000)
+        ])
+        Payment.objects.bulk_create([
+            Payment(
+                user=users[i % 300], amount_deducted=100, created_at=now - timedelta(hours=i),
+                status="pending" if i % 40 == 0 else "completed", checkout_request_id=f"ws_CO_{i}",
+            )
+            for i in range(6000)
+        ])
+        Withdrawal.objects.bulk_create([
+            Withdrawal(user=users[i % 300], mobile_number="0712345678", amount=50,
+                       status="pending" if i % 25 == 0 else "paid")
+            for i in range(2000)
+        ])
+        Referral.objects.bulk_create([
+            Referral(referrer=users[i], referred=users[i + 1], referred_email=users[i + 1].email)
+            for i in range(299)
+        ])
+        KYCProfile.objects.bulk_create([
+            KYCProfile(user=user, full_name=user.full_name, email=user.email) for user in users
+        ])
+        if connection.vendor in ("sqlite", "postgresql"):
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        table = queryset.model._meta.db_table
+        full_scans = {
+            "sqlite": rf"SCAN {table}(?! USING)",
+            "mysql": r"\|\s*ALL\s*\|",
+            "postgresql": rf"Seq Scan on {table}",
+        }.get(connection.vendor)
+        if full_scans:
+            self.assertNotRegex(plan, full_scans, f"Full scan of {table}:\n{plan}")
+        return plan
+
+    def test_rental_queries(self):
+        now = timezone.now()
+        self.assertUsesIndex(due_rentals(now).order_by("end_date", "id")[:500])
+        self.assertUsesIndex(due_rentals(now).filter(user=self.user))
+        self.assertUsesIndex(Rental.objects.filter(user=self.user).order_by("-created_at"))
+        self.assertUsesIndex(Rental.objects.filter(user=self.user, status="active"))
+        self.assertUsesIndex(Rental.objects.filter(status="active", is_completed=False).order_by("-created_at"))
+
+    # SQLite gets "NOT referral_reward_given" from Django, which it cannot
+    # seek on; MySQL and PostgreSQL compare the flag and use the index
+    @skipIf(connection.vendor == "sqlite", "SQLite cannot use an index for NOT <boolean column>")
+    def test_unrewarded_referral_query(self):
+        self.assertUsesIndex(Rental.objects.filter(referrer__isnull=False, referral_reward_given=False))
+
+    def test_payment_queries(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            Payment.objects.filter(user=self.user, status="completed", created_at__year=now.year, created_at__month=now.month)
+        )
+        self.assertUsesIndex(Payment.objects.filter(user=self.user).order_by("-created_at", "-id")[:51])
+        self.assertUsesIndex(Payment.objects.filter(checkout_request_id="ws_CO_40", status="pending"))
+        self.assertUsesIndex(
+            Payment.objects.filter(
+                status="pending", checkout_request_id__isnull=False, created_at__lt=now, id__gt=0
+            ).order_by("id")[:100]
+        )
+
+    def test_withdrawal_and_user_queries(self):
+        self.assertUsesIndex(Withdrawal.objects.filter(user=self.user, status="pending"))
+        self.assertUsesIndex(Withdrawal.objects.filter(status="pending").order_by("-created_at"))
+        self.assertUsesIndex(Referral.objects.filter(referrer=self.user, referred=self.other))
+        self.assertUsesIndex(KYCProfile.objects.filter(user=self.user))
@@ -5,6 +5,7 @@ from .views import (
     PaymentHistoryView,
     AdminPaymentsOverviewView,
     MpesaPaymentView,
+    MpesaPaymentStatusView,
     MpesaCallbackView,
     EarningsView,
 )
@@ -23,12 +24,13 @@ urlpatterns = [
     # Mpesa payment endpoints
     # ---------------------------
     path("mpesa/initiate/", MpesaPaymentView.as_view(), name="mpesa-initiate"),
+    path("mpesa/status/<uuid:tracking_id>/", MpesaPaymentStatusView.as_view(), name="mpesa-status"),
     path("make/", MpesaPaymentView.as_view(), name="make-payment"),
     path("mpesa/callback/", MpesaCallbackView.as_view(), name="mpesa-callback"),
 
     # ---------------------------
     # Admin-only endpoint
-    # Optional filtering: ?user_id=<id>
+    # Optional filtering: ?user_id=<id>&date_from=<date>&date_to=<date>
     # ---------------------------
     path("admin/overview/", AdminPaymentsOverviewView.as_view(), name="admin-payments-overview"),
 ]
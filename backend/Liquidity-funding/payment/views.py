@@ -1,61 +1,34 @@
 # payments/views.py
-import requests
-import json
+import hashlib
 import logging
-import base64
+from datetime import timedelta
 from decimal import Decimal
-from datetime import datetime
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.conf import settings
 from django.http import JsonResponse
+from django.utils.http import parse_etags, quote_etag
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Sum
 from django.utils import timezone
 
-from .models import Payment, Wallet
-from .serializers import PaymentSerializer
-from Users.models import Referral
+from .models import Payment, StkPushJob, MpesaCallback
+from .jobs import enqueue_stk_push
+from .ledger import InsufficientFunds, cached_balances
+from .pagination import InvalidPageParameter, is_paged, keyset_page, parse_limit, parse_timestamp
+from .settlement import process_referral_reward
+from .wallets import WalletService
+from rentals.maturity import settle_user_due_rentals
 from rentals.models import Rental
 
 logger = logging.getLogger(__name__)
 
-def process_referral_reward(user, amount):
-    """
-    Process referral reward when a user rents a coin.
-    Gives 50% of rental amount to the referrer.
-    """
-    logger.info(f"Processing referral reward for user {user.email}, amount {amount}")
-    
-    if getattr(user, "referred_by", None):
-        reward = Decimal(str(amount)) / Decimal('2')  # 50% of rental amount
-        ref_wallet, _ = Wallet.objects.get_or_create(user=user.referred_by)
-        old_ref_balance = ref_wallet.balance
-        ref_wallet.balance += reward
-        ref_wallet.save(update_fields=["balance"])
-        
-        # Also update the referrer's wallet_balance field
-        old_user_ref_balance = user.referred_by.wallet_balance
-        user.referred_by.wallet_balance += reward
-        user.referred_by.save(update_fields=["wallet_balance"])
-
-        Referral.objects.update_or_create(
-            referrer=user.referred_by,
-            referred=user,
-            defaults={"reward": reward},
-        )
-        
-        logger.info(f"Referral reward processed: {reward} awarded to {user.referred_by.email} for {user.email}'s rental")
-        logger.info(f"Referrer wallet balance updated from {old_ref_balance} to {ref_wallet.balance}")
-        logger.info(f"Referrer user wallet_balance updated from {old_user_ref_balance} to {user.referred_by.wallet_balance}")
-        return reward
-    else:
-        logger.info(f"No referrer found for user {user.email}")
-    return 0
 User = get_user_model()
 
 # --- Currency Deduction Rules (amounts in KES) ---
@@ -90,21 +63,46 @@ def normalize_phone(phone):
 
 
 # ---------------------------#
-# Helper: Get M-PESA Access Token
+# Helper: Payments summary
 # ---------------------------#
-def get_mpesa_access_token():
-    """Fetch OAuth token from M-PESA API."""
-    url = f"{settings.MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
-    headers = {"Authorization": f"Basic {settings.MPESA_BASE64_ENCODED_CREDENTIALS}"}
-
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        token_data = response.json()
-        return token_data.get("access_token")
-    except requests.RequestException as e:
-        logger.error(f"M-PESA token request failed: {e}")
-        return None
+def payments_summary(payments, cache_key_parts):
+    """
+    Count and amount per (currency, status) from one GROUP BY query,
+    cached in the shared "wallets" cache for PAYMENTS_SUMMARY_CACHE_TTL
+    seconds per filter combination, so every worker serves the same totals.
+    grand_total sums every payment, as before; totals_by_currency and
+    completed_total count completed payments only.
+    """
+    key = "payments:admin-summary:" + ":".join(
+        part.isoformat() if hasattr(part, "isoformat") else str(part) for part in cache_key_parts
+    )
+    summary_cache = caches["wallets"]
+    summary = summary_cache.get(key)
+    if summary is not None:
+        return summary
+
+    breakdown = list(
+        payments.order_by()
+        .values("currency", "status")
+        .annotate(count=Count("id"), total=Sum("amount_deducted"))
+        .order_by("currency", "status")
+    )
+    totals_by_currency, counts_by_status = {}, {}
+    for row in breakdown:
+        counts_by_status[row["status"]] = counts_by_status.get(row["status"], 0) + row["count"]
+        if row["status"] == "completed":
+            totals_by_currency[row["currency"]] = row["total"]
+
+    summary = {
+        "breakdown": breakdown,
+        "totals_by_currency": totals_by_currency,
+        "counts_by_status": counts_by_status,
+        "grand_total": sum((row["total"] for row in breakdown), Decimal("0")),
+        "completed_total": sum(totals_by_currency.values(), Decimal("0")),
+        "generated_at": timezone.now(),
+    }
+    summary_cache.set(key, summary, getattr(settings, "PAYMENTS_SUMMARY_CACHE_TTL", 30))
+    return summary
 
 
 # ---------------------------#
@@ -114,8 +112,27 @@ class GetBalanceView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        wallet, _ = Wallet.objects.get_or_create(user=request.user)
-        return Response({"balance": wallet.balance}, status=status.HTTP_200_OK)
+        """
+        Cached wallet balances with an ETag; a poll that sends the last
+        ETag back in If-None-Match gets 304 Not Modified.
+        """
+        settle_user_due_rentals(request.user)
+        balances = cached_balances(request.user)
+        etag = quote_etag(
+            hashlib.sha1(f"{balances['available']}|{balances['locked']}".encode()).hexdigest()[:16]
+        )
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == "*"):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response({
+            "balance": balances["available"],
+            "available_balance": balances["available"],
+            "locked_rental_balance": balances["locked"],
+            "total_balance": balances["total"],
+        }, status=status.HTTP_200_OK, headers=headers)
 
 
 # ---------------------------#
@@ -148,220 +165,98 @@ class MpesaPaymentView(APIView):
                 logger.error("MPESA_CALLBACK_URL not set")
                 return Response({"error": "M-PESA callback URL not configured"}, status=500)
 
-            # Get M-PESA access token
-            access_token = get_mpesa_access_token()
-            if not access_token:
-                return Response({"error": "Failed to retrieve M-PESA access token"}, status=500)
-
-            # Generate current timestamp and password
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            password = base64.b64encode(f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode()).decode()
-
-            # Log environment and payload
-            logger.info(f"M-PESA Environment: {settings.MPESA_ENV}, Base URL: {settings.MPESA_BASE_URL}")
-
-            # Prepare STK Push
-            stk_url = f"{settings.MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest"
-            headers = {"Authorization": f"Bearer {access_token}"}
-            payload = {
-                "BusinessShortCode": settings.MPESA_SHORTCODE,
-                "Password": password,
-                "Timestamp": timestamp,
-                "TransactionType": "CustomerBuyGoodsOnline",
-                "Amount": amount,
-                "PartyA": phone,
-                "PartyB": settings.MPESA_TILL_NUMBER,
-                "PhoneNumber": phone,
-                "CallBackURL": settings.MPESA_CALLBACK_URL,
-                "AccountReference": card_currency,
-                "TransactionDesc": f"Wallet top-up via {card_currency}",
-            }
-
+            # Queue the STK push; a process_stk_pushes worker sends it to Daraja
+            job = enqueue_stk_push(request.user, card_currency, amount, phone)
+            return Response({
+                "message": "STK push queued. Check your phone for the M-PESA prompt.",
+                "tracking_id": str(job.tracking_id),
+                "payment_id": job.payment_id,
+                "status": job.status,
+            }, status=status.HTTP_202_ACCEPTED)
+        else:
+            # Deduct for currency rental
+            logger.info(f"Processing card payment for user {request.user.email}, amount {amount}, currency {card_currency}")
+            
             try:
-                response = requests.post(stk_url, json=payload, headers=headers, timeout=10)
-                data = response.json()
-                logger.info(f"STK Push initiated for {phone}: {json.dumps(data)}")
-                
-                # Store the CheckoutRequestID for callback matching
-                checkout_request_id = data.get('CheckoutRequestID')
-                if checkout_request_id:
-                    # Create a pending payment record to track this transaction
-                    Payment.objects.create(
+                with transaction.atomic():
+                    payment = Payment.objects.create(
                         user=request.user,
                         currency=card_currency,
                         amount_deducted=amount,
-                        status="pending",
-                        checkout_request_id=checkout_request_id,
+                        status="completed",
                     )
-                    logger.info(f"Created pending payment with CheckoutRequestID: {checkout_request_id}")
-                
-                return Response(data, status=response.status_code)
-            except requests.RequestException as e:
-                logger.error(f"STK Push request failed: {e}")
-                return Response({"error": "Failed to send STK Push request"}, status=500)
-            except Exception as e:
-                logger.exception("Unexpected error in STK Push")
-                return Response({"error": str(e)}, status=500)
-        else:
-            # Deduct for currency rental
-            logger.info(f"Processing card payment for user {request.user.email}, amount {amount}, currency {card_currency}")
-            
-            wallet, _ = Wallet.objects.get_or_create(user=request.user)
-            old_balance = wallet.balance
-            wallet.balance -= Decimal(str(amount))
-            wallet.save(update_fields=["balance"])
-            logger.info(f"Wallet balance updated from {old_balance} to {wallet.balance}")
-
-            # Also update the user's wallet_balance field
-            old_user_balance = request.user.wallet_balance
-            request.user.wallet_balance -= Decimal(str(amount))
-            request.user.save(update_fields=["wallet_balance"])
-            logger.info(f"User wallet_balance updated from {old_user_balance} to {request.user.wallet_balance}")
-
-            Payment.objects.create(
-                user=request.user,
-                currency=card_currency,
-                amount_deducted=amount,
-                status="completed",
-            )
-            logger.info(f"Payment record created for user {request.user.email}, amount {amount} {card_currency}")
-
-            Rental.objects.create(
-                user=request.user,
-                currency=card_currency,
-                amount=amount,
-                expected_return=amount * 2,
-                status="active",
-                duration_days=20,
-            )
-            logger.info(f"Rental created for user {request.user.email}, amount {amount} {card_currency}")
+                    # Pay for the rental from the wallet: available -> locked
+                    if not WalletService.lock(request.user, amount, reference=f"payment:{payment.id}"):
+                        raise InsufficientFunds()
+                    logger.info(f"Payment record created for user {request.user.email}, amount {amount} {card_currency}")
 
-            # Process referral reward (if user was referred)
-            reward = process_referral_reward(request.user, amount)
-            logger.info(f"Referral reward processing completed: {reward}")
+                    Rental.objects.create(
+                        user=request.user,
+                        currency=card_currency,
+                        amount=amount,
+                        expected_return=amount * 2,
+                        status="active",
+                        duration_days=20,
+                    )
+                    logger.info(f"Rental created for user {request.user.email}, amount {amount} {card_currency}")
 
+                    # Process referral reward (if user was referred)
+                    reward = process_referral_reward(request.user, amount)
+                    logger.info(f"Referral reward processing completed: {reward}")
+            except InsufficientFunds:
+                available, _ = WalletService.balances(request.user)
+                return Response({"error": f"Insufficient available balance. Available: {available}"}, status=400)
+
+            available, _ = WalletService.balances(request.user)
             return Response({
-                "new_balance": float(wallet.balance),
+                "new_balance": float(available),
                 "referral_reward": float(reward) if reward > 0 else None
             }, status=status.HTTP_200_OK)
 
 
+# ---------------------------#
+# 2b. STK Push Status (GET)
+# ---------------------------#
+class MpesaPaymentStatusView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, tracking_id):
+        try:
+            job = StkPushJob.objects.select_related("payment").get(
+                tracking_id=tracking_id, payment__user=request.user
+            )
+        except StkPushJob.DoesNotExist:
+            return Response({"error": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            "tracking_id": str(job.tracking_id),
+            "push_status": job.status,
+            "payment_id": job.payment_id,
+            "payment_status": job.payment.status,
+            "checkout_request_id": job.payment.checkout_request_id,
+            "error": job.last_error or None,
+        }, status=status.HTTP_200_OK)
+
+
 # ---------------------------#
 # 3. M-PESA Callback (POST)
 # ---------------------------#
 @method_decorator(csrf_exempt, name="dispatch")
 class MpesaCallbackView(APIView):
+    """
+    Acknowledge Daraja immediately: store the raw body in the callback inbox
+    and return. Settlement happens in the drain_mpesa_callbacks worker.
+    """
+    authentication_classes = []
     permission_classes = [permissions.AllowAny]
 
     def post(self, request):
         try:
-            data = request.data
-            logger.info("📥 M-PESA Callback: %s", json.dumps(data, indent=2))
-
-            stk_callback = data.get("Body", {}).get("stkCallback", {})
-            result_code = stk_callback.get("ResultCode")
-            checkout_request_id = stk_callback.get("CheckoutRequestID")
-
-            if result_code != 0:
-                logger.warning(f"M-PESA transaction failed with ResultCode: {result_code}, CheckoutRequestID: {checkout_request_id}")
-                # Update pending payment status to failed
-                if checkout_request_id:
-                    try:
-                        payment = Payment.objects.get(checkout_request_id=checkout_request_id, status="pending")
-                        payment.status = "failed"
-                        payment.save(update_fields=["status"])
-                        logger.info(f"Updated payment status to failed for CheckoutRequestID: {checkout_request_id}")
-                    except Payment.DoesNotExist:
-                        logger.warning(f"No pending payment found for CheckoutRequestID: {checkout_request_id}")
-                return JsonResponse({"ResultCode": 0, "ResultDesc": "Transaction failed or cancelled"})
-
-            metadata = stk_callback.get("CallbackMetadata", {})
-            amount, phone = None, None
-
-            for item in metadata.get("Item", []):
-                if item["Name"] == "Amount":
-                    amount = item["Value"]
-                elif item["Name"] == "PhoneNumber":
-                    phone = str(item["Value"])
-
-            if not amount:
-                return JsonResponse({"ResultCode": 1, "ResultDesc": "Missing Amount"})
-
-            # Find the pending payment using CheckoutRequestID (primary method)
-            payment = None
-            user = None
-            
-            if checkout_request_id:
-                try:
-                    payment = Payment.objects.get(checkout_request_id=checkout_request_id, status="pending")
-                    user = payment.user
-                    logger.info(f"Found pending payment for user {user.email} using CheckoutRequestID: {checkout_request_id}")
-                except Payment.DoesNotExist:
-                    logger.warning(f"No pending payment found for CheckoutRequestID: {checkout_request_id}")
-                    # Fallback to phone number method (less reliable)
-                    if phone:
-                        user = User.objects.filter(phone_number=phone).first()
-                        if user:
-                            logger.info(f"Fallback: Found user {user.email} using phone number {phone}")
-                        else:
-                            logger.warning(f"No user found for phone {phone}")
-                    else:
-                        logger.error("No phone number available for fallback")
-                    return JsonResponse({"ResultCode": 1, "ResultDesc": "Transaction not found"})
-            else:
-                logger.error("No CheckoutRequestID in callback")
-                return JsonResponse({"ResultCode": 1, "ResultDesc": "Missing CheckoutRequestID"})
-
-            if not user:
-                logger.error("No user found for transaction processing")
-                return JsonResponse({"ResultCode": 1, "ResultDesc": "User not found"})
-
-            logger.info(f"Processing M-PESA callback for user {user.email}, amount {amount}, CheckoutRequestID: {checkout_request_id}")
-
-            wallet, _ = Wallet.objects.get_or_create(user=user)
-            old_balance = wallet.balance
-            wallet.balance -= Decimal(str(amount))
-            wallet.save(update_fields=["balance"])
-            logger.info(f"Wallet balance updated from {old_balance} to {wallet.balance}")
-
-            # Also update the user's wallet_balance field
-            old_user_balance = user.wallet_balance
-            user.wallet_balance -= Decimal(str(amount))
-            user.save(update_fields=["wallet_balance"])
-            logger.info(f"User wallet_balance updated from {old_user_balance} to {user.wallet_balance}")
-
-            # Update the pending payment record to completed
-            if payment:
-                payment.status = "completed"
-                payment.save(update_fields=["status"])
-                logger.info(f"Updated payment status to completed for CheckoutRequestID: {checkout_request_id}")
-
-            # Create the rental record
-            Rental.objects.create(
-                user=user,
-                currency=payment.currency if payment else "KES",
-                amount=amount,
-                expected_return=amount * 2,
-                status="active",
-                duration_days=20,
-            )
-            logger.info(f"Rental created for user {user.email}, amount {amount}")
-
-            # Process referral reward (if user was referred)
-            reward = process_referral_reward(user, amount)
-            logger.info(f"Referral reward processing completed: {reward}")
-
-            return JsonResponse({
-                "ResultCode": 0, 
-                "ResultDesc": "Callback processed successfully",
-                "referral_reward": float(reward) if reward > 0 else None,
-                "user_email": user.email,
-                "amount": float(amount)
-            })
-
-        except Exception as e:
-            logger.exception("Error processing M-PESA callback")
-            return JsonResponse({"ResultCode": 1, "ResultDesc": f"Error: {str(e)}"})
+            MpesaCallback.objects.create(raw_body=request.body.decode("utf-8", errors="replace"))
+        except Exception:
+            logger.exception("Failed to store M-PESA callback")
+            return JsonResponse({"ResultCode": 1, "ResultDesc": "Temporary error, please retry"})
+        return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
 
 
 # ---------------------------#
@@ -371,9 +266,32 @@ class PaymentHistoryView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        payments = Payment.objects.filter(user=request.user).order_by("-created_at")
-        serializer = PaymentSerializer(payments, many=True)
-        return Response({"payments": serializer.data}, status=200)
+        """
+        Newest-first payment history, one keyset page at a time.
+        Query params: ?limit=<n>&cursor=<next_cursor> to page back,
+        ?since=<ISO datetime> to fetch only payments made after a refresh.
+        Without limit or cursor the whole history is returned.
+        """
+        try:
+            limit = parse_limit(request.query_params.get("limit")) if is_paged(request.query_params) else None
+            since = parse_timestamp(request.query_params.get("since"))
+            payments = Payment.objects.filter(user=request.user)
+            if since:
+                payments = payments.filter(created_at__gt=since)
+            rows, next_cursor = keyset_page(
+                payments.values("id", "currency", "amount_deducted", "status", "created_at"),
+                cursor=request.query_params.get("cursor"),
+                limit=limit,
+            )
+        except InvalidPageParameter as e:
+            return Response({"error": str(e)}, status=400)
+
+        for row in rows:
+            row["user"] = request.user.id
+            row["user_email"] = request.user.email
+            row["created_at"] = timezone.localtime(row["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+
+        return Response({"payments": rows, "next_cursor": next_cursor}, status=200)
 
 
 # ---------------------------#
@@ -383,18 +301,48 @@ class AdminPaymentsOverviewView(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def get(self, request):
-        user_id = request.query_params.get("user_id")
-        payments = Payment.objects.filter(user_id=user_id) if user_id else Payment.objects.all()
-        payments = payments.order_by("-created_at")
+        """
+        Payment totals per currency and status plus one keyset page of rows.
+        Query params: ?user_id=<id>, ?date_from=/?date_to=<ISO date or datetime>
+        (a bare date_to includes that whole day), ?limit=, ?cursor=.
+        """
+        params = request.query_params
+        try:
+            user_id = params.get("user_id") or None
+            if user_id is not None and not user_id.isdigit():
+                raise InvalidPageParameter("user_id must be an integer")
+            date_from = parse_timestamp(params.get("date_from"), name="date_from")
+            date_to = parse_timestamp(params.get("date_to"), name="date_to")
+            if date_to and len(params["date_to"]) == 10:
+                date_to += timedelta(days=1)
+            limit = parse_limit(params.get("limit"))
+
+            payments = Payment.objects.all()
+            if user_id:
+                payments = payments.filter(user_id=user_id)
+            if date_from:
+                payments = payments.filter(created_at__gte=date_from)
+            if date_to:
+                payments = payments.filter(created_at__lt=date_to)
+
+            rows, next_cursor = keyset_page(
+                payments.values("id", "user_id", "user__email", "currency", "amount_deducted", "status", "created_at"),
+                cursor=params.get("cursor"),
+                limit=limit,
+            )
+        except InvalidPageParameter as e:
+            return Response({"error": str(e)}, status=400)
 
-        serializer = PaymentSerializer(payments, many=True)
-        total_amount = payments.aggregate(total=Sum("amount_deducted"))["total"] or 0
+        for row in rows:
+            row["user"] = row.pop("user_id")
+            row["user_email"] = row.pop("user__email")
+            row["created_at"] = timezone.localtime(row["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
 
         return Response(
             {
-                "payments": serializer.data,
-                "totals_by_currency": {"KES": total_amount},
-                "grand_total": total_amount,
+                "payments": rows,
+                "next_cursor": next_cursor,
+                **payments_summary(payments, (user_id, date_from, date_to)),
             },
             status=200,
         )
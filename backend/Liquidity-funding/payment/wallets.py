@@ -0,0 +1,118 @@
+# payments/wallets.py
+import logging
+
+from .ledger import InsufficientFunds, cached_balances, post_entries, post_many
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------#
+# Wallet service
+# ---------------------------#
+class WalletService:
+    """
+    The only way to move wallet money.
+
+    Each call is one conditional UPDATE on the wallet row (for example
+    `balance = balance - x WHERE user_id = ? AND balance >= x`) plus the
+    matching ledger insert. Success is judged from the UPDATE's rowcount,
+    so concurrent requests can never both spend the same funds. Methods
+    return True on success and False when the wallet lacks the funds.
+    """
+    CREDIT_TYPES = {"deposit", "referral_reward", "admin_award", "withdrawal_refund"}
+
+    @staticmethod
+    def _apply(user, entries):
+        try:
+            post_entries(user, entries)
+            return True
+        except InsufficientFunds as e:
+            logger.info(str(e))
+            return False
+
+    @classmethod
+    def credit(cls, user, amount, entry_type="deposit", reference=""):
+        """Add money to the available balance."""
+        if entry_type not in cls.CREDIT_TYPES:
+            raise ValueError(f"{entry_type} is not a credit")
+        return cls._apply(user, [(entry_type, amount, reference)])
+
+    @classmethod
+    def debit(cls, user, amount, reference=""):
+        """Hold money from the available balance for a withdrawal, if there is enough."""
+        return cls._apply(user, [("withdrawal_hold", amount, reference)])
+
+    @classmethod
+    def payout(cls, user, amount, reference=""):
+        """Record that a held withdrawal left for M-PESA (no balance change)."""
+        return cls._apply(user, [("withdrawal_payout", amount, reference)])
+
+    @classmethod
+    def lock(cls, user, amount, reference=""):
+        """Move money from the available balance into rentals, if there is enough."""
+        return cls._apply(user, [("rental_lock", amount, reference)])
+
+    @classmethod
+    def deposit_locked(cls, user, amount, reference=""):
+        """Record an external payment that funds a rental directly."""
+        return cls._apply(user, [("deposit", amount, reference), ("rental_lock", amount, reference)])
+
+    @classmethod
+    def unlock(cls, user, amount, profit=0, reference=""):
+        """Release a matured rental's principal plus its profit to the available balance."""
+        return cls._apply(user, [("rental_unlock", amount, reference), ("rental_profit", profit, reference)])
+
+    @classmethod
+    def unlock_many(cls, releases):
+        """
+        Release many matured rentals at once: `releases` is a list of
+        (user_id, amount, profit, reference). One grouped UPDATE credits
+        each user's summed return; returns False (and writes nothing) if
+        any wallet lacks the locked funds.
+        """
+        entries_by_user = {}
+        for user_id, amount, profit, reference in releases:
+            entries_by_user.setdefault(user_id, []).extend([
+                ("rental_unlock", amount, reference),
+                ("rental_profit", profit, reference),
+            ])
+        try:
+            post_many(entries_by_user)
+            return True
+        except InsufficientFunds as e:
+            logger.info(str(e))
+            return False
+
+    @classmethod
+    def credit_many(cls, credits):
+        """
+        Credit many users at once: `credits` is a list of (user_id, amount,
+        entry_type, reference). One grouped UPDATE adds each user's summed
+        credits; returns False (and writes nothing) if a wallet is missing.
+        """
+        entries_by_user = {}
+        for user_id, amount, entry_type, reference in credits:
+            if entry_type not in cls.CREDIT_TYPES:
+                raise ValueError(f"{entry_type} is not a credit")
+            entries_by_user.setdefault(user_id, []).append((entry_type, amount, reference))
+        try:
+            post_many(entries_by_user)
+            return True
+        except InsufficientFunds as e:
+            logger.info(str(e))
+            return False
+
+    @classmethod
+    def payout_many(cls, payouts):
+        """Record many held withdrawals leaving for M-PESA: `payouts` is a list of (user_id, amount, reference)."""
+        entries_by_user = {}
+        for user_id, amount, reference in payouts:
+            entries_by_user.setdefault(user_id, []).append(("withdrawal_payout", amount, reference))
+        post_many(entries_by_user)
+        return True
+
+    @staticmethod
+    def balances(user):
+        """(available, locked) for the user's wallet from the balance cache; zeros if there is none."""
+        balances = cached_balances(user)
+        return balances["available"], balances["locked"]
@@ -0,0 +1,109 @@
+# rentals/forecast.py
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db.models import DateTimeField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from withdrawal.models import Withdrawal
+
+from .models import Rental
+from .referrals import REFERRAL_REWARD_RATE, unrewarded_rentals
+
+DEFAULT_HORIZON_DAYS = 60
+OUTSTANDING_WITHDRAWAL_STATUSES = ("pending", "approved", "processing")
+ZERO = Decimal("0.00")
+
+
+def _local_day(field, now):
+    """
+    The site-local calendar day of a datetime column, computed in the
+    database. Shifting by the UTC offset and truncating in UTC avoids
+    needing MySQL's time zone tables (Africa/Nairobi has no DST).
+    """
+    offset = timezone.localtime(now).utcoffset()
+    shifted = ExpressionWrapper(F(field) + offset, output_field=DateTimeField())
+    return TruncDate(shifted, tzinfo=dt_timezone.utc)
+
+
+def forecast_obligations(horizon_days=DEFAULT_HORIZON_DAYS, multiplier=None, duration_days=None, now=None):
+    """
+    Daily and weekly cash the platform owes over the next `horizon_days`.
+
+    Active rentals are grouped by payout day with one GROUP BY in the
+    database, so the book is never loaded row by row; the curve is then
+    built over the (at most horizon-sized) list of day buckets. Overdue
+    payouts, outstanding withdrawals and unpaid referral rewards all fall
+    on today.
+
+    What-if scenarios: `multiplier` pays amount * multiplier instead of
+    each rental's expected_return; `duration_days` moves every payout to
+    created_at + duration_days.
+    """
+    now = now or timezone.now()
+    today = timezone.localtime(now).date()
+    last_day = today + timedelta(days=horizon_days)
+
+    active = Rental.objects.filter(status="active", is_completed=False, end_date__isnull=False)
+    day_field = "created_at" if duration_days is not None else "end_date"
+    shift = timedelta(days=duration_days or 0)
+    grouped = (
+        active.annotate(day=_local_day(day_field, now))
+        .values("day")
+        .annotate(principal=Sum("amount"), returns=Sum("expected_return"))
+        .order_by()
+    )
+
+    rentals = [ZERO] * (horizon_days + 1)
+    beyond_horizon = ZERO
+    for row in grouped:
+        payout = row["principal"] * Decimal(str(multiplier)) if multiplier is not None else row["returns"]
+        day = max(row["day"] + shift, today)
+        if day > last_day:
+            beyond_horizon += payout
+        else:
+            rentals[(day - today).days] += payout
+
+    withdrawals = (
+        Withdrawal.objects.filter(status__in=OUTSTANDING_WITHDRAWAL_STATUSES).aggregate(total=Sum("amount"))["total"]
+        or ZERO
+    )
+    referral_rewards = (
+        unrewarded_rentals().aggregate(total=Sum("amount"))["total"]
+        or ZERO
+    ) * REFERRAL_REWARD_RATE
+
+    daily, cumulative = [], ZERO
+    for offset, rental_total in enumerate(rentals):
+        other = withdrawals + referral_rewards if offset == 0 else ZERO
+        total = rental_total + other
+        cumulative += total
+        daily.append({
+            "date": today + timedelta(days=offset),
+            "rentals": rental_total,
+            "withdrawals": withdrawals if offset == 0 else ZERO,
+            "referral_rewards": referral_rewards if offset == 0 else ZERO,
+            "total": total,
+            "cumulative": cumulative,
+        })
+
+    weekly = {}
+    for day in daily:
+        week_start = day["date"] - timedelta(days=day["date"].weekday())
+        weekly[week_start] = weekly.get(week_start, ZERO) + day["total"]
+
+    return {
+        "generated_at": now,
+        "horizon_days": horizon_days,
+        "scenario": {"multiplier": multiplier, "duration_days": duration_days},
+        "daily": daily,
+        "weekly": [{"week_start": week_start, "total": total} for week_start, total in weekly.items()],
+        "totals": {
+            "within_horizon": cumulative,
+            "beyond_horizon": beyond_horizon,
+            "rentals": sum(rentals, ZERO),
+            "withdrawals": withdrawals,
+            "referral_rewards": referral_rewards,
+        },
+    }
@@ -1,24 +1,34 @@
 
+import time
+
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.db import transaction
-from rentals.models import Rental
-from payment.models import Wallet
-from Users.models import Referral
+from rentals.maturity import DEFAULT_BATCH_SIZE, settle_matured_rentals, settle_matured_rentals_parallel
+from rentals.referrals import process_referral_rewards
 from decimal import Decimal
 
 
 class Command(BaseCommand):
     help = 'Complete rentals that have reached their end date and process referral rewards'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Matured rentals settled per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Report matured rentals without completing them')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes, each settling one user_id shard')
+
     def handle(self, *args, **options):
         now = timezone.now()
         
         # Complete matured rentals
-        completed_rentals = self.complete_matured_rentals(now)
+        completed_rentals = self.complete_matured_rentals(
+            now, options['batch_size'], options['dry_run'], options['workers']
+        )
+
+        if options['dry_run']:
+            return
         
         # Process referral rewards for new rentals
-        referral_rewards = self.process_referral_rewards()
+        referral_rewards = self.process_referral_rewards(options['batch_size'])
         
         # Summary
         self.stdout.write(
@@ -28,115 +38,51 @@ class Command(BaseCommand):
             self.style.SUCCESS(f'Processed {referral_rewards} referral rewards')
         )
 
-    def complete_matured_rentals(self, now):
-        """Complete rentals that have reached their end date"""
-        matured_rentals = Rental.objects.filter(
-            status='active',
-            is_completed=False,
-            end_date__lte=now
-        )
+    def complete_matured_rentals(self, now, batch_size=DEFAULT_BATCH_SIZE, dry_run=False, workers=1):
+        """Complete rentals that have reached their end date, one keyset batch per transaction"""
+        started = time.monotonic()
+        if workers > 1:
+            results = settle_matured_rentals_parallel(now, workers, batch_size, dry_run)
+        else:
+            results = [settle_matured_rentals(now, batch_size, dry_run=dry_run)]
+        elapsed = time.monotonic() - started
 
-        completed_count = 0
-        for rental in matured_rentals:
-            try:
-                with transaction.atomic():
-                    # Get user's wallet
-                    wallet = rental.user.wallet
-                    
-                    # Move money from rental_balance to balance (doubled amount)
-                    return_amount = rental.expected_return
-                    success = wallet.complete_rental(rental.amount, return_amount)
-                    
-                    if success:
-                        # Mark rental as completed
-                        rental.is_completed = True
-                        rental.completion_date = now
-                        rental.is_claimed = True
-                        rental.status = 'completed'
-                        rental.save()
-                        
-                        completed_count += 1
-                        self.stdout.write(
-                            self.style.SUCCESS(
-                                f'Completed rental {rental.unique_id} for user {rental.user.email}, '
-                                f'added {return_amount} to wallet balance'
-                            )
-                        )
-                    else:
-                        self.stdout.write(
-                            self.style.WARNING(
-                                f'Failed to complete rental {rental.unique_id} - insufficient rental balance'
-                            )
-                        )
-                        
-            except Exception as e:
+        action = 'would complete' if dry_run else 'completed'
+        for index, stats in enumerate(results):
+            for rental_id in stats['failed']:
                 self.stdout.write(
-                    self.style.ERROR(
-                        f'Error completing rental {rental.unique_id}: {str(e)}'
+                    self.style.WARNING(
+                        f'Failed to complete rental {rental_id} - insufficient rental balance'
                     )
                 )
-
-        return completed_count
-
-    def process_referral_rewards(self):
-        """Process referral rewards for rentals that haven't been rewarded yet"""
-        # Find rentals that have a referrer but haven't given referral reward
-        unrewarded_rentals = Rental.objects.filter(
-            referrer__isnull=False,
-            referral_reward_given=False
-        )
-
-        reward_count = 0
-        for rental in unrewarded_rentals:
-            try:
-                with transaction.atomic():
-                    # Calculate referral reward (50% of rental amount)
-                    reward_amount = rental.amount * Decimal('0.50')
-                    
-                    # Add reward to referrer's wallet
-                    referrer_wallet = rental.referrer.wallet
-                    referrer_wallet.add_referral_reward(reward_amount)
-                    
-                    # Update rental record
-                    rental.referral_reward_given = True
-                    rental.save()
-                    
-                    # Update referral record
-                    try:
-                        referral = Referral.objects.get(
-                            referrer=rental.referrer,
-                            referred=rental.user
-                        )
-                        referral.reward_given = True
-                        referral.rental_amount = rental.amount
-                        referral.reward_amount = reward_amount
-                        referral.save()
-                    except Referral.DoesNotExist:
-                        # Create referral record if it doesn't exist
-                        Referral.objects.create(
-                            referrer=rental.referrer,
-                            referred=rental.user,
-                            referred_email=rental.user.email,
-                            referred_name=rental.user.full_name,
-                            reward_given=True,
-                            rental_amount=rental.amount,
-                            reward_amount=reward_amount,
-                            status='completed'
-                        )
-                    
-                    reward_count += 1
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Given referral reward of {reward_amount} to {rental.referrer.email} '
-                            f'for rental by {rental.user.email}'
-                        )
-                    )
-                    
-            except Exception as e:
+            if stats['errors']:
                 self.stdout.write(
-                    self.style.ERROR(
-                        f'Error processing referral reward for rental {rental.unique_id}: {str(e)}'
-                    )
+                    self.style.ERROR(f'{stats["errors"]} rentals could not be settled; see the log')
+                )
+            if workers > 1:
+                rate = stats['completed'] / stats['elapsed'] if stats['elapsed'] else 0
+                self.stdout.write(
+                    f'Worker {index}: {action} {stats["completed"]} in {stats["elapsed"]:.2f}s ({rate:.0f} rows/s)'
                 )
 
-        return reward_count
+        completed_count = sum(stats['completed'] for stats in results)
+        failed_count = sum(len(stats['failed']) + stats['errors'] for stats in results)
+        paid_out = sum((stats['paid_out'] for stats in results), Decimal('0'))
+        rate = completed_count / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Matured rentals: {action} {completed_count} ({paid_out} KES to wallets), '
+                f'{failed_count} failed, in {elapsed:.2f}s ({rate:.0f} rows/s)'
+            )
+        )
+        return completed_count
+
+    def process_referral_rewards(self, chunk_size=DEFAULT_BATCH_SIZE):
+        """Pay outstanding referral rewards, crediting each referrer once per chunk"""
+        stats = process_referral_rewards(chunk_size)
+        if stats['errors']:
+            self.stdout.write(
+                self.style.ERROR(f'{stats["errors"]} referral rewards could not be paid; see the log')
+            )
+        self.stdout.write(f'Referral rewards: paid {stats["paid_out"]} KES for {stats["rewarded"]} rentals')
+        return stats['rewarded']
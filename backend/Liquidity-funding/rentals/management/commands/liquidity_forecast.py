@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rentals.forecast import DEFAULT_HORIZON_DAYS, forecast_obligations
+
+
+class Command(BaseCommand):
+    help = 'Print the daily or weekly cash the platform owes over the coming days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon-days', type=int, default=DEFAULT_HORIZON_DAYS, help='Days to forecast')
+        parser.add_argument('--weekly', action='store_true', help='Print weekly totals instead of daily rows')
+        parser.add_argument('--multiplier', type=float, help='What-if: pay amount * multiplier instead of expected_return')
+        parser.add_argument('--duration-days', type=int, help='What-if: pay every active rental created_at + N days')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        forecast = forecast_obligations(
+            options['horizon_days'],
+            multiplier=options['multiplier'],
+            duration_days=options['duration_days'],
+        )
+        elapsed = time.monotonic() - started
+
+        if options['weekly']:
+            for week in forecast['weekly']:
+                self.stdout.write(f'{week["week_start"]}  {week["total"]:>14,.2f}')
+        else:
+            for day in forecast['daily']:
+                if day['total']:
+                    self.stdout.write(f'{day["date"]}  {day["total"]:>14,.2f}  (cumulative {day["cumulative"]:,.2f})')
+
+        totals = forecast['totals']
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{totals["within_horizon"]:,.2f} KES due within {forecast["horizon_days"]} days '
+                f'(rentals {totals["rentals"]:,.2f}, withdrawals {totals["withdrawals"]:,.2f}, '
+                f'referral rewards {totals["referral_rewards"]:,.2f}); '
+                f'{totals["beyond_horizon"]:,.2f} later. Computed in {elapsed * 1000:.0f} ms'
+            )
+        )
@@ -0,0 +1,42 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from rentals.scheduler import SCHEDULER_LOCK_NAME, MaturityScheduler, advisory_lock
+
+
+class Command(BaseCommand):
+    help = 'Long-running scheduler that settles rentals as soon as they reach their end date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Due rentals settled per transaction')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Longest sleep between checks for new rentals, in seconds')
+        parser.add_argument('--horizon-minutes', type=int, default=60, help='How far ahead end dates are kept in memory')
+        parser.add_argument('--standby-interval', type=float, default=30.0, help='Seconds between lock attempts while another node schedules')
+
+    def handle(self, *args, **options):
+        # The scheduler lock lives on this process's connection, so keep it
+        # open across iterations; only a broken connection is replaced
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = None
+
+        # Only one node schedules at a time; the others stand by and take
+        # over when the lock holder's connection goes away (or it loses the lock)
+        while True:
+            with advisory_lock(SCHEDULER_LOCK_NAME) as acquired:
+                if acquired:
+                    self.stdout.write(self.style.SUCCESS('Acquired the scheduler lock; settling rentals as they mature'))
+                    scheduler = MaturityScheduler(
+                        horizon=timedelta(minutes=options['horizon_minutes']),
+                        batch_size=options['batch_size'],
+                        poll_interval=options['poll_interval'],
+                    )
+                    if scheduler.run(on_settled=self.report, lock_name=SCHEDULER_LOCK_NAME):
+                        return
+            self.stdout.write('Another node holds the scheduler lock; standing by')
+            time.sleep(options['standby_interval'])
+
+    def report(self, completed, failed):
+        self.stdout.write(f'Settled {completed} matured rentals ({failed} lacked locked funds)')
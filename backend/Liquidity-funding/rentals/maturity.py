@@ -0,0 +1,211 @@
+# rentals/maturity.py
+import logging
+import multiprocessing
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.db.models.functions import Mod
+
+from payment.wallets import WalletService
+
+from .models import Rental
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+NEXT_DUE_CACHE_KEY = "rentals:next-due:{user_id}"
+
+
+# ---------------------------#
+# Finding matured rentals
+# ---------------------------#
+def due_rentals(now, shard=None):
+    """
+    Active rentals whose end date has passed. `shard` is (index, count):
+    only rentals whose user_id % count == index, so workers on different
+    shards never touch the same wallet.
+    """
+    rentals = Rental.objects.filter(status="active", is_completed=False, end_date__lte=now)
+    if shard:
+        index, count = shard
+        rentals = rentals.annotate(shard=Mod("user_id", count)).filter(shard=index)
+    return rentals
+
+
+def due_rental_batches(now, batch_size=DEFAULT_BATCH_SIZE, shard=None):
+    """
+    Yield lists of matured rental rows ({"id", "user_id", "amount",
+    "expected_return", "end_date"}), oldest first, keyset-paginated on
+    (end_date, id) so each batch is one bounded index range scan.
+    """
+    last = None
+    while True:
+        rentals = due_rentals(now, shard)
+        if last:
+            rentals = rentals.filter(Q(end_date__gt=last[0]) | Q(end_date=last[0], id__gt=last[1]))
+        rows = list(
+            rentals.order_by("end_date", "id")
+            .values("id", "user_id", "amount", "expected_return", "end_date")[:batch_size]
+        )
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]["end_date"], rows[-1]["id"]
+
+
+# ---------------------------#
+# Settling a batch
+# ---------------------------#
+def _release(row):
+    return row["user_id"], row["amount"], row["expected_return"] - row["amount"], f"rental:{row['id']}"
+
+
+def settle_rental_batch(rental_ids, now):
+    """
+    Complete the given matured rentals in one transaction: one bulk UPDATE
+    claims the rows still active, and one grouped wallet UPDATE moves each
+    user's summed principal and profit to the available balance.
+
+    If some wallet lacks the locked funds, the batch falls back to one
+    unlock per rental and puts the rentals that could not be paid back to
+    active. Returns (completed_rows, failed_ids).
+    """
+    token = uuid.uuid4()
+    with transaction.atomic():
+        # Skip rows another worker or an overlapping run is settling; the
+        # conditional UPDATE below is what guarantees a single payout
+        rental_ids = list(
+            Rental.objects.select_for_update(skip_locked=True)
+            .filter(id__in=rental_ids, status="active", is_completed=False)
+            .values_list("id", flat=True)
+        )
+        if not rental_ids:
+            return [], []
+        claimed = Rental.objects.filter(id__in=rental_ids, status="active", is_completed=False).update(
+            status="completed",
+            is_completed=True,
+            is_claimed=True,
+            completion_date=now,
+            settlement_token=token,
+        )
+        if not claimed:
+            return [], []
+
+        rows = list(Rental.objects.filter(settlement_token=token).order_by("id").values("id", "user_id", "amount", "expected_return"))
+        if WalletService.unlock_many([_release(row) for row in rows]):
+            return rows, []
+
+        failed = []
+        for row in rows:
+            user_id, amount, profit, reference = _release(row)
+            if not WalletService.unlock(user_id, amount, profit=profit, reference=reference):
+                failed.append(row["id"])
+        if failed:
+            logger.warning(f"Rentals {failed} matured but their wallets lack the locked funds")
+            Rental.objects.filter(id__in=failed).update(
+                status="active",
+                is_completed=False,
+                is_claimed=False,
+                completion_date=None,
+                settlement_token=None,
+            )
+    return [row for row in rows if row["id"] not in failed], failed
+
+
+# ---------------------------#
+# Settling on read
+# ---------------------------#
+def settle_user_due_rentals(user, now=None):
+    """
+    Settle a user's matured rentals before their balance or rentals are
+    read, so they never wait for the sweeper. The user's next end date is
+    kept in the "wallets" cache, so until it passes this is a single
+    cache lookup. Safe to race the batch job: both claim rentals with the
+    same status-guarded UPDATE. Returns how many rentals were settled.
+    """
+    user_id = getattr(user, "pk", user)
+    now = now or timezone.now()
+    cache = caches["wallets"]
+    key = NEXT_DUE_CACHE_KEY.format(user_id=user_id)
+    next_due = cache.get(key)
+    if next_due is not None and (next_due == "" or next_due > now):
+        return 0
+
+    due_ids = list(due_rentals(now).filter(user_id=user_id).order_by().values_list("id", flat=True))
+    completed = settle_rental_batch(due_ids, now)[0] if due_ids else []
+
+    # Rentals that could not be paid are left to the sweeper until the entry expires
+    upcoming = (
+        Rental.objects.filter(user_id=user_id, status="active", is_completed=False, end_date__gt=now)
+        .order_by("end_date")
+        .values_list("end_date", flat=True)
+        .first()
+    )
+    if not connection.in_atomic_block:
+        cache.set(key, upcoming or "", getattr(settings, "WALLET_BALANCE_CACHE_TTL", 300))
+    return len(completed)
+
+
+def forget_next_due(user_id):
+    """Drop a user's cached next end date now and when the current transaction commits."""
+    key = NEXT_DUE_CACHE_KEY.format(user_id=user_id)
+    caches["wallets"].delete(key)
+    transaction.on_commit(lambda: caches["wallets"].delete(key))
+
+
+# ---------------------------#
+# Settling everything due
+# ---------------------------#
+def settle_matured_rentals(now, batch_size=DEFAULT_BATCH_SIZE, shard=None, dry_run=False):
+    """
+    Settle every rental (in `shard`, if given) that matured by `now`, one
+    batch per transaction. Returns stats: {"completed", "paid_out",
+    "failed" (rental ids), "errors", "elapsed"}.
+    """
+    started = time.monotonic()
+    stats = {"completed": 0, "paid_out": Decimal("0"), "failed": [], "errors": 0}
+    for batch in due_rental_batches(now, batch_size, shard):
+        if dry_run:
+            stats["completed"] += len(batch)
+            stats["paid_out"] += sum(row["expected_return"] for row in batch)
+            continue
+        try:
+            completed, failed = settle_rental_batch([row["id"] for row in batch], now)
+        except Exception:
+            logger.exception(f"Error completing rentals {batch[0]['id']}..{batch[-1]['id']}")
+            stats["errors"] += len(batch)
+            continue
+        stats["completed"] += len(completed)
+        stats["paid_out"] += sum(row["expected_return"] for row in completed)
+        stats["failed"].extend(failed)
+    stats["elapsed"] = time.monotonic() - started
+    return stats
+
+
+def _settle_shard(args):
+    now, batch_size, shard, dry_run = args
+    try:
+        return settle_matured_rentals(now, batch_size, shard, dry_run)
+    finally:
+        connections.close_all()
+
+
+def settle_matured_rentals_parallel(now, workers, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Run settle_matured_rentals() in `workers` forked processes, one
+    user_id shard each. Returns the per-worker stats in shard order.
+    """
+    # Forked children must open their own database connections
+    connections.close_all()
+    context = multiprocessing.get_context("fork")
+    with context.Pool(workers) as pool:
+        return pool.map(_settle_shard, [(now, batch_size, (index, workers), dry_run) for index in range(workers)])
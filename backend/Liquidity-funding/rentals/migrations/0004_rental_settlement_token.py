@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0003_rental_completion_date_rental_is_claimed_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rental',
+            name='settlement_token',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['status', 'end_date'], name='rentals_ren_status_6a1df2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['settlement_token'], name='rentals_ren_settlem_c0b2c8_idx'),
+        ),
+    ]
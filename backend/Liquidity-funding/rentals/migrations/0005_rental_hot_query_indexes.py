@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0004_rental_settlement_token'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='rental',
+            name='rentals_ren_status_6a1df2_idx',
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['status', 'is_completed', 'end_date'], name='rentals_ren_status_421bdb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['user', 'created_at'], name='rentals_ren_user_id_eb4dbb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['referral_reward_given', 'referrer'], name='rentals_ren_referra_f7034a_idx'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from datetime import timedelta
 import uuid
@@ -43,6 +45,7 @@ class Rental(models.Model):
     is_claimed = models.BooleanField(default=False)  # Whether doubled amount has been added to wallet
     referrer = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL, related_name="referred_rentals")
     referral_reward_given = models.BooleanField(default=False)  # Whether referral reward has been given
+    settlement_token = models.UUIDField(null=True, blank=True, editable=False)  # Set by the maturity batch that completed it
 
     def save(self, *args, **kwargs):
         if not self.end_date:
@@ -56,3 +59,19 @@ class Rental(models.Model):
         ordering = ["-created_at"]
         verbose_name = "Rental"
         verbose_name_plural = "Rentals"
+        indexes = [
+            # Maturity sweeps scan active rentals in (end_date, id) order
+            models.Index(fields=["status", "is_completed", "end_date"]),
+            models.Index(fields=["settlement_token"]),
+            # Per-user rental lists, newest first
+            models.Index(fields=["user", "created_at"]),
+            # Unpaid referral rewards
+            models.Index(fields=["referral_reward_given", "referrer"]),
+        ]
+
+
+@receiver(post_save, sender=Rental)
+def reset_next_due(sender, instance, **kwargs):
+    """A new or changed rental may mature before the user's cached next end date."""
+    from .maturity import forget_next_due
+    forget_next_due(instance.user_id)
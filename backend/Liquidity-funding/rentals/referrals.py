@@ -0,0 +1,147 @@
+# rentals/referrals.py
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+
+from payment.wallets import WalletService
+from Users.models import Referral
+
+from .models import Rental
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+REFERRAL_REWARD_RATE = Decimal("0.50")  # Referrers earn 50% of each referred rental
+
+
+# ---------------------------#
+# Finding unrewarded rentals
+# ---------------------------#
+def unrewarded_rentals():
+    """Rentals with a referrer whose referral reward has not been paid yet."""
+    return Rental.objects.filter(referrer__isnull=False, referral_reward_given=False)
+
+
+def _reward(row):
+    return (row["amount"] * REFERRAL_REWARD_RATE).quantize(Decimal("0.01"))
+
+
+# ---------------------------#
+# Rewarding a chunk
+# ---------------------------#
+def _upsert_referrals(rows):
+    """
+    Mark the (referrer, referred) Referral rows of `rows` as rewarded,
+    creating the missing ones: one SELECT, one bulk_update and one
+    bulk_create. Like the old per-rental loop, a pair's amounts are those
+    of its latest rental.
+    """
+    latest = {}
+    for row in rows:
+        latest[(row["referrer_id"], row["user_id"])] = row
+
+    # An invited user may already have a pending row keyed by email only
+    matches = Q()
+    for row in latest.values():
+        matches |= Q(referrer_id=row["referrer_id"], referred_id=row["user_id"])
+        matches |= Q(referrer_id=row["referrer_id"], referred_email=row["user__email"])
+    existing = {}
+    for referral in Referral.objects.filter(matches).order_by("id"):
+        existing.setdefault((referral.referrer_id, referral.referred_email), referral)
+        if referral.referred_id:
+            existing[(referral.referrer_id, referral.referred_id)] = referral
+
+    to_update, to_create = [], []
+    for (referrer_id, user_id), row in latest.items():
+        referral = existing.get((referrer_id, user_id)) or existing.get((referrer_id, row["user__email"]))
+        if referral is None:
+            to_create.append(Referral(
+                referrer_id=referrer_id,
+                referred_id=user_id,
+                referred_email=row["user__email"],
+                referred_name=row["user__full_name"],
+                reward_given=True,
+                rental_amount=row["amount"],
+                reward_amount=_reward(row),
+                status="completed",
+            ))
+            continue
+        referral.referred_id = referral.referred_id or user_id
+        referral.reward_given = True
+        referral.rental_amount = row["amount"]
+        referral.reward_amount = _reward(row)
+        if referral not in to_update:
+            to_update.append(referral)
+
+    if to_update:
+        Referral.objects.bulk_update(to_update, ["referred", "reward_given", "rental_amount", "reward_amount"])
+    if to_create:
+        Referral.objects.bulk_create(to_create)
+
+
+def reward_referral_chunk(rental_ids):
+    """
+    Pay the referral rewards of the given rentals in one transaction:
+    one bulk UPDATE flags the rentals still unrewarded, one grouped wallet
+    UPDATE credits each referrer their summed rewards (with one ledger
+    entry per rental), and the Referral rows are upserted in bulk.
+    Returns the rewarded rows.
+    """
+    with transaction.atomic():
+        # Rows another run holds are skipped; the flag UPDATE below is what
+        # guarantees a single reward per rental
+        rows = list(
+            unrewarded_rentals()
+            .select_for_update(skip_locked=True, of=("self",))
+            .filter(id__in=rental_ids)
+            .order_by("id")
+            .values("id", "user_id", "referrer_id", "amount", "user__email", "user__full_name")
+        )
+        if not rows:
+            return []
+        flagged = unrewarded_rentals().filter(id__in=[row["id"] for row in rows]).update(referral_reward_given=True)
+        if flagged != len(rows):
+            raise RuntimeError(f"Rentals {rental_ids[0]}..{rental_ids[-1]} were rewarded concurrently")
+
+        credits = [(row["referrer_id"], _reward(row), "referral_reward", f"rental:{row['id']}") for row in rows]
+        if not WalletService.credit_many(credits):
+            # A referrer without a wallet; credit() creates it
+            for user_id, amount, entry_type, reference in credits:
+                WalletService.credit(user_id, amount, entry_type, reference=reference)
+
+        _upsert_referrals(rows)
+    return rows
+
+
+# ---------------------------#
+# Rewarding everything due
+# ---------------------------#
+def process_referral_rewards(chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Pay every outstanding referral reward, `chunk_size` rentals per
+    transaction, walking the unrewarded rentals by id. A run costs a fixed
+    handful of queries per chunk however many rentals or referrers there
+    are. Returns stats: {"rewarded", "paid_out", "errors"}.
+    """
+    stats = {"rewarded": 0, "paid_out": Decimal("0"), "errors": 0}
+    last_id = 0
+    while True:
+        rental_ids = list(
+            unrewarded_rentals().filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size]
+        )
+        if not rental_ids:
+            break
+        last_id = rental_ids[-1]
+        try:
+            rows = reward_referral_chunk(rental_ids)
+        except Exception:
+            logger.exception(f"Error paying referral rewards for rentals {rental_ids[0]}..{rental_ids[-1]}")
+            stats["errors"] += len(rental_ids)
+            continue
+        stats["rewarded"] += len(rows)
+        stats["paid_out"] += sum((_reward(row) for row in rows), Decimal("0"))
+        if len(rental_ids) < chunk_size:
+            break
+    return stats
@@ -0,0 +1,206 @@
+# rentals/scheduler.py
+import heapq
+import logging
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .maturity import settle_rental_batch
+from .models import Rental
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_LOCK_NAME = "rentals.maturity_scheduler"
+
+# Longest sleep after consecutive failed iterations (database down, lost connection)
+MAX_BACKOFF_SECONDS = 300
+
+
+# ---------------------------#
+# Advisory lock
+# ---------------------------#
+def _lock_key(name):
+    return zlib.crc32(name.encode())
+
+
+def try_advisory_lock(name):
+    """
+    Take a database-wide named lock without waiting; returns whether it was
+    acquired. Uses GET_LOCK on MySQL and pg_try_advisory_lock on PostgreSQL;
+    other backends (SQLite in development) always acquire. The lock belongs
+    to this connection and goes away with it.
+    """
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == "mysql":
+            cursor.execute("SELECT GET_LOCK(%s, 0)", [name])
+            return cursor.fetchone()[0] == 1
+        if vendor == "postgresql":
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [_lock_key(name)])
+            return cursor.fetchone()[0]
+    return True
+
+
+def holds_advisory_lock(name):
+    """Whether this connection (which may have reconnected since) still holds the lock."""
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == "mysql":
+            cursor.execute("SELECT COALESCE(IS_USED_LOCK(%s) = CONNECTION_ID(), 0)", [name])
+            return cursor.fetchone()[0] == 1
+        if vendor == "postgresql":
+            # A bigint key below 2**32 is stored as classid 0, objid key, objsubid 1
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()"
+                " AND classid = 0 AND objid = %s::bigint::oid AND objsubid = 1 AND granted)",
+                [_lock_key(name)],
+            )
+            return cursor.fetchone()[0]
+    return True
+
+
+def ensure_advisory_lock(name):
+    """Check the lock is still ours and, if a reconnect dropped it, try to take it back."""
+    return holds_advisory_lock(name) or try_advisory_lock(name)
+
+
+@contextmanager
+def advisory_lock(name):
+    """
+    Try to take a database-wide named lock without waiting (see
+    try_advisory_lock); yields whether it was acquired and releases it on
+    exit.
+    """
+    acquired = try_advisory_lock(name)
+    try:
+        yield acquired
+    finally:
+        vendor = connection.vendor
+        if acquired and vendor in ("mysql", "postgresql"):
+            with connection.cursor() as cursor:
+                if vendor == "mysql":
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", [name])
+                else:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", [_lock_key(name)])
+
+
+# ---------------------------#
+# Maturity scheduler
+# ---------------------------#
+class MaturityScheduler:
+    """
+    Settles rentals at their end_date instead of at the next cron run.
+
+    Keeps a min-heap of (end_date, id) for active rentals maturing within
+    `horizon`. Each refresh only reads rentals created since the last one
+    (id > the highest id seen) and, when the window runs low, the next
+    slice of end dates from the (status, end_date) index, so there is no
+    full-table scan. Due entries are popped and settled in small batches;
+    rentals already settled elsewhere are skipped by the claim UPDATE.
+    """
+
+    def __init__(self, horizon=timedelta(hours=1), batch_size=100, poll_interval=5.0):
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.heap = []
+        self.last_seen_id = 0
+        self.loaded_until = None
+
+    def _push(self, rows):
+        for end_date, rental_id in rows:
+            heapq.heappush(self.heap, (end_date, rental_id))
+
+    def refresh(self, now=None):
+        """Load new rentals and extend the window; returns how many entries were added."""
+        now = now or timezone.now()
+        added = 0
+        active = Rental.objects.filter(status="active", is_completed=False, end_date__isnull=False)
+
+        if self.loaded_until is None:
+            self.last_seen_id = Rental.objects.order_by("-id").values_list("id", flat=True).first() or 0
+            self.loaded_until = now + self.horizon
+            rows = list(active.filter(end_date__lte=self.loaded_until).values_list("end_date", "id"))
+            self._push(rows)
+            return len(rows)
+
+        # Rentals created since the last refresh, read by primary key range
+        new_rows = list(active.filter(id__gt=self.last_seen_id).values_list("end_date", "id"))
+        if new_rows:
+            self.last_seen_id = max(rental_id for _, rental_id in new_rows)
+            due_soon = [row for row in new_rows if row[0] <= self.loaded_until]
+            self._push(due_soon)
+            added += len(due_soon)
+
+        # Slide the window before it runs out
+        if now + self.horizon / 2 >= self.loaded_until:
+            until = now + self.horizon
+            rows = list(
+                active.filter(end_date__gt=self.loaded_until, end_date__lte=until, id__lte=self.last_seen_id)
+                .values_list("end_date", "id")
+            )
+            self._push(rows)
+            self.loaded_until = until
+            added += len(rows)
+        return added
+
+    def seconds_until_next(self, now=None):
+        """How long to sleep: until the next due rental, but no longer than the poll interval."""
+        now = now or timezone.now()
+        if not self.heap:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, (self.heap[0][0] - now).total_seconds()))
+
+    def settle_due(self, now=None):
+        """Pop and settle every rental due by `now`, `batch_size` at a time. Returns (completed, failed) counts."""
+        now = now or timezone.now()
+        completed_count, failed_count = 0, 0
+        while self.heap and self.heap[0][0] <= now:
+            batch = []
+            while self.heap and self.heap[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self.heap)[1])
+            try:
+                completed, failed = settle_rental_batch(batch, now)
+            except Exception:
+                logger.exception(f"Error settling rentals {batch}; they will be retried")
+                for rental_id in batch:
+                    heapq.heappush(self.heap, (now + timedelta(seconds=self.poll_interval), rental_id))
+                break
+            completed_count += len(completed)
+            failed_count += len(failed)
+        return completed_count, failed_count
+
+    def run(self, stop=lambda: False, on_settled=None, lock_name=None):
+        """
+        Refresh, settle and sleep until `stop()` returns True; returns True
+        then. Each iteration drops a broken database connection first. If
+        `lock_name` is given, the lock is checked (and re-taken after a
+        reconnect) before anything is settled; if another node took it
+        meanwhile, returns False. A failing iteration is logged and retried
+        with exponential backoff instead of ending the loop.
+        """
+        failures = 0
+        while not stop():
+            close_old_connections()
+            try:
+                if lock_name and not ensure_advisory_lock(lock_name):
+                    logger.warning(f"Lost the {lock_name} lock to another node; stopping")
+                    return False
+                now = timezone.now()
+                self.refresh(now)
+                completed, failed = self.settle_due(now)
+            except Exception:
+                failures += 1
+                delay = min(self.poll_interval * 2 ** (failures - 1), MAX_BACKOFF_SECONDS)
+                logger.exception(f"Maturity scheduler iteration failed ({failures} in a row); retrying in {delay:.0f}s")
+                time.sleep(delay)
+                continue
+            failures = 0
+            if (completed or failed) and on_settled:
+                on_settled(completed, failed)
+            time.sleep(self.seconds_until_next())
+        return True
@@ -0,0 +1,399 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import OperationalError, connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from Users.models import CustomUser, Referral
+from payment.ledger import rebuild_wallet_balances
+from payment.models import LedgerEntry, Wallet
+from payment.tests import LOCMEM_CACHES
+from payment.wallets import WalletService
+from withdrawal.models import Withdrawal
+from .forecast import forecast_obligations
+from .maturity import settle_matured_rentals, settle_rental_batch
+from .models import Rental
+from .referrals import process_referral_rewards
+from .scheduler import MaturityScheduler
+from .views import AdminActiveRentalsView
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RentalMaturityTests(TestCase):
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create_user(email=f"renter{i}@example.com", full_name=f"Renter {i}", password="Secret123!")
+            for i in range(3)
+        ]
+        self.matured = timezone.now() - timedelta(days=1)
+
+    def rent(self, user, amount, end_date=None):
+        WalletService.deposit_locked(user, amount)
+        return Rental.objects.create(
+            user=user, currency="KES", amount=amount, expected_return=amount * 2, end_date=end_date or self.matured,
+        )
+
+    def test_batches_credit_summed_returns_with_grouped_updates(self):
+        for amount in (Decimal("100"), Decimal("50")):
+            for user in self.users:
+                self.rent(user, amount)
+        pending = self.rent(self.users[0], Decimal("10"), end_date=timezone.now() + timedelta(days=5))
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command("complete_rentals", "--batch-size", "3", stdout=out)
+        wallet_updates = [q for q in queries.captured_queries if q["sql"].startswith('UPDATE "payment_wallet"')]
+        self.assertEqual(len(wallet_updates), 2)
+        self.assertIn("completed 6", out.getvalue())
+
+        self.assertEqual(WalletService.balances(self.users[0]), (300, 10))
+        self.assertEqual(WalletService.balances(self.users[2]), (300, 0))
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="rental_profit").count(), 6)
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, "active")
+        self.assertEqual(Rental.objects.filter(status="completed", is_claimed=True).count(), 6)
+        self.assertEqual(rebuild_wallet_balances(dry_run=True)[1], [])
+
+    def test_unpaid_rental_goes_back_to_active(self):
+        paid = self.rent(self.users[0], Decimal("100"))
+        unpaid = self.rent(self.users[1], Decimal("100"))
+        Wallet.objects.filter(user=self.users[1]).update(rental_balance=0)
+
+        call_command("complete_rentals", stdout=StringIO())
+        paid.refresh_from_db()
+        unpaid.refresh_from_db()
+        self.assertEqual((paid.status, unpaid.status), ("completed", "active"))
+        self.assertIsNone(unpaid.settlement_token)
+        self.assertEqual(WalletService.balances(self.users[0]), (200, 0))
+
+    def test_shards_are_disjoint_and_repeat_claims_never_double_pay(self):
+        rentals = [self.rent(user, Decimal("100")) for user in self.users]
+        now = timezone.now()
+        first = settle_matured_rentals(now, shard=(0, 2))
+        second = settle_matured_rentals(now, shard=(1, 2))
+        self.assertEqual(first["completed"] + second["completed"], 3)
+        self.assertEqual(first["completed"], sum(1 for user in self.users if user.id % 2 == 0))
+
+        self.assertEqual(settle_rental_batch([rental.id for rental in rentals], now), ([], []))
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="rental_unlock").count(), 3)
+        self.assertEqual(WalletService.balances(self.users[0]), (200, 0))
+
+    def test_dry_run_changes_nothing(self):
+        self.rent(self.users[0], Decimal("100"))
+        out = StringIO()
+        call_command("complete_rentals", "--dry-run", stdout=out)
+        self.assertIn("would complete 1 (200.00 KES", out.getvalue())
+        self.assertEqual(Rental.objects.filter(status="active").count(), 1)
+        self.assertEqual(WalletService.balances(self.users[0]), (0, 100))
+
+
+class ReferralRewardTests(TestCase):
+    def setUp(self):
+        self.referrers = [
+            CustomUser.objects.create_user(email=f"referrer{i}@example.com", full_name=f"Referrer {i}", password="Secret123!")
+            for i in range(2)
+        ]
+        self.referred = [
+            CustomUser.objects.create_user(email=f"friend{i}@example.com", full_name=f"Friend {i}", password="Secret123!")
+            for i in range(3)
+        ]
+        # An invite recorded before the friend signed up
+        Referral.objects.create(referrer=self.referrers[0], referred_email="friend0@example.com")
+
+    def rent(self, user, referrer, amount):
+        return Rental.objects.create(user=user, currency="KES", amount=amount, expected_return=amount * 2, referrer=referrer)
+
+    def test_credits_each_referrer_once_per_chunk(self):
+        for amount in (Decimal("100"), Decimal("40")):
+            self.rent(self.referred[0], self.referrers[0], amount)
+            self.rent(self.referred[1], self.referrers[0], amount)
+            self.rent(self.referred[2], self.referrers[1], amount)
+
+        with CaptureQueriesContext(connection) as queries:
+            stats = process_referral_rewards(chunk_size=4)
+        wallet_updates = [q for q in queries.captured_queries if q["sql"].startswith('UPDATE "payment_wallet"')]
+        self.assertEqual(len(wallet_updates), 2)
+        self.assertEqual((stats["rewarded"], stats["paid_out"], stats["errors"]), (6, Decimal("210.00"), 0))
+
+        self.assertEqual(WalletService.balances(self.referrers[0]), (140, 0))
+        self.assertEqual(WalletService.balances(self.referrers[1]), (70, 0))
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="referral_reward").count(), 6)
+        self.assertFalse(Rental.objects.filter(referral_reward_given=False).exists())
+
+        invite = Referral.objects.get(referrer=self.referrers[0], referred_email="friend0@example.com")
+        self.assertEqual((invite.referred, invite.reward_given, invite.reward_amount), (self.referred[0], True, 20))
+        self.assertEqual(Referral.objects.filter(reward_given=True).count(), 3)
+
+        self.assertEqual(process_referral_rewards()["rewarded"], 0)
+        self.assertEqual(WalletService.balances(self.referrers[0]), (140, 0))
+
+    def test_referrer_without_wallet_is_still_credited(self):
+        Wallet.objects.filter(user=self.referrers[1]).delete()
+        self.rent(self.referred[0], self.referrers[0], Decimal("100"))
+        self.rent(self.referred[2], self.referrers[1], Decimal("100"))
+
+        out = StringIO()
+        call_command("complete_rentals", stdout=out)
+        self.assertIn("Processed 2 referral rewards", out.getvalue())
+        self.assertEqual(WalletService.balances(self.referrers[0]), (50, 0))
+        self.assertEqual(WalletService.balances(self.referrers[1]), (50, 0))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MaturitySchedulerTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="renter@example.com", full_name="Renter", password="Secret123!")
+        self.now = timezone.now()
+
+    def rent(self, end_date):
+        WalletService.deposit_locked(self.user, 100)
+        return Rental.objects.create(user=self.user, currency="KES", amount=100, expected_return=200, end_date=end_date)
+
+    def test_settles_rentals_at_their_end_date(self):
+        due = self.rent(self.now - timedelta(seconds=5))
+        soon = self.rent(self.now + timedelta(seconds=30))
+        later = self.rent(self.now + timedelta(days=3))
+
+        scheduler = MaturityScheduler(horizon=timedelta(hours=1), poll_interval=5)
+        self.assertEqual(scheduler.refresh(self.now), 2)
+        self.assertEqual(scheduler.settle_due(self.now), (1, 0))
+        self.assertEqual(scheduler.seconds_until_next(self.now), 5)
+
+        after = self.now + timedelta(seconds=31)
+        self.assertEqual(scheduler.settle_due(after), (1, 0))
+        self.assertEqual(
+            dict(Rental.objects.values_list("id", "status")),
+            {due.id: "completed", soon.id: "completed", later.id: "active"},
+        )
+        self.assertEqual(WalletService.balances(self.user), (400, 100))
+
+    def test_refresh_reads_only_new_rentals(self):
+        scheduler = MaturityScheduler(horizon=timedelta(hours=1))
+        scheduler.refresh(self.now)
+        created = self.rent(self.now + timedelta(minutes=10))
+        with self.assertNumQueries(1):
+            self.assertEqual(scheduler.refresh(self.now), 1)
+        self.assertEqual(scheduler.heap, [(created.end_date, created.id)])
+
+        far = self.now + timedelta(minutes=45)
+        self.rent(self.now + timedelta(minutes=70))
+        self.assertEqual(scheduler.refresh(far), 1)  # Window slid to include the later rental
+
+    def test_run_survives_a_failed_iteration(self):
+        due = self.rent(self.now - timedelta(seconds=5))
+        scheduler = MaturityScheduler(poll_interval=5)
+        refresh = scheduler.refresh
+        calls = []
+
+        def flaky_refresh(now):
+            calls.append(now)
+            if len(calls) == 1:
+                raise OperationalError("Lost connection to MySQL server during query")
+            return refresh(now)
+
+        scheduler.refresh = flaky_refresh
+        # The test case's connection must stay open; each iteration asks to drop a broken one
+        with patch("rentals.scheduler.close_old_connections") as close, patch("rentals.scheduler.time.sleep") as sleep:
+            with self.assertLogs("rentals.scheduler", "ERROR"):
+                self.assertTrue(scheduler.run(stop=lambda: len(calls) >= 2, lock_name="test-lock"))
+        self.assertEqual(close.call_count, 2)
+        sleep.assert_any_call(5)  # Backed off after the failure
+        due.refresh_from_db()
+        self.assertEqual(due.status, "completed")
+
+    def test_run_stops_when_the_lock_is_lost(self):
+        due = self.rent(self.now - timedelta(seconds=5))
+        with patch("rentals.scheduler.ensure_advisory_lock", return_value=False), patch("rentals.scheduler.close_old_connections"):
+            self.assertFalse(MaturityScheduler().run(lock_name="test-lock"))
+        due.refresh_from_db()
+        self.assertEqual(due.status, "active")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LazySettlementTests(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="renter@example.com", full_name="Renter", password="Secret123!")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def rent(self, end_date):
+        WalletService.deposit_locked(self.user, 100)
+        return Rental.objects.create(user=self.user, currency="KES", amount=100, expected_return=200, end_date=end_date)
+
+    def test_balance_read_settles_matured_rentals(self):
+        matured = self.rent(timezone.now() - timedelta(minutes=1))
+        self.rent(timezone.now() + timedelta(days=2))
+
+        response = self.client.get("/api/payments/balance/")
+        self.assertEqual((response.data["available_balance"], response.data["locked_rental_balance"]), (200, 100))
+        matured.refresh_from_db()
+        self.assertEqual(matured.status, "completed")
+
+        # Nothing else is due, so the next read is served from the cache alone
+        with self.assertNumQueries(0):
+            self.client.get("/api/payments/balance/")
+
+        # A batch run afterwards finds nothing left to pay
+        call_command("complete_rentals", stdout=StringIO())
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="rental_unlock").count(), 1)
+
+    def test_new_rental_resets_next_due(self):
+        self.client.get("/api/rentals/user-rentals/")
+        rental = self.rent(timezone.now() + timedelta(days=2))
+        Rental.objects.filter(id=rental.id).update(end_date=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.get("/api/rentals/user-rentals/")
+        self.assertEqual(response.data["rentals"][0]["status"], "completed")
+
+    def test_withdrawal_can_spend_matured_returns(self):
+        self.rent(timezone.now() - timedelta(minutes=1))
+        response = self.client.post("/api/withdraw/", {"mobile_number": "0712345678", "amount": "150"}, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(WalletService.balances(self.user), (50, 0))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserRentalsViewTests(TransactionTestCase):
+    def setUp(self):
+        self.referrer = CustomUser.objects.create_user(email="referrer@example.com", full_name="Referrer", password="Secret123!")
+        self.user = CustomUser.objects.create_user(email="renter@example.com", full_name="Renter", password="Secret123!")
+        now = timezone.now()
+        for i in range(5):
+            Rental.objects.create(
+                user=self.user, currency="KES", amount=100, expected_return=200, referrer=self.referrer,
+                created_at=now - timedelta(hours=i), end_date=now + timedelta(days=i + 1),
+            )
+        Rental.objects.create(user=self.user, currency="KES", amount=50, expected_return=100, status="completed",
+                              is_completed=True, created_at=now - timedelta(days=30), end_date=now - timedelta(days=10))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_without_per_row_queries(self):
+        self.client.get("/api/rentals/user-rentals/")  # Warm the next-due cache
+        with self.assertNumQueries(2):  # Page and summary
+            response = self.client.get("/api/rentals/user-rentals/", {"limit": 4})
+        self.assertEqual(len(response.data["rentals"]), 4)
+        self.assertEqual(response.data["rentals"][0]["referrer"], "referrer@example.com")
+        self.assertEqual(response.data["summary"]["active_rentals"], 5)
+        self.assertEqual(response.data["summary"]["locked_amount"], 500)
+        self.assertEqual(response.data["summary"]["total_returned"], 100)
+
+        with self.assertNumQueries(1):
+            second = self.client.get("/api/rentals/user-rentals/", {"limit": 4, "cursor": response.data["next_cursor"]})
+        self.assertEqual([row["status"] for row in second.data["rentals"]], ["active", "completed"])
+        self.assertIsNone(second.data["next_cursor"])
+        self.assertNotIn("summary", second.data)
+
+    def test_unpaged_request_returns_every_rental(self):
+        now = timezone.now()
+        for i in range(60):
+            Rental.objects.create(user=self.user, currency="KES", amount=10, expected_return=20,
+                                  end_date=now + timedelta(days=30))
+        response = self.client.get("/api/rentals/user-rentals/")
+        self.assertEqual(len(response.data["rentals"]), 66)
+        self.assertIsNone(response.data["next_cursor"])
+        self.assertEqual(response.data["summary"]["total_rentals"], 66)
+
+    def test_status_filter(self):
+        response = self.client.get("/api/rentals/user-rentals/", {"status": "completed"})
+        self.assertEqual([row["amount"] for row in response.data["rentals"]], [50])
+        self.assertEqual(self.client.get("/api/rentals/user-rentals/", {"status": "bogus"}).status_code, 400)
+
+
+class AdminActiveRentalsTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(email="admin@example.com", full_name="Admin", password="Secret123!")
+        self.user = CustomUser.objects.create_user(email="renter@example.com", full_name="Renter One", password="Secret123!")
+        now = timezone.now()
+        for i in range(5):
+            Rental.objects.create(user=self.user, currency="KES", amount=100, expected_return=200, referrer=self.admin,
+                                  created_at=now - timedelta(hours=i), end_date=now + timedelta(days=2 - i))
+        Rental.objects.create(user=self.user, currency="KES", amount=999, expected_return=1998, status="completed", is_completed=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_summary_and_page(self):
+        with self.assertNumQueries(2):  # Summary aggregate and one page
+            response = self.client.get("/api/rentals/admin/active/", {"limit": 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["summary"], {
+            "total_active_rentals": 5, "total_locked_amount": 500.0,
+            "total_expected_returns": 1000.0, "total_mature_rentals": 3,
+        })
+        first = response.data["active_rentals"][0]
+        self.assertEqual((first["user_full_name"], first["referrer"], first["is_mature"]), ("Renter One", "admin@example.com", False))
+        rest = self.client.get("/api/rentals/admin/active/", {"limit": 3, "cursor": response.data["next_cursor"]})
+        self.assertEqual([row["time_remaining"] for row in rest.data["active_rentals"]], ["Mature", "Mature"])
+
+    def test_unpaged_request_returns_every_active_rental(self):
+        end_date = timezone.now() + timedelta(days=30)
+        Rental.objects.bulk_create([
+            Rental(user=self.user, currency="KES", amount=10, expected_return=20, end_date=end_date) for _ in range(60)
+        ])
+        response = self.client.get("/api/rentals/admin/active/")
+        self.assertEqual(len(response.data["active_rentals"]), 65)
+        self.assertIsNone(response.data["next_cursor"])
+        self.assertEqual(len(self.client.get("/api/rentals/admin/active/", {"limit": 50}).data["active_rentals"]), 50)
+
+    def test_ndjson_stream(self):
+        with patch.object(AdminActiveRentalsView, "STREAM_BATCH_SIZE", 2):
+            response = self.client.get("/api/rentals/admin/active/", {"stream": 1})
+            lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(lines[0]["summary"]["total_active_rentals"], 5)
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(len({line["id"] for line in lines[1:]}), 5)
+
+    def test_requires_staff(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get("/api/rentals/admin/active/").status_code, 403)
+
+
+class LiquidityForecastTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(email="admin@example.com", full_name="Admin", password="Secret123!")
+        self.user = CustomUser.objects.create_user(email="renter@example.com", full_name="Renter", password="Secret123!")
+        self.now = timezone.now()
+        for days, amount in ((-1, 100), (2, 100), (2, 50), (9, 10), (90, 1000)):
+            Rental.objects.create(user=self.user, currency="KES", amount=amount, expected_return=amount * 2,
+                                  created_at=self.now - timedelta(days=20), end_date=self.now + timedelta(days=days))
+        Rental.objects.create(user=self.user, currency="KES", amount=40, expected_return=80, referrer=self.admin,
+                              created_at=self.now, end_date=self.now + timedelta(days=20))
+        Withdrawal.objects.create(user=self.user, mobile_number="0712345678", amount=30, status="pending")
+        Withdrawal.objects.create(user=self.user, mobile_number="0712345678", amount=999, status="paid")
+
+    def test_daily_curve(self):
+        with self.assertNumQueries(3):
+            forecast = forecast_obligations(horizon_days=30, now=self.now)
+        daily = forecast["daily"]
+        self.assertEqual(len(daily), 31)
+        self.assertEqual(daily[0]["rentals"], 200)  # Overdue payouts fall due today
+        self.assertEqual((daily[0]["withdrawals"], daily[0]["referral_rewards"]), (30, 20))
+        self.assertEqual(daily[2]["rentals"], 300)
+        self.assertEqual(forecast["totals"]["beyond_horizon"], 2000)
+        self.assertEqual(forecast["totals"]["within_horizon"], 200 + 30 + 20 + 300 + 20 + 80)
+        self.assertEqual(sum(week["total"] for week in forecast["weekly"]), forecast["totals"]["within_horizon"])
+
+    def test_what_if_scenarios(self):
+        forecast = forecast_obligations(horizon_days=30, multiplier=1.5, duration_days=25, now=self.now)
+        # Rentals made 20 days ago now pay out in 5 days, the new one in 25
+        self.assertEqual(forecast["daily"][5]["rentals"], Decimal("1890.00"))
+        self.assertEqual(forecast["daily"][25]["rentals"], Decimal("60.00"))
+        self.assertEqual(forecast["totals"]["beyond_horizon"], 0)
+
+    def test_admin_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get("/api/rentals/admin/forecast/", {"horizon_days": 7, "multiplier": "3"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["daily"][2]["rentals"], Decimal("450.00"))
+        self.assertEqual(client.get("/api/rentals/admin/forecast/", {"horizon_days": "x"}).status_code, 400)
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get("/api/rentals/admin/forecast/").status_code, 403)
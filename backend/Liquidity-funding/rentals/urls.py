@@ -6,7 +6,8 @@ from .views import (
     UserRentalsView, 
     CreateRentalView, 
     RentalStatusView,
-    AdminActiveRentalsView
+    AdminActiveRentalsView,
+    AdminLiquidityForecastView,
 )
 
 app_name = "rentals"
@@ -23,6 +24,9 @@ urlpatterns = [
     
     # Admin: Get all active rentals for monitoring
     path("admin/active/", AdminActiveRentalsView.as_view(), name="admin-active-rentals"),
+
+    # Admin: Upcoming payout obligations, with what-if scenarios
+    path("admin/forecast/", AdminLiquidityForecastView.as_view(), name="admin-liquidity-forecast"),
     
     # Legacy endpoint (keep for compatibility)
     path("pending-returns/", PendingReturnsView.as_view(), name="pending-returns"),
@@ -1,15 +1,22 @@
 
 
+import json
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions, serializers
-from django.db.models import Sum, Q
+from django.db.models import Count, Sum, Q
 from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from datetime import timedelta
 
+from .forecast import DEFAULT_HORIZON_DAYS, forecast_obligations
+from .maturity import settle_user_due_rentals
 from .models import Rental
-from payment.models import Wallet
+from payment.ledger import InsufficientFunds
+from payment.pagination import InvalidPageParameter, is_paged, keyset_page, parse_limit
+from payment.wallets import WalletService
 from Users.models import CustomUser
 
 
@@ -48,26 +55,6 @@ class CreateRentalView(APIView):
 
         try:
             with transaction.atomic():
-                # Get user's wallet
-                wallet = request.user.wallet
-                
-                # Check if user has sufficient available balance
-                if not wallet.can_withdraw(amount):
-                    return Response(
-                        {
-                            "error": f"Insufficient available balance. Available: {wallet.available_balance}, Locked in Rentals: {wallet.locked_rental_balance}"
-                        },
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
-                # Move money from wallet_balance to rental_balance
-                success = wallet.create_rental_payment(amount)
-                if not success:
-                    return Response(
-                        {"error": "Failed to process rental payment"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-
                 # Create rental record
                 expected_return = amount * 2  # Doubled amount
                 end_date = timezone.now() + timedelta(days=duration_days)
@@ -87,6 +74,12 @@ class CreateRentalView(APIView):
                     referrer=referrer
                 )
 
+                # Move money from available balance to rental_balance; the
+                # conditional UPDATE fails if the balance is too low
+                if not WalletService.lock(request.user, amount, reference=f"rental:{rental.id}"):
+                    raise InsufficientFunds()
+
+                available, locked_balance = WalletService.balances(request.user)
                 return Response({
                     "message": "Rental created successfully",
                     "rental": {
@@ -102,12 +95,20 @@ class CreateRentalView(APIView):
                         "referrer": rental.referrer.email if rental.referrer else None
                     },
                     "wallet_balances": {
-                        "available_balance": float(wallet.available_balance),
-                        "locked_rental_balance": float(wallet.locked_rental_balance),
-                        "total_balance": float(wallet.total_balance)
+                        "available_balance": float(available),
+                        "locked_rental_balance": float(locked_balance),
+                        "total_balance": float(available + locked_balance)
                     }
                 }, status=status.HTTP_201_CREATED)
 
+        except InsufficientFunds:
+            available, locked_balance = WalletService.balances(request.user)
+            return Response(
+                {
+                    "error": f"Insufficient available balance. Available: {available}, Locked in Rentals: {locked_balance}"
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {"error": f"Failed to create rental: {str(e)}"},
@@ -130,39 +131,97 @@ class PendingReturnsView(APIView):
         return Response({"pending_returns": float(total_pending_returns)}, status=status.HTTP_200_OK)
 
 
+RENTAL_ROW_FIELDS = (
+    "id", "unique_id", "currency", "amount", "expected_return", "status", "duration_days",
+    "created_at", "end_date", "is_completed", "completion_date", "is_claimed",
+    "referrer__email", "referral_reward_given",
+)
+
+
+def rental_row(row, now):
+    """API representation of a Rental .values() row (RENTAL_ROW_FIELDS), timed against one `now`."""
+    end_date = row["end_date"]
+    return {
+        "id": row["id"],
+        "unique_id": str(row["unique_id"]),
+        "currency": row["currency"],
+        "amount": float(row["amount"]),
+        "expected_return": float(row["expected_return"]),
+        "status": row["status"],
+        "duration_days": row["duration_days"],
+        "created_at": row["created_at"].isoformat(),
+        "end_date": end_date.isoformat() if end_date else None,
+        "is_completed": row["is_completed"],
+        "completion_date": row["completion_date"].isoformat() if row["completion_date"] else None,
+        "is_claimed": row["is_claimed"],
+        "referrer": row["referrer__email"],
+        "referral_reward_given": row["referral_reward_given"],
+        "is_mature": bool(end_date and end_date <= now and not row["is_completed"]),
+        "days_remaining": max(0, (end_date - now).days) if end_date else None,
+    }
+
+
 class UserRentalsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    # ?status= buckets; "matured" rentals have passed their end date but are not paid out yet
+    STATUS_FILTERS = {
+        "active": lambda now: Q(status="active", end_date__gt=now),
+        "matured": lambda now: Q(status="active", end_date__lte=now),
+        "completed": lambda now: Q(status="completed"),
+        "failed": lambda now: Q(status="failed"),
+    }
+
     def get(self, request):
         """
-        Returns all rentals for the authenticated user with full details.
+        The user's rentals, newest first, one keyset page at a time.
+        Query params: ?status=active|matured|completed|failed, ?limit=,
+        ?cursor=<next_cursor>. The first page also carries a summary of
+        all the user's rentals. Without limit or cursor every rental is
+        returned, as the dashboard expects.
         """
-        rentals = Rental.objects.filter(user=request.user).order_by("-created_at")
-        rental_data = []
-        for rental in rentals:
-            # Check if rental is mature and ready for completion
-            is_mature = rental.end_date <= timezone.now() if rental.end_date else False
-            
-            rental_data.append({
-                "id": rental.id,
-                "unique_id": str(rental.unique_id),
-                "currency": rental.currency,
-                "amount": float(rental.amount),
-                "expected_return": float(rental.expected_return),
-                "status": rental.status,
-                "duration_days": rental.duration_days,
-                "created_at": rental.created_at.isoformat(),
-                "end_date": rental.end_date.isoformat() if rental.end_date else None,
-                "is_completed": rental.is_completed,
-                "completion_date": rental.completion_date.isoformat() if rental.completion_date else None,
-                "is_claimed": rental.is_claimed,
-                "referrer": rental.referrer.email if rental.referrer else None,
-                "referral_reward_given": rental.referral_reward_given,
-                "is_mature": is_mature and not rental.is_completed,
-                "days_remaining": max(0, (rental.end_date - timezone.now()).days) if rental.end_date else None
-            })
-
-        return Response({"rentals": rental_data}, status=status.HTTP_200_OK)
+        settle_user_due_rentals(request.user)
+        now = timezone.now()
+        status_filter = request.query_params.get("status")
+        if status_filter and status_filter not in self.STATUS_FILTERS:
+            return Response(
+                {"error": f"status must be one of {', '.join(self.STATUS_FILTERS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rentals = Rental.objects.filter(user=request.user)
+        if status_filter:
+            rentals = rentals.filter(self.STATUS_FILTERS[status_filter](now))
+        cursor = request.query_params.get("cursor")
+        try:
+            rows, next_cursor = keyset_page(
+                rentals.values(*RENTAL_ROW_FIELDS),
+                cursor=cursor,
+                limit=parse_limit(request.query_params.get("limit")) if is_paged(request.query_params) else None,
+            )
+        except InvalidPageParameter as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = {"rentals": [rental_row(row, now) for row in rows], "next_cursor": next_cursor}
+        if not cursor:
+            data["summary"] = self.summary(request.user, now)
+        return Response(data, status=status.HTTP_200_OK)
+
+    def summary(self, user, now):
+        """Counts and totals over all the user's rentals in one aggregate query."""
+        active = Q(status="active")
+        totals = Rental.objects.filter(user=user).aggregate(
+            total_rentals=Count("id"),
+            active_rentals=Count("id", filter=Q(status="active", end_date__gt=now)),
+            matured_rentals=Count("id", filter=Q(status="active", end_date__lte=now)),
+            completed_rentals=Count("id", filter=Q(status="completed")),
+            locked_amount=Sum("amount", filter=active),
+            pending_returns=Sum("expected_return", filter=active),
+            total_returned=Sum("expected_return", filter=Q(status="completed")),
+        )
+        for key in ("locked_amount", "pending_returns", "total_returned"):
+            totals[key] = float(totals[key] or 0)
+        return totals
 
 
 class RentalStatusView(APIView):
@@ -172,46 +231,34 @@ class RentalStatusView(APIView):
         """
         Get detailed status of a specific rental
         """
-        try:
-            rental = Rental.objects.get(id=rental_id, user=request.user)
-        except Rental.DoesNotExist:
+        settle_user_due_rentals(request.user)
+        row = Rental.objects.filter(id=rental_id, user=request.user).values(*RENTAL_ROW_FIELDS).first()
+        if row is None:
             return Response(
                 {"error": "Rental not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Check if rental is mature and ready for completion
-        is_mature = rental.end_date <= timezone.now() if rental.end_date else False
-        
-
-        return Response({
-            "rental": {
-                "id": rental.id,
-                "unique_id": str(rental.unique_id),
-                "currency": rental.currency,
-                "amount": float(rental.amount),
-                "expected_return": float(rental.expected_return),
-                "status": rental.status,
-                "duration_days": rental.duration_days,
-                "created_at": rental.created_at.isoformat(),
-                "end_date": rental.end_date.isoformat() if rental.end_date else None,
-                "is_completed": rental.is_completed,
-                "completion_date": rental.completion_date.isoformat() if rental.completion_date else None,
-                "is_claimed": rental.is_claimed,
-                "referrer": rental.referrer.email if rental.referrer else None,
-                "referral_reward_given": rental.referral_reward_given,
-                "is_mature": is_mature and not rental.is_completed,
-                "days_remaining": max(0, (rental.end_date - timezone.now()).days) if rental.end_date else None
-            }
-        }, status=status.HTTP_200_OK)
+        return Response({"rental": rental_row(row, timezone.now())}, status=status.HTTP_200_OK)
 
 
 class AdminActiveRentalsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    ROW_FIELDS = (
+        "id", "unique_id", "user__email", "user__full_name", "currency", "amount", "expected_return",
+        "status", "duration_days", "created_at", "end_date", "referrer__email", "referral_reward_given",
+    )
+    STREAM_BATCH_SIZE = 1000
+
     def get(self, request):
         """
-        Returns all active rentals for admin monitoring with user details
+        Active rentals for admin monitoring, newest first. The summary is
+        one aggregate query over the whole active book; rows come one
+        keyset page at a time (?limit=, ?cursor=), or with ?stream=1 as
+        NDJSON: a {"summary": ...} line followed by one line per rental,
+        read from the database in bounded batches. Requests without limit
+        or cursor (older dashboards) get every active rental.
         """
         # Check if user is admin/superuser
         if not request.user.is_staff and not request.user.is_superuser:
@@ -220,63 +267,118 @@ class AdminActiveRentalsView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        # Get all active rentals
-        active_rentals = Rental.objects.filter(
-            status="active",
-            is_completed=False
-        ).select_related('user').order_by('-created_at')
+        now = timezone.now()
+        active_rentals = Rental.objects.filter(status="active", is_completed=False)
+        summary = self.summary(active_rentals, now)
+        rows = active_rentals.values(*self.ROW_FIELDS)
 
-        rental_data = []
-        total_locked_amount = 0
-        total_expected_returns = 0
+        if request.query_params.get("stream"):
+            response = StreamingHttpResponse(self.stream(rows, summary, now), content_type="application/x-ndjson")
+            response["Cache-Control"] = "no-cache"
+            return response
 
-        for rental in active_rentals:
-            # Calculate time remaining
-            time_remaining = None
-            is_mature = False
-            
-            if rental.end_date:
-                time_remaining = rental.end_date - timezone.now()
-                is_mature = time_remaining <= timedelta(0) and not rental.is_completed
-                
-                # Format time remaining
-                if time_remaining.total_seconds() > 0:
-                    days = time_remaining.days
-                    hours = time_remaining.seconds // 3600
-                    time_remaining_str = f"{days}d {hours}h"
-                else:
-                    time_remaining_str = "Mature"
-            
-            rental_data.append({
-                "id": rental.id,
-                "unique_id": str(rental.unique_id),
-                "user_email": rental.user.email,
-                "user_full_name": f"{rental.user.first_name} {rental.user.last_name}".strip() or rental.user.username,
-                "currency": rental.currency,
-                "amount": float(rental.amount),
-                "expected_return": float(rental.expected_return),
-                "status": rental.status,
-                "duration_days": rental.duration_days,
-                "created_at": rental.created_at.isoformat(),
-                "end_date": rental.end_date.isoformat() if rental.end_date else None,
-                "time_remaining": time_remaining_str if time_remaining_str else None,
-                "is_mature": is_mature,
-                "days_remaining": max(0, time_remaining.days) if time_remaining and time_remaining.days > 0 else 0,
-                "hours_remaining": max(0, time_remaining.seconds // 3600) if time_remaining and time_remaining.total_seconds() > 0 else 0,
-                "referrer": rental.referrer.email if rental.referrer else None,
-                "referral_reward_given": rental.referral_reward_given
-            })
-            
-            # Add to totals
-            total_locked_amount += float(rental.amount)
-            total_expected_returns += float(rental.expected_return)
+        try:
+            page, next_cursor = keyset_page(
+                rows,
+                cursor=request.query_params.get("cursor"),
+                limit=parse_limit(request.query_params.get("limit")) if is_paged(request.query_params) else None,
+            )
+        except InvalidPageParameter as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
-            "active_rentals": rental_data,
-            "summary": {
-                "total_active_rentals": len(rental_data),
-                "total_locked_amount": total_locked_amount,
-                "total_expected_returns": total_expected_returns,
-                "total_mature_rentals": len([r for r in rental_data if r["is_mature"]])
-            }
+            "active_rentals": [self.row(row, now) for row in page],
+            "next_cursor": next_cursor,
+            "summary": summary,
         }, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def summary(active_rentals, now):
+        totals = active_rentals.aggregate(
+            total_active_rentals=Count("id"),
+            total_locked_amount=Sum("amount"),
+            total_expected_returns=Sum("expected_return"),
+            total_mature_rentals=Count("id", filter=Q(end_date__lte=now)),
+        )
+        totals["total_locked_amount"] = float(totals["total_locked_amount"] or 0)
+        totals["total_expected_returns"] = float(totals["total_expected_returns"] or 0)
+        return totals
+
+    @staticmethod
+    def row(row, now):
+        end_date = row["end_date"]
+        remaining = (end_date - now) if end_date else None
+        is_mature = remaining is not None and remaining <= timedelta(0)
+        if remaining is None:
+            time_remaining = None
+        elif is_mature:
+            time_remaining = "Mature"
+        else:
+            time_remaining = f"{remaining.days}d {remaining.seconds // 3600}h"
+        return {
+            "id": row["id"],
+            "unique_id": str(row["unique_id"]),
+            "user_email": row["user__email"],
+            "user_full_name": row["user__full_name"] or row["user__email"],
+            "currency": row["currency"],
+            "amount": float(row["amount"]),
+            "expected_return": float(row["expected_return"]),
+            "status": row["status"],
+            "duration_days": row["duration_days"],
+            "created_at": row["created_at"].isoformat(),
+            "end_date": end_date.isoformat() if end_date else None,
+            "time_remaining": time_remaining,
+            "is_mature": is_mature,
+            "days_remaining": remaining.days if remaining is not None and not is_mature else 0,
+            "hours_remaining": remaining.seconds // 3600 if remaining is not None and not is_mature else 0,
+            "referrer": row["referrer__email"],
+            "referral_reward_given": row["referral_reward_given"],
+        }
+
+    def stream(self, rows, summary, now):
+        yield json.dumps({"summary": summary}) + "\n"
+        cursor = None
+        while True:
+            page, cursor = keyset_page(rows, cursor=cursor, limit=self.STREAM_BATCH_SIZE)
+            for row in page:
+                yield json.dumps(self.row(row, now)) + "\n"
+            if not cursor:
+                return
+
+
+class AdminLiquidityForecastView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    MAX_HORIZON_DAYS = 365
+
+    def get(self, request):
+        """
+        Daily and weekly payout obligations over the next ?horizon_days=
+        (default 60). What-if: ?multiplier= re-prices active rentals at
+        amount * multiplier, ?duration_days= moves their payout dates.
+        """
+        if not request.user.is_staff and not request.user.is_superuser:
+            return Response(
+                {"error": "Access denied. Admin privileges required."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        params = request.query_params
+        try:
+            horizon_days = int(params.get("horizon_days") or DEFAULT_HORIZON_DAYS)
+            multiplier = float(params["multiplier"]) if params.get("multiplier") else None
+            duration_days = int(params["duration_days"]) if params.get("duration_days") else None
+        except ValueError:
+            return Response(
+                {"error": "horizon_days and duration_days must be integers, multiplier a number"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 1 <= horizon_days <= self.MAX_HORIZON_DAYS or (duration_days is not None and duration_days < 0) \
+                or (multiplier is not None and multiplier < 0):
+            return Response(
+                {"error": f"horizon_days must be 1-{self.MAX_HORIZON_DAYS}; multiplier and duration_days cannot be negative"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        forecast = forecast_obligations(horizon_days, multiplier=multiplier, duration_days=duration_days)
+        return Response(forecast, status=status.HTTP_200_OK)
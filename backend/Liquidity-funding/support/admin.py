@@ -1,3 +1,18 @@
 from django.contrib import admin
+from .models import SystemSettings
 
-# Register your models here.
+
+@admin.register(SystemSettings)
+class SystemSettingsAdmin(admin.ModelAdmin):
+    """
+    Admin configuration for the SystemSettings singleton.
+    Saving through the admin goes through SystemSettings.save(),
+    which invalidates the process-local settings cache.
+    """
+    list_display = ("id", "maintenance_mode", "email_notifications")
+
+    def has_add_permission(self, request):
+        return not SystemSettings.objects.exists()
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -1,7 +1,17 @@
-from django.db import models
+import threading
+import time
+
+from django.conf import settings as django_settings
+from django.db import models, transaction
 from django.utils import timezone
 from Users.models import CustomUser
 
+
+# Process-local cache for the SystemSettings singleton. The version is bumped
+# on every write so a reload that raced with a write is never stored.
+_settings_cache = {"instance": None, "version": 0, "loaded_at": 0.0}
+_settings_cache_lock = threading.Lock()
+
 # -----------------------
 # Support Message Model
 # -----------------------
@@ -48,3 +58,36 @@ class SystemSettings(models.Model):
         """Get or create the singleton settings instance."""
         settings, created = cls.objects.get_or_create(id=1, defaults={'maintenance_mode': False, 'email_notifications': True})
         return settings
+
+    @classmethod
+    def get_cached(cls):
+        """
+        Return the settings singleton from the process-local cache.
+        Reloads from the database only after a write or once
+        SYSTEM_SETTINGS_CACHE_TTL seconds have passed (so other worker
+        processes pick up changes made elsewhere).
+        """
+        ttl = getattr(django_settings, "SYSTEM_SETTINGS_CACHE_TTL", 30)
+        instance = _settings_cache["instance"]
+        if instance is not None and time.monotonic() - _settings_cache["loaded_at"] < ttl:
+            return instance
+
+        version = _settings_cache["version"]
+        instance = cls.get_settings()
+        with _settings_cache_lock:
+            if _settings_cache["version"] == version:
+                _settings_cache["instance"] = instance
+                _settings_cache["loaded_at"] = time.monotonic()
+        return instance
+
+    @classmethod
+    def invalidate_cache(cls):
+        """Drop the cached singleton so the next read goes to the database."""
+        with _settings_cache_lock:
+            _settings_cache["version"] += 1
+            _settings_cache["instance"] = None
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.invalidate_cache()
+        transaction.on_commit(self.invalidate_cache)
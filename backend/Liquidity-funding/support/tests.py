@@ -1,3 +1,79 @@
-from django.test import TestCase
+import threading
+from unittest.mock import patch
 
-# Create your tests here.
+from django.test import TestCase, TransactionTestCase, modify_settings, override_settings
+from rest_framework.test import APIClient
+
+from Users.models import CustomUser
+from .models import SystemSettings
+
+
+class SystemSettingsCacheTests(TransactionTestCase):
+    def setUp(self):
+        SystemSettings.get_settings()
+        SystemSettings.invalidate_cache()
+        self.addCleanup(SystemSettings.invalidate_cache)
+
+    def read_in_thread(self):
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(maintenance_mode=SystemSettings.get_cached().maintenance_mode))
+        thread.start()
+        thread.join()
+        return result["maintenance_mode"]
+
+    def test_reads_are_served_from_memory(self):
+        SystemSettings.get_cached()
+        with self.assertNumQueries(0):
+            SystemSettings.get_cached()
+
+    def test_save_invalidates_every_thread(self):
+        self.assertFalse(self.read_in_thread())
+        settings = SystemSettings.get_settings()
+        settings.maintenance_mode = True
+        settings.save()
+        self.assertTrue(self.read_in_thread())
+        self.assertTrue(SystemSettings.get_cached().maintenance_mode)
+
+    def test_reload_racing_a_write_is_not_cached(self):
+        get_settings = SystemSettings.get_settings
+
+        def load_then_write():
+            stale = get_settings()
+            SystemSettings.objects.filter(id=1).update(maintenance_mode=True)
+            SystemSettings.invalidate_cache()  # The write's version bump lands mid-reload
+            return stale
+
+        with patch.object(SystemSettings, "get_settings", side_effect=load_then_write):
+            self.assertFalse(SystemSettings.get_cached().maintenance_mode)
+        self.assertTrue(SystemSettings.get_cached().maintenance_mode)
+
+    @override_settings(SYSTEM_SETTINGS_CACHE_TTL=0)
+    def test_writes_from_other_processes_show_after_the_ttl(self):
+        SystemSettings.get_cached()
+        # An UPDATE from another process bumps nothing here
+        SystemSettings.objects.filter(id=1).update(maintenance_mode=True)
+        self.assertTrue(SystemSettings.get_cached().maintenance_mode)
+
+
+@modify_settings(MIDDLEWARE={"append": "support.middleware.MaintenanceModeMiddleware"})
+class MaintenanceModeMiddlewareTests(TestCase):
+    def setUp(self):
+        settings = SystemSettings.get_settings()
+        settings.maintenance_mode = True
+        settings.save()
+        SystemSettings.invalidate_cache()
+        self.addCleanup(SystemSettings.invalidate_cache)
+        self.client = APIClient()
+
+    def test_non_staff_requests_get_503(self):
+        response = self.client.get("/api/payments/balance/")
+        self.assertEqual(response.status_code, 503)
+        self.assertContains(response, "under maintenance", status_code=503)
+
+    def test_staff_auth_and_status_requests_pass(self):
+        self.assertEqual(self.client.get("/api/support/maintenance/").data, {"maintenance_mode": True})
+        self.assertNotEqual(self.client.post("/api/auth/login/", {}).status_code, 503)
+
+        admin = CustomUser.objects.create_superuser(email="admin@example.com", full_name="Admin", password="Secret123!")
+        self.client.force_login(admin)
+        self.assertNotEqual(self.client.get("/api/payments/balance/").status_code, 503)
@@ -12,7 +12,7 @@ class MaintenanceStatusView(APIView):
     permission_classes = []
 
     def get(self, request):
-        settings = SystemSettings.get_settings()
+        settings = SystemSettings.get_cached()
         return Response({"maintenance_mode": settings.maintenance_mode}, status=status.HTTP_200_OK)
 
 # ---------------------------#
@@ -1,10 +1,8 @@
 # withdrawal/admin.py
 from django.contrib import admin
-from django.utils import timezone
-from django.core.exceptions import ValidationError
 from django.contrib import messages
 from .models import Withdrawal
-from payment.models import Wallet
+from .transitions import TRANSITIONS, transition_many
 
 
 @admin.register(Withdrawal)
@@ -21,20 +19,30 @@ class WithdrawalAdmin(admin.ModelAdmin):
     list_filter = ("status", "created_at")
     search_fields = ("user__email", "mobile_number")
     ordering = ("-created_at",)
+    # Status only changes through the actions, which also move the money
+    readonly_fields = ("status", "processed_at")
     actions = ["approve_withdrawal", "mark_as_paid", "reject_withdrawal"]
 
+    def _apply(self, request, queryset, action, done_message):
+        """Run a bulk transition over the selection and report the outcome counts."""
+        outcomes = transition_many(queryset.values_list("id", flat=True), action)
+        target = TRANSITIONS[action][1]
+        skipped = [withdrawal_id for withdrawal_id, outcome in outcomes.items() if outcome != target]
+        self.message_user(request, done_message.format(count=len(outcomes) - len(skipped)))
+        if skipped:
+            self.message_user(
+                request,
+                f"{len(skipped)} withdrawal(s) skipped (not in a state for this action): "
+                f"{', '.join(str(withdrawal_id) for withdrawal_id in skipped[:20])}"
+                f"{'...' if len(skipped) > 20 else ''}",
+                level=messages.WARNING,
+            )
+
     # -----------------------
     # ✅ Custom Action - Approve
     # -----------------------
     def approve_withdrawal(self, request, queryset):
-        updated = 0
-        for withdrawal in queryset.filter(status="pending"):
-            try:
-                withdrawal.approve()
-                updated += 1
-            except ValidationError as e:
-                self.message_user(request, f"Error approving withdrawal {withdrawal.id}: {e}", level=messages.ERROR)
-        self.message_user(request, f"{updated} withdrawal(s) approved.")
+        self._apply(request, queryset, "approve", "{count} withdrawal(s) approved.")
 
     approve_withdrawal.short_description = "Approve selected withdrawals"
 
@@ -42,14 +50,7 @@ class WithdrawalAdmin(admin.ModelAdmin):
     # ✅ Custom Action - Mark as Paid
     # -----------------------
     def mark_as_paid(self, request, queryset):
-        updated = 0
-        for withdrawal in queryset.filter(status__in=["pending", "approved", "processing"]):
-            try:
-                withdrawal.mark_as_paid()
-                updated += 1
-            except ValidationError as e:
-                self.message_user(request, f"Error marking withdrawal {withdrawal.id} as paid: {e}", level=messages.ERROR)
-        self.message_user(request, f"{updated} withdrawal(s) marked as Paid.")
+        self._apply(request, queryset, "pay", "{count} withdrawal(s) marked as Paid.")
 
     mark_as_paid.short_description = "Mark selected withdrawals as Paid"
 
@@ -57,17 +58,7 @@ class WithdrawalAdmin(admin.ModelAdmin):
     # ✅ Custom Action - Reject Withdrawal
     # -----------------------
     def reject_withdrawal(self, request, queryset):
-        updated = 0
-        for withdrawal in queryset.filter(status="pending"):
-            try:
-                # Refund wallet on reject
-                wallet = Wallet.objects.get(user=withdrawal.user)
-                wallet.balance += withdrawal.amount
-                wallet.save()
-                withdrawal.reject()
-                updated += 1
-            except (ValidationError, Wallet.DoesNotExist) as e:
-                self.message_user(request, f"Error rejecting withdrawal {withdrawal.id}: {e}", level=messages.ERROR)
-        self.message_user(request, f"{updated} withdrawal(s) Rejected and refunded.")
+        # Refunds are credited with the status change, one wallet UPDATE per chunk
+        self._apply(request, queryset, "reject", "{count} withdrawal(s) Rejected and refunded.")
 
     reject_withdrawal.short_description = "Reject selected withdrawals"
@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from withdrawal.transitions import AGE_BUCKETS, ESCALATION_AGE, escalate_stale_withdrawals
+
+
+class Command(BaseCommand):
+    help = 'Move pending withdrawals older than 48 hours to processing and print the queue age histogram'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=ESCALATION_AGE.total_seconds() / 3600, help='Escalate pending requests older than this')
+        parser.add_argument('--dry-run', action='store_true', help='Count the stale requests without escalating them')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        escalated, histogram = escalate_stale_withdrawals(
+            older_than=timedelta(hours=options['hours']),
+            dry_run=options['dry_run'],
+        )
+        elapsed = time.monotonic() - started
+
+        labels = [label for label, _, _ in AGE_BUCKETS]
+        self.stdout.write(f'{"":<11}' + ''.join(f'{label:>8}' for label in labels))
+        for status, counts in histogram.items():
+            self.stdout.write(f'{status:<11}' + ''.join(f'{counts[label]:>8}' for label in labels))
+
+        action = 'would escalate' if options['dry_run'] else 'escalated'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Pending withdrawals older than {options["hours"]:g}h: {action} {escalated} to processing '
+                f'in {elapsed * 1000:.0f} ms'
+            )
+        )
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('withdrawal', '0002_alter_withdrawal_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['user', 'status'], name='withdrawal__user_id_971a09_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['status', 'created_at'], name='withdrawal__status_cc73c7_idx'),
+        ),
+    ]
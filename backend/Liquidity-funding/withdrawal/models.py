@@ -34,6 +34,10 @@ class Withdrawal(models.Model):
 
     class Meta:
         ordering = ["-created_at"]  # newest first
+        indexes = [
+            models.Index(fields=["user", "status"]),      # "already has a pending request" check
+            models.Index(fields=["status", "created_at"]),  # admin queue, oldest pending
+        ]
 
     # -----------------------
     # Validation
@@ -46,35 +50,34 @@ class Withdrawal(models.Model):
     # -----------------------
     # Admin workflow helpers
     # -----------------------
+    # State changes go through withdrawal.transitions, one conditional
+    # UPDATE each, so concurrent admin actions cannot both apply
+    def _transition(self, action, outcome):
+        from .transitions import TRANSITIONS, transition
+
+        if not transition(self, action):
+            sources = TRANSITIONS[action][0]
+            allowed = " or ".join(filter(None, [", ".join(sources[:-1]), sources[-1]]))
+            raise ValidationError(f"Only {allowed} withdrawals can be {outcome}.")
+
     def approve(self):
         """Admin approves withdrawal."""
-        if self.status != "pending":
-            raise ValidationError("Only pending withdrawals can be approved.")
-        self.status = "approved"
-        self.processed_at = timezone.now()
-        self.save(update_fields=["status", "processed_at"])
+        self._transition("approve", "approved")
 
     def mark_as_paid(self):
         """Admin confirms withdrawal has been paid."""
-        if self.status not in ["approved", "pending", "processing"]:
-            raise ValidationError("Only approved or processing withdrawals can be marked as paid.")
-        self.status = "paid"
-        self.processed_at = timezone.now()
-        self.save(update_fields=["status", "processed_at"])
+        self._transition("pay", "marked as paid")
 
     def reject(self):
-        """Admin rejects withdrawal."""
-        if self.status != "pending":
-            raise ValidationError("Only pending withdrawals can be rejected.")
-        self.status = "rejected"
-        self.processed_at = timezone.now()
-        self.save(update_fields=["status", "processed_at"])
+        """Admin rejects withdrawal and refunds the held amount."""
+        self._transition("reject", "rejected")
 
     def move_to_processing(self):
-        """Move to processing if 48h has passed since request (manual or cronjob trigger)."""
-        if self.status == "pending" and (timezone.now() - self.created_at).total_seconds() >= 172800:
-            self.status = "processing"
-            self.save(update_fields=["status"])
+        """Move to processing if 48h has passed since request; escalate_withdrawals does this in bulk."""
+        from .transitions import ESCALATION_AGE, transition
+
+        if self.status == "pending" and timezone.now() - self.created_at >= ESCALATION_AGE:
+            transition(self, "process")
 
     # -----------------------
     # Display
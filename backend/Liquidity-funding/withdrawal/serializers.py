@@ -2,6 +2,8 @@
 from rest_framework import serializers
 from .models import Withdrawal
 
+MAX_BULK_ACTION_IDS = 1000
+
 
 # ---------------------------
 # Serializer for client withdrawal requests
@@ -64,35 +66,14 @@ class WithdrawalSerializer(serializers.ModelSerializer):
 
 
 # ---------------------------
-# Serializer for admin status updates
+# Serializer for admin bulk actions
 # ---------------------------
-class WithdrawalStatusUpdateSerializer(serializers.ModelSerializer):
-    """Serializer for updating withdrawal status by admin."""
-
-    class Meta:
-        model = Withdrawal
-        fields = ["status"]
+class WithdrawalBulkActionSerializer(serializers.Serializer):
+    """Validates a batch of withdrawal ids and the action to apply to them."""
 
-    def validate_status(self, value):
-        """Ensure status is valid and part of allowed workflow."""
-        valid_statuses = [choice[0] for choice in Withdrawal.STATUS_CHOICES]
-        if value not in valid_statuses:
-            raise serializers.ValidationError("Invalid status.")
-
-        # Optional: enforce workflow transitions
-        instance = self.instance
-        if instance:
-            if instance.status == "pending" and value not in ["approved", "rejected"]:
-                raise serializers.ValidationError(
-                    "Pending withdrawals can only be approved or rejected."
-                )
-            if instance.status == "approved" and value != "paid":
-                raise serializers.ValidationError(
-                    "Approved withdrawals can only be marked as paid."
-                )
-            if instance.status in ["paid", "rejected"]:
-                raise serializers.ValidationError(
-                    "This withdrawal has already been finalized."
-                )
-
-        return value
+    action = serializers.ChoiceField(choices=["approve", "pay", "reject"])
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_ACTION_IDS,
+    )
@@ -1,3 +1,117 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from Users.models import CustomUser
+from payment.ledger import rebuild_wallet_balances
+from payment.models import LedgerEntry
+from payment.wallets import WalletService
+from .models import Withdrawal
+from .transitions import escalate_stale_withdrawals, transition
+
+
+class WithdrawalTransitionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email="payer@example.com", full_name="Payer", password="Secret123!")
+        WalletService.credit(self.user, 1000)
+        self.withdrawal = Withdrawal.objects.create(user=self.user, mobile_number="0712345678", amount=400)
+        WalletService.debit(self.user, 400, reference=f"withdrawal:{self.withdrawal.id}")
+
+    def test_transitions_are_conditional_updates(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(transition(self.withdrawal.id, "approve"))
+        statements = [q["sql"] for q in queries.captured_queries if "withdrawal_withdrawal" in q["sql"]]
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith("UPDATE"))
+
+        self.assertFalse(transition(self.withdrawal.id, "approve"))
+        self.assertFalse(transition(self.withdrawal.id, "reject"))
+        self.assertTrue(transition(self.withdrawal.id, "pay"))
+        self.withdrawal.refresh_from_db()
+        self.assertEqual(self.withdrawal.status, "paid")
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="withdrawal_payout").count(), 1)
+        self.assertEqual(WalletService.balances(self.user), (600, 0))
+
+    def test_stale_instances_cannot_refund_twice(self):
+        first = Withdrawal.objects.get(id=self.withdrawal.id)
+        second = Withdrawal.objects.get(id=self.withdrawal.id)
+        first.reject()
+        with self.assertRaisesMessage(ValidationError, "Only pending or processing withdrawals can be rejected."):
+            second.reject()
+        with self.assertRaisesMessage(ValidationError, "Only pending, approved or processing withdrawals can be marked as paid."):
+            second.mark_as_paid()
+        self.assertEqual(first.status, "rejected")
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="withdrawal_refund").count(), 1)
+        self.assertEqual(WalletService.balances(self.user), (1000, 0))
+
+    def test_bulk_reject_refunds_with_one_wallet_update(self):
+        users = [
+            CustomUser.objects.create_user(email=f"bulk{i}@example.com", full_name=f"Bulk {i}", password="Secret123!")
+            for i in range(3)
+        ]
+        ids = []
+        for user in users:
+            WalletService.credit(user, 100)
+            for amount in (30, 20):
+                withdrawal = Withdrawal.objects.create(user=user, mobile_number="0712345678", amount=amount, status="approved")
+                WalletService.debit(user, amount, reference=f"withdrawal:{withdrawal.id}")
+                ids.append(withdrawal.id)
+        Withdrawal.objects.filter(id=ids[0]).update(status="pending")
+        Withdrawal.objects.filter(id=ids[1]).update(status="paid")
+
+        admin = CustomUser.objects.create_superuser(email="admin@example.com", full_name="Admin", password="Secret123!")
+        client = APIClient()
+        client.force_authenticate(admin)
+        self.assertEqual(client.post("/api/withdraw/bulk/", {"action": "pay", "ids": [ids[2]]}, format="json").data["succeeded"], 1)
+
+        Withdrawal.objects.filter(id__in=ids[3:]).update(status="pending")
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post("/api/withdraw/bulk/", {"action": "reject", "ids": ids + [999999]}, format="json")
+        wallet_updates = [q for q in queries.captured_queries if q["sql"].startswith('UPDATE "payment_wallet"')]
+        self.assertEqual(len(wallet_updates), 1)
+        self.assertEqual((response.data["succeeded"], response.data["failed"]), (4, 3))
+        outcomes = {row["id"]: row["outcome"] for row in response.data["results"]}
+        self.assertEqual(outcomes[ids[1]], "already paid")
+        self.assertEqual(outcomes[ids[2]], "already paid")
+        self.assertEqual(outcomes[999999], "not found")
+        self.assertEqual(outcomes[ids[3]], "rejected")
+
+        self.assertEqual(WalletService.balances(users[0]), (80, 0))
+        self.assertEqual(WalletService.balances(users[1]), (70, 0))
+        self.assertEqual(WalletService.balances(users[2]), (100, 0))
+        self.assertEqual(LedgerEntry.objects.filter(entry_type="withdrawal_payout").count(), 1)
+        self.assertEqual(rebuild_wallet_balances(dry_run=True)[1], [])
+        self.assertEqual(client.post("/api/withdraw/bulk/", {"action": "delete", "ids": ids}, format="json").status_code, 400)
+
+    def test_saving_a_status_moves_no_money(self):
+        self.withdrawal.status = "rejected"
+        self.withdrawal.save()
+        self.assertEqual(WalletService.balances(self.user), (600, 0))
+
+
+class WithdrawalEscalationTests(TestCase):
+    def test_escalates_stale_pending_in_one_update(self):
+        now = timezone.now()
+        for i, hours in enumerate((1, 30, 50, 100, 200)):
+            user = CustomUser.objects.create_user(email=f"queue{i}@example.com", full_name=f"Queue {i}", password="Secret123!")
+            Withdrawal.objects.create(user=user, mobile_number="0712345678", amount=10, created_at=now - timedelta(hours=hours))
+        Withdrawal.objects.filter(created_at__lte=now - timedelta(hours=150)).update(status="approved")
+
+        with self.assertNumQueries(2):
+            escalated, histogram = escalate_stale_withdrawals(now)
+        self.assertEqual(escalated, 2)
+        self.assertEqual(histogram["pending"], {"<24h": 1, "24-48h": 1, "48-72h": 0, "3-7d": 0, ">7d": 0})
+        self.assertEqual(histogram["processing"], {"<24h": 0, "24-48h": 0, "48-72h": 1, "3-7d": 1, ">7d": 0})
 
-# Create your tests here.
+        out = StringIO()
+        call_command("escalate_withdrawals", stdout=out)
+        self.assertIn("escalated 0 to processing", out.getvalue())
+        self.assertEqual(Withdrawal.objects.filter(status="processing").count(), 2)
+        self.assertEqual(Withdrawal.objects.filter(status="approved").count(), 1)
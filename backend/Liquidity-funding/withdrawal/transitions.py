@@ -0,0 +1,193 @@
+# withdrawal/transitions.py
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from payment.ledger import InsufficientFunds
+from payment.wallets import WalletService
+
+from .models import Withdrawal
+
+# action -> (statuses it may start from, resulting status).
+# "processing" is a pending request escalated after 48 hours, so admins
+# can still approve or reject it.
+TRANSITIONS = {
+    "approve": (("pending", "processing"), "approved"),
+    "pay": (("pending", "approved", "processing"), "paid"),
+    "reject": (("pending", "processing"), "rejected"),
+    "process": (("pending",), "processing"),
+}
+
+
+def _refund(user_id, amount, reference):
+    return WalletService.credit(user_id, amount, "withdrawal_refund", reference=reference)
+
+
+def _payout(user_id, amount, reference):
+    return WalletService.payout(user_id, amount, reference=reference)
+
+
+# Wallet posting that goes with an action, in the same transaction
+POSTINGS = {"reject": _refund, "pay": _payout}
+
+BULK_CHUNK_SIZE = 500
+
+# Pending requests older than this are escalated to processing
+ESCALATION_AGE = timedelta(hours=48)
+
+# (label, minimum age, maximum age) buckets for the open-queue histogram
+AGE_BUCKETS = [
+    ("<24h", None, timedelta(hours=24)),
+    ("24-48h", timedelta(hours=24), timedelta(hours=48)),
+    ("48-72h", timedelta(hours=48), timedelta(hours=72)),
+    ("3-7d", timedelta(hours=72), timedelta(days=7)),
+    (">7d", timedelta(days=7), None),
+]
+
+
+def _refund_many(rows):
+    credits = [(row["user_id"], row["amount"], "withdrawal_refund", f"withdrawal:{row['id']}") for row in rows]
+    if not WalletService.credit_many(credits):
+        # A user without a wallet; credit() creates it
+        for user_id, amount, entry_type, reference in credits:
+            WalletService.credit(user_id, amount, entry_type, reference=reference)
+
+
+def _payout_many(rows):
+    WalletService.payout_many([(row["user_id"], row["amount"], f"withdrawal:{row['id']}") for row in rows])
+
+
+BULK_POSTINGS = {"reject": _refund_many, "pay": _payout_many}
+
+
+# ---------------------------#
+# Transitions
+# ---------------------------#
+def transition(withdrawal, action, now=None):
+    """
+    Move a withdrawal (instance or id) through `action` with one
+    `UPDATE ... WHERE id = ? AND status IN (...)`. The matching wallet
+    posting (refund on reject, payout on pay) runs in the same
+    transaction, so of two concurrent clicks only the one whose UPDATE
+    matched moves money. Returns False if the withdrawal was not in a
+    state the action can start from.
+    """
+    withdrawal_id = getattr(withdrawal, "pk", withdrawal)
+    sources, target = TRANSITIONS[action]
+    changes = {"status": target}
+    if action != "process":
+        changes["processed_at"] = now or timezone.now()
+
+    with transaction.atomic():
+        if not Withdrawal.objects.filter(id=withdrawal_id, status__in=sources).update(**changes):
+            return False
+        posting = POSTINGS.get(action)
+        if posting:
+            if isinstance(withdrawal, Withdrawal):
+                user_id, amount = withdrawal.user_id, withdrawal.amount
+            else:
+                user_id, amount = Withdrawal.objects.filter(id=withdrawal_id).values_list("user_id", "amount").get()
+            if not posting(user_id, amount, f"withdrawal:{withdrawal_id}"):
+                raise InsufficientFunds(f"Could not {action} withdrawal {withdrawal_id}")
+
+    if isinstance(withdrawal, Withdrawal):
+        for field, value in changes.items():
+            setattr(withdrawal, field, value)
+    return True
+
+
+# ---------------------------#
+# Bulk transitions
+# ---------------------------#
+def _transition_chunk(withdrawal_ids, action, changes):
+    sources, target = TRANSITIONS[action]
+    with transaction.atomic():
+        # Lock the rows the action applies to, so the UPDATE below changes
+        # exactly these and their postings match
+        rows = list(
+            Withdrawal.objects.select_for_update()
+            .filter(id__in=withdrawal_ids, status__in=sources)
+            .order_by("id")
+            .values("id", "user_id", "amount")
+        )
+        if rows:
+            Withdrawal.objects.filter(id__in=[row["id"] for row in rows]).update(**changes)
+            posting = BULK_POSTINGS.get(action)
+            if posting:
+                posting(rows)
+    return {row["id"] for row in rows}
+
+
+def transition_many(withdrawal_ids, action, now=None):
+    """
+    Apply `action` to many withdrawals with set-based UPDATEs: per chunk,
+    one locking SELECT, one UPDATE and one grouped wallet posting (all
+    refunds of a reject run are credited with a single wallet UPDATE).
+    Returns {id: outcome}, where outcome is the new status, "not found",
+    or "already <status>" for withdrawals the action cannot start from.
+    """
+    _, target = TRANSITIONS[action]
+    changes = {"status": target}
+    if action != "process":
+        changes["processed_at"] = now or timezone.now()
+
+    withdrawal_ids = list(dict.fromkeys(int(withdrawal_id) for withdrawal_id in withdrawal_ids))
+    done = set()
+    for start in range(0, len(withdrawal_ids), BULK_CHUNK_SIZE):
+        done |= _transition_chunk(withdrawal_ids[start:start + BULK_CHUNK_SIZE], action, changes)
+
+    skipped = [withdrawal_id for withdrawal_id in withdrawal_ids if withdrawal_id not in done]
+    current = {}
+    for start in range(0, len(skipped), BULK_CHUNK_SIZE):
+        current.update(Withdrawal.objects.filter(id__in=skipped[start:start + BULK_CHUNK_SIZE]).values_list("id", "status"))
+
+    outcomes = {}
+    for withdrawal_id in withdrawal_ids:
+        if withdrawal_id in done:
+            outcomes[withdrawal_id] = target
+        elif withdrawal_id in current:
+            outcomes[withdrawal_id] = f"already {current[withdrawal_id]}"
+        else:
+            outcomes[withdrawal_id] = "not found"
+    return outcomes
+
+
+# ---------------------------#
+# Escalation
+# ---------------------------#
+def queue_age_histogram(now=None):
+    """
+    {status: {bucket label: count}} for the open queue (pending and
+    processing), counted in one aggregate over the (status, created_at)
+    index.
+    """
+    now = now or timezone.now()
+    aggregates = {}
+    for status in ("pending", "processing"):
+        for label, min_age, max_age in AGE_BUCKETS:
+            bucket = Q(status=status)
+            if min_age is not None:
+                bucket &= Q(created_at__lte=now - min_age)
+            if max_age is not None:
+                bucket &= Q(created_at__gt=now - max_age)
+            aggregates[f"{status}:{label}"] = Count("id", filter=bucket)
+    counts = Withdrawal.objects.filter(status__in=("pending", "processing")).aggregate(**aggregates)
+    return {
+        status: {label: counts[f"{status}:{label}"] for label, _, _ in AGE_BUCKETS}
+        for status in ("pending", "processing")
+    }
+
+
+def escalate_stale_withdrawals(now=None, older_than=ESCALATION_AGE, dry_run=False):
+    """
+    Move every pending withdrawal requested more than `older_than` ago to
+    processing with one UPDATE on the (status, created_at) index; no
+    instances are loaded and no signals fire. Returns (escalated count,
+    queue_age_histogram() after the sweep).
+    """
+    now = now or timezone.now()
+    stale = Withdrawal.objects.filter(status="pending", created_at__lte=now - older_than)
+    escalated = stale.count() if dry_run else stale.update(status="processing")
+    return escalated, queue_age_histogram(now)
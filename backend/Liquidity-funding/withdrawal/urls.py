@@ -9,6 +9,7 @@ from .views import (
     WithdrawalApproveView,
     WithdrawalPaidView,
     WithdrawalRejectView,
+    WithdrawalBulkActionView,
 )
 
 urlpatterns = [
@@ -37,4 +38,6 @@ urlpatterns = [
     # POST   /api/withdraw/paid/<id>/    -> Mark withdrawal as paid
     path("reject/<int:withdrawal_id>/", WithdrawalRejectView.as_view(), name="withdraw-reject"),  
     # POST   /api/withdraw/reject/<id>/  -> Reject & refund withdrawal
+    path("bulk/", WithdrawalBulkActionView.as_view(), name="withdraw-bulk"),  
+    # POST   /api/withdraw/bulk/         -> {"action": "approve"|"pay"|"reject", "ids": [...]}, per-id outcomes
 ]
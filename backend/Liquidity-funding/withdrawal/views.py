@@ -3,13 +3,17 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions, viewsets
 from django.http import JsonResponse
-from django.utils import timezone
+from django.db import transaction
 from .models import Withdrawal
 from .serializers import (
+    WithdrawalBulkActionSerializer,
     WithdrawalCreateSerializer,
     WithdrawalSerializer,
 )
-from payment.models import Wallet
+from .transitions import TRANSITIONS, transition, transition_many
+from payment.ledger import InsufficientFunds
+from payment.wallets import WalletService
+from rentals.maturity import settle_user_due_rentals
 
 
 # -----------------------
@@ -45,26 +49,23 @@ class WithdrawalRequestView(APIView):
                 )
 
 
-            try:
-                wallet = Wallet.objects.get(user=user)
-            except Wallet.DoesNotExist:
-                return Response(
-                    {"error": "Wallet not found."}, status=status.HTTP_404_NOT_FOUND
-                )
+            # Pay out matured rentals first so their returns can be withdrawn
+            settle_user_due_rentals(user)
 
-            # Check available balance only (not rental balance)
-            if not wallet.can_withdraw(amount):
+            # Deduct immediately from available balance (reserve funds);
+            # only the available balance counts, not the rental balance
+            try:
+                with transaction.atomic():
+                    withdrawal = serializer.save(user=user, status="pending")
+                    if not WalletService.debit(user, amount, reference=f"withdrawal:{withdrawal.id}"):
+                        raise InsufficientFunds()
+            except InsufficientFunds:
+                available, locked = WalletService.balances(user)
                 return Response(
-                    {"error": f"Insufficient available balance. Available: {wallet.available_balance}, Locked in Rentals: {wallet.locked_rental_balance}"},
+                    {"error": f"Insufficient available balance. Available: {available}, Locked in Rentals: {locked}"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            # Deduct immediately from available balance (reserve funds)
-            wallet.balance -= amount
-            wallet.save()
-
-            withdrawal = serializer.save(user=user, status="pending")
-
             return Response(
                 {
                     "message": "Withdrawal request submitted. Awaiting admin approval.",
@@ -123,17 +124,11 @@ class WithdrawalApproveView(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def post(self, request, withdrawal_id):
-        try:
-            withdrawal = Withdrawal.objects.get(id=withdrawal_id, status="pending")
-        except Withdrawal.DoesNotExist:
+        if not transition(withdrawal_id, "approve"):
             return Response(
                 {"error": "Withdrawal not found or already processed."},
                 status=status.HTTP_404_NOT_FOUND,
             )
-
-        withdrawal.status = "approved"
-        withdrawal.processed_at = timezone.now()
-        withdrawal.save(update_fields=["status", "processed_at"])
         return Response({"message": "Withdrawal approved."})
 
 
@@ -144,19 +139,11 @@ class WithdrawalPaidView(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def post(self, request, withdrawal_id):
-        try:
-            withdrawal = Withdrawal.objects.get(
-                id=withdrawal_id, status__in=["pending", "approved"]
-            )
-        except Withdrawal.DoesNotExist:
+        if not transition(withdrawal_id, "pay"):
             return Response(
                 {"error": "Withdrawal not found or already processed."},
                 status=status.HTTP_404_NOT_FOUND,
             )
-
-        withdrawal.status = "paid"
-        withdrawal.processed_at = timezone.now()
-        withdrawal.save(update_fields=["status", "processed_at"])
         return Response({"message": "Withdrawal marked as paid."})
 
 
@@ -167,28 +154,44 @@ class WithdrawalRejectView(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def post(self, request, withdrawal_id):
-        try:
-            withdrawal = Withdrawal.objects.get(id=withdrawal_id, status="pending")
-        except Withdrawal.DoesNotExist:
+        # Refunded in the same transaction as the status change
+        if not transition(withdrawal_id, "reject"):
             return Response(
                 {"error": "Withdrawal not found or already processed."},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        # Refund back
-        wallet = Wallet.objects.get(user=withdrawal.user)
-        wallet.balance += withdrawal.amount
-        wallet.save()
-
-        withdrawal.status = "rejected"
-        withdrawal.processed_at = timezone.now()
-        withdrawal.save(update_fields=["status", "processed_at"])
-
         return Response(
             {"message": "Withdrawal rejected. Funds refunded to wallet."}
         )
 
 
+# -----------------------
+# Admin approves, pays or rejects many withdrawals at once
+# -----------------------
+class WithdrawalBulkActionView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        serializer = WithdrawalBulkActionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        action = serializer.validated_data["action"]
+        target = TRANSITIONS[action][1]
+        outcomes = transition_many(serializer.validated_data["ids"], action)
+        succeeded = sum(1 for outcome in outcomes.values() if outcome == target)
+        return Response({
+            "action": action,
+            "succeeded": succeeded,
+            "failed": len(outcomes) - succeeded,
+            "results": [
+                {"id": withdrawal_id, "ok": outcome == target, "outcome": outcome}
+                for withdrawal_id, outcome in outcomes.items()
+            ],
+        })
+
+
 # -----------------------
 # ViewSet for CRUD (not used in frontend but useful for DRF Browsable API)
 # -----------------------